@@ -390,18 +390,18 @@ class NowalletApp(App):
 
     async def do_listen_task(self):
         logging.info("Listening for new transactions.")
-        await self.wallet.listen_to_addresses()
+        try:
+            await self.wallet.listen_to_addresses()
+        except ConnectionError as ce:
+            self.show_dialog("Error", str(ce))
 
     async def do_login_tasks(self, email, passphrase):
-        self.root.ids.wait_text.text = "Connecting.."
-
-        server, port, proto = await nowallet.get_random_server(self.loop)
-        connection = nowallet.Connection(self.loop, server, port, proto)
-        await connection.do_connect()
+        def show_progress(message):
+            self.root.ids.wait_text.text = message
 
-        self.root.ids.wait_text.text = "Deriving Keys.."
-        self.wallet = await self.loop.run_in_executor(None, nowallet.Wallet, email, passphrase,
-            connection, self.loop, self.chain, self.bech32)
+        self.wallet = await nowallet.Wallet.create(
+            email, passphrase, self.loop, self.chain,
+            bech32=self.bech32, progress=show_progress)
 
         self.root.ids.wait_text.text = "Fetching history.."
         await self.wallet.discover_all_keys()
@@ -478,8 +478,7 @@ class NowalletApp(App):
             "Current Address ({}):\n{}".format(encoding, address)
 
     def update_recieve_qrcode(self):
-        address = self.wallet.get_address(
-            self.wallet.get_next_unused_key(), addr=True)
+        address = self.wallet.get_next_unused_address()
         logging.info("Current address: {}".format(address))
         amount = Decimal(self.current_coin) / self.unit_factor
         self.root.ids.addr_qrcode.data = \
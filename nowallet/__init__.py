@@ -7,4 +7,10 @@ from . import socks_http
 from . import scrape
 from . import exchange_rate
 from . import bip49
+from . import keychain
+from . import resume
+from . import txcache
+from . import headers
+from . import servers
+from . import utxoset
 from .nowallet import *
@@ -38,16 +38,6 @@ async def main() -> None:
     chain = nowallet.TBTC
     loop = asyncio.get_event_loop()  # type: asyncio.AbstractEventLoop
 
-    try:
-        t1 = await nowallet.get_random_server(loop)  # type: List[Any]
-        server, port, proto = t1
-        connection = nowallet.Connection(
-            loop, server, port, proto)  # type: nowallet.Connection
-        await connection.do_connect()
-    except (SocksConnectionError, ClientConnectorError):
-        print("Make sure Tor is installed and running before using Nowallet.")
-        sys.exit(1)
-
     email = input("Enter email: ")  # type: str
     passphrase = getpass.getpass("Enter passphrase: ")  # type: str
     confirm = getpass.getpass("Confirm your passphrase: ")  # type: str
@@ -55,8 +45,12 @@ async def main() -> None:
     assert passphrase == confirm, "Passphrase and confirmation did not match"
     assert email and passphrase, "Email and/or passphrase were blank"
 
-    # type: nowallet.Wallet
-    wallet = nowallet.Wallet(email, passphrase, connection, loop, chain)
+    try:
+        wallet = await nowallet.Wallet.create(
+            email, passphrase, loop, chain)  # type: nowallet.Wallet
+    except (SocksConnectionError, ClientConnectorError):
+        print("Make sure Tor is installed and running before using Nowallet.")
+        sys.exit(1)
     await wallet.discover_all_keys()
 
     if len(sys.argv) > 1 and sys.argv[1].lower() == "spend":
@@ -106,6 +100,10 @@ if __name__ == "__main__":
         # number of tasks
         sys.exit(loop.run_until_complete(main()))
 
+    except ConnectionError as err:
+        print("Error: {}".format(err), file=sys.stderr)
+        sys.exit(1)
+
     except KeyboardInterrupt:
         # Optionally show a message if the shutdown may take a while
         print("\nAttempting graceful shutdown, press Ctrl+C again to exit...",
@@ -4,22 +4,59 @@ from Crypto.Hash import SHA256
 from pycoin.tx.pay_to.ScriptPayToAddressWit import ScriptPayToAddressWit
 from pycoin.key.BIP32Node import BIP32Node
 from pycoin.ui import address_for_pay_to_script, standard_tx_out_script
-from pycoin.networks import bech32_hrp_for_netcode
+from pycoin.networks import bech32_hrp_for_netcode, pub32_prefix_for_netcode
 from pycoin.contrib import segwit_addr
 from pycoin.serialize import b2h_rev
-from pycoin.encoding import hash160
+from pycoin.encoding import hash160, a2b_hashed_base58, b2a_hashed_base58
+
+# SLIP-0132 extended public key prefixes: (netcode, is bech32)
+SEGWIT_PUB32_PREFIXES = {
+    bytes.fromhex("049d7cb2"): ("BTC", False),  # ypub
+    bytes.fromhex("04b24746"): ("BTC", True),  # zpub
+    bytes.fromhex("044a5262"): ("XTN", False),  # upub
+    bytes.fromhex("045f1cf6"): ("XTN", True),  # vpub
+}  # type: Dict[bytes, Tuple[str, bool]]
+
+
+def p2wpkh_script_for_hash160(hash160_c: bytes) -> bytes:
+    return ScriptPayToAddressWit(b'\0', hash160_c).script()
+
+
+def bech32_p2wpkh_address_for_script(p2aw_script: bytes, netcode: str) -> str:
+    hrp = bech32_hrp_for_netcode(netcode)
+    witprog_version = 1
+    return segwit_addr.encode(hrp, witprog_version, p2aw_script)
+
+
+def p2sh_p2wpkh_address_for_script(p2aw_script: bytes, netcode: str) -> str:
+    return address_for_pay_to_script(p2aw_script, netcode=netcode)
 
 
 class SegwitBIP32Node(BIP32Node):
+    @classmethod
+    def from_segwit_hwif(cls, b58_str: str) -> Tuple["SegwitBIP32Node", bool]:
+        """ Parses an extended public key, including the SLIP-0132 ypub/zpub
+        style encodings which pycoin does not know about.
+
+        :param b58_str: an xpub, ypub or zpub (or testnet equivalent)
+        :returns: A public SegwitBIP32Node, and whether the prefix says it is
+            bech32 (True), P2SH wrapped (False) or doesn't say (None)
+        """
+        data = a2b_hashed_base58(b58_str)  # type: bytes
+        prefix = SEGWIT_PUB32_PREFIXES.get(data[:4])  # type: Tuple[str, bool]
+        if prefix is None:
+            return cls.from_hwif(b58_str), None
+        netcode, bech32 = prefix
+        data = pub32_prefix_for_netcode(netcode) + data[4:]
+        return cls.from_hwif(b2a_hashed_base58(data)), bech32
+
     def bech32_p2wpkh_address(self) -> str:
-        hrp = bech32_hrp_for_netcode(self.netcode())
-        witprog_version = 1
-        p2aw_script = self.p2wpkh_script()
-        return segwit_addr.encode(hrp, witprog_version, p2aw_script)
+        p2aw_script = self.p2wpkh_script()  # type: bytes
+        return bech32_p2wpkh_address_for_script(p2aw_script, self.netcode())
 
     def p2sh_p2wpkh_address(self) -> str:
         p2aw_script = self.p2wpkh_script()  # type: bytes
-        return address_for_pay_to_script(p2aw_script, netcode=self.netcode())
+        return p2sh_p2wpkh_address_for_script(p2aw_script, self.netcode())
 
     def p2wpkh_script_hash(self) -> bytes:
         p2aw_script = self.p2wpkh_script()  # type: bytes
@@ -35,7 +72,7 @@ class SegwitBIP32Node(BIP32Node):
 
     def p2wpkh_script(self) -> bytes:
         hash160_c = self.hash160(use_uncompressed=False)  # type: bytes
-        return ScriptPayToAddressWit(b'\0', hash160_c).script()
+        return p2wpkh_script_for_hash160(hash160_c)
 
 
 def main():
@@ -0,0 +1,159 @@
+import struct
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Set, Tuple, Iterable, Any
+
+HEADER_SIZE = 80  # type: int
+
+
+def header_timestamp(header: bytes) -> int:
+    """ Returns the timestamp field of a raw block header.
+
+    :param header: an 80 byte block header
+    :returns: the block's timestamp
+    """
+    return struct.unpack_from("<I", header, 68)[0]
+
+
+def header_hash(header: bytes) -> bytes:
+    """ Returns the hash of a raw block header, in internal byte order.
+
+    :param header: an 80 byte block header
+    :returns: the block's double SHA256 hash
+    """
+    return hashlib.sha256(hashlib.sha256(header).digest()).digest()
+
+
+class HeaderCache:
+    """ HeaderCache object. A height keyed cache of raw block headers.
+    Missing heights are fetched in bulk with the ranged headers call,
+    and a height that is already being fetched is never asked for twice,
+    so resolving the timestamps of a long history costs one request per
+    run of nearby heights rather than one per transaction.
+    Headers near the tip are dropped when a reorg is seen.
+    """
+
+    MAX_CHUNK = 2016  # type: int
+    MAX_GAP = 16  # type: int
+    REORG_DEPTH = 6  # type: int
+
+    def __init__(self, connection, loop: asyncio.AbstractEventLoop,
+                 method: str = "blockchain.block.headers") -> None:
+        """ HeaderCache object constructor.
+
+        :param connection: a Connection or ConnectionPool to fetch with
+        :param loop: an asyncio event loop
+        :param method: the Electrum API method for a range of headers
+        :returns: A new, empty HeaderCache object
+        """
+        self.connection = connection
+        self.loop = loop  # type: asyncio.AbstractEventLoop
+        self.method = method  # type: str
+        self.tip = None  # type: int
+        self._headers = {}  # type: Dict[int, bytes]
+        self._inflight = {}  # type: Dict[int, asyncio.Future]
+
+    def __len__(self) -> int:
+        return len(self._headers)
+
+    def __contains__(self, height: int) -> bool:
+        return height in self._headers
+
+    @staticmethod
+    def _runs(heights: List[int]) -> List[Tuple[int, int]]:
+        """ Groups sorted heights into (start, count) ranges, bridging small
+        gaps since a few spare headers are cheaper than another request.
+        """
+        runs = []  # type: List[Tuple[int, int]]
+        for height in heights:
+            if runs:
+                start, count = runs[-1]
+                if height - (start + count) < HeaderCache.MAX_GAP \
+                        and height - start < HeaderCache.MAX_CHUNK:
+                    runs[-1] = (start, height - start + 1)
+                    continue
+            runs.append((height, 1))
+        return runs
+
+    async def _fetch(self, heights: List[int]) -> None:
+        runs = HeaderCache._runs(heights)  # type: List[Tuple[int, int]]
+        results = await self.connection.batch_rpc(
+            [(self.method, [start, count]) for start, count in runs])  # type: List[Dict[str, Any]]
+        for (start, count), result in zip(runs, results):
+            raw = bytes.fromhex(result["hex"])  # type: bytes
+            for i in range(min(result["count"], count)):
+                self._headers[start + i] = raw[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
+        logging.debug("Fetched headers for %s heights in %s requests",
+                      len(heights), len(runs))
+
+        missing = [height for height in heights
+                   if height not in self._headers]  # type: List[int]
+        if missing:
+            raise ValueError("Server sent no headers for heights {}".format(missing))
+
+    def _forget(self, heights: List[int], future: asyncio.Future) -> None:
+        for height in heights:
+            if self._inflight.get(height) is future:
+                del self._inflight[height]
+
+    async def prefetch(self, heights: Iterable[int]) -> None:
+        """ Coroutine. Makes sure the headers for all given heights are cached,
+        fetching every missing one at once, and waiting on any that are
+        already being fetched.
+
+        :param heights: the block heights to fetch headers for
+        """
+        wanted = sorted(set(height for height in heights
+                            if height not in self._headers))  # type: List[int]
+        waiting = set(self._inflight[height] for height in wanted
+                      if height in self._inflight)  # type: Set[asyncio.Future]
+        missing = [height for height in wanted
+                   if height not in self._inflight]  # type: List[int]
+        if missing:
+            future = asyncio.ensure_future(
+                self._fetch(missing), loop=self.loop)  # type: asyncio.Future
+            for height in missing:
+                self._inflight[height] = future
+            future.add_done_callback(lambda _: self._forget(missing, future))
+            waiting.add(future)
+        if waiting:
+            await asyncio.gather(*waiting, loop=self.loop)
+
+    async def get_header(self, height: int) -> bytes:
+        """ Coroutine. Returns the raw header at a given height.
+
+        :param height: the block height
+        :returns: Future, an 80 byte block header
+        """
+        if height not in self._headers:
+            await self.prefetch([height])
+        return self._headers[height]
+
+    async def get_timestamp(self, height: int) -> int:
+        """ Coroutine. Returns the timestamp of the block at a given height.
+
+        :param height: the block height
+        :returns: Future, the block's timestamp
+        """
+        return header_timestamp(await self.get_header(height))
+
+    def set_tip(self, height: int, header: bytes) -> None:
+        """ Records a new chain tip. If it doesn't build on the header we
+        have below it, or doesn't extend the old tip, there was a reorg, and
+        every cached header near the tip is dropped.
+
+        :param height: the new tip's height
+        :param header: the new tip's raw header
+        """
+        parent = self._headers.get(height - 1)  # type: bytes
+        reorg = (self.tip is not None and height <= self.tip
+                 and self._headers.get(height) != header) or \
+            (parent is not None and header[4:36] != header_hash(parent))  # type: bool
+        if reorg:
+            logging.warning("Reorg detected at height %s", height)
+            floor = min(height, self.tip or height) - HeaderCache.REORG_DEPTH  # type: int
+            for cached in [h for h in self._headers if h > floor]:
+                del self._headers[cached]
+        self.tip = height
+        self._headers[height] = header
@@ -0,0 +1,343 @@
+import hmac
+import threading
+import struct
+import hashlib
+import asyncio
+import collections
+import concurrent.futures
+from typing import Dict, List, Tuple, Union, Callable
+
+from Crypto.Hash import SHA256
+from pycoin import ecdsa
+from pycoin.ui import standard_tx_out_script
+from pycoin.serialize import b2h_rev
+from pycoin.encoding import (
+    hash160, from_bytes_32, public_pair_to_sec, sec_to_public_pair
+)
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+from .bip49 import (
+    SegwitBIP32Node, p2wpkh_script_for_hash160,
+    bech32_p2wpkh_address_for_script, p2sh_p2wpkh_address_for_script
+)
+
+_ORDER = ecdsa.generator_secp256k1.order()  # type: int
+
+
+def _coincurve_child_secs(parent_sec: bytes, tweaks: List[bytes]) -> List[bytes]:
+    parent = coincurve.PublicKey(parent_sec)  # type: coincurve.PublicKey
+    return [parent.add(tweak).format(compressed=True) for tweak in tweaks]
+
+
+def _pycoin_child_secs(parent_sec: bytes, tweaks: List[bytes]) -> List[bytes]:
+    generator = ecdsa.generator_secp256k1
+    x, y = sec_to_public_pair(parent_sec)
+    parent = ecdsa.Point(generator.curve(), x, y, _ORDER)
+    return [public_pair_to_sec((from_bytes_32(tweak) * generator + parent).pair())
+            for tweak in tweaks]
+
+
+# Available EC point backends for public child derivation, in order of
+# preference. Every backend must produce identical keys.
+ECBackend = Callable[[bytes, List[bytes]], List[bytes]]
+EC_BACKENDS = collections.OrderedDict()  # type: Dict[str, ECBackend]
+if coincurve is not None:
+    EC_BACKENDS["coincurve"] = _coincurve_child_secs
+EC_BACKENDS["pycoin"] = _pycoin_child_secs
+
+
+def derive_child_secs(parent_sec: bytes, chain_code: bytes, start: int,
+                      count: int, backend: str = None) -> List[bytes]:
+    """ Derives a range of non-hardened child public keys (BIP32 CKDpub).
+    The HMAC key schedule is computed once for the whole range, and the
+    EC additions are done by the fastest available backend.
+
+    :param parent_sec: the parent's compressed public key
+    :param chain_code: the parent's chain code
+    :param start: the first child index to derive
+    :param count: the number of children to derive
+    :param backend: a named key of EC_BACKENDS, or None for the fastest
+    :returns: a list of compressed child public keys
+    """
+    if start < 0 or start + count > 0x80000000:
+        raise ValueError("Child index out of range for public derivation")
+    mac = hmac.new(chain_code, parent_sec, hashlib.sha512)
+    tweaks = []  # type: List[bytes]
+    for i in range(start, start + count):
+        child_mac = mac.copy()
+        child_mac.update(struct.pack(">L", i))
+        tweak = child_mac.digest()[:32]  # type: bytes
+        if from_bytes_32(tweak) >= _ORDER:
+            raise ValueError("Invalid child key at index {}".format(i))
+        tweaks.append(tweak)
+    child_secs = EC_BACKENDS[backend] if backend is not None \
+        else next(iter(EC_BACKENDS.values()))  # type: ECBackend
+    return child_secs(parent_sec, tweaks)
+
+
+def _encode_sec(sec: bytes, netcode: str, bech32: bool) -> Tuple[str, bytes, str]:
+    p2aw_script = p2wpkh_script_for_hash160(hash160(sec))  # type: bytes
+    address = bech32_p2wpkh_address_for_script(p2aw_script, netcode) if bech32 \
+        else p2sh_p2wpkh_address_for_script(p2aw_script, netcode)  # type: str
+    script = standard_tx_out_script(address)  # type: bytes
+    return address, script, b2h_rev(SHA256.new(script).digest())
+
+
+# A compact block of derived keys: the raw 32 byte scripthashes and the
+# scriptPubKeys, each concatenated, and the newline separated addresses.
+CompactKeys = Tuple[bytes, bytes, str]
+
+
+def derive_compact(parent_sec: bytes, chain_code: bytes, netcode: str,
+                   bech32: bool, start: int, count: int,
+                   backend: str = None) -> CompactKeys:
+    """ Derives a range of keys from a chain's public node, and packs their
+    scripthashes, scriptPubKeys and addresses into compact arrays, which
+    are cheap to send back from a worker process.
+
+    :param parent_sec: the chain root's compressed public key
+    :param chain_code: the chain root's chain code
+    :param netcode: the netcode to encode the addresses for
+    :param bech32: a boolean indicating which address encoding to use
+    :param start: the first child index to derive
+    :param count: the number of children to derive
+    :param backend: a named key of EC_BACKENDS, or None for the fastest
+    :returns: a (scripthashes, scripts, addresses) tuple
+    """
+    scripthashes = bytearray()  # type: bytearray
+    scripts = bytearray()  # type: bytearray
+    addresses = []  # type: List[str]
+    for sec in derive_child_secs(parent_sec, chain_code, start, count, backend):
+        address, script, scripthash = _encode_sec(sec, netcode, bech32)
+        scripthashes += bytes.fromhex(scripthash)
+        scripts += script
+        addresses.append(address)
+    return bytes(scripthashes), bytes(scripts), "\n".join(addresses)
+
+
+class DerivedKey:
+    """ DerivedKey object. Holds a derived key's address, scriptPubKey
+    and scripthash, so they only have to be computed once. The key node
+    itself is only derived if it is needed, e.g. for signing.
+    """
+    __slots__ = ("index", "node", "scripthash", "address", "script")
+
+    def __init__(self, index: int, sec: bytes, netcode: str,
+                 bech32: bool = False, node: SegwitBIP32Node = None) -> None:
+        """ DerivedKey object constructor.
+
+        :param index: the index of this key under its chain's root key
+        :param sec: the compressed public key for this index
+        :param netcode: the netcode to encode the address for
+        :param bech32: a boolean indicating which address encoding to use
+        :param node: the SegwitBIP32Node for this index, if already known
+        :returns: A new DerivedKey object
+        """
+        self.index = index  # type: int
+        self.node = node  # type: SegwitBIP32Node
+        self.address, self.script, self.scripthash = _encode_sec(sec, netcode, bech32)
+
+    @classmethod
+    def from_encoded(cls, index: int, address: str,
+                     script: bytes, scripthash: str) -> "DerivedKey":
+        """ Builds a DerivedKey from an already encoded address,
+        scriptPubKey and scripthash, without doing any EC math.
+
+        :returns: A new DerivedKey object
+        """
+        derived = cls.__new__(cls)  # type: DerivedKey
+        derived.index = index
+        derived.node = None
+        derived.address = address
+        derived.script = script
+        derived.scripthash = scripthash
+        return derived
+
+    def __repr__(self) -> str:
+        return "<DerivedKey: index:{} address:{}>".format(self.index, self.address)
+
+
+class KeyChain:
+    """ KeyChain object. A memoized table of the keys derived from one
+    chain root (spend or change). Keys are derived on first use, a range
+    at a time if asked, and kept in a bounded LRU table, so repeated
+    lookups never redo the EC math.
+    A reverse index back to the key index is filled in as keys are
+    derived, and is never evicted, so every key ever derived can still be
+    found. It only holds each key's raw 32 byte scripthash, roughly 100
+    bytes per key, and addresses and scriptPubKeys are turned into a
+    scripthash when searched for, so it stays small next to the table.
+    A KeyChain may be filled from a worker thread while it is being read.
+    """
+
+    def __init__(self, root_key: SegwitBIP32Node, bech32: bool = False,
+                 max_size: int = None, ec_backend: str = None) -> None:
+        """ KeyChain object constructor.
+
+        :param root_key: the chain root key that all indicies derive from
+        :param bech32: a boolean indicating which address encoding to use
+        :param max_size: the maximum number of keys to hold in memory,
+            or None for no limit
+        :param ec_backend: a named key of EC_BACKENDS, or None for the fastest
+        :returns: A new, empty KeyChain object
+        """
+        self.root_key = root_key  # type: SegwitBIP32Node
+        self.bech32 = bech32  # type: bool
+        self.max_size = max_size  # type: int
+        self.ec_backend = ec_backend  # type: str
+        self._root_sec = root_key.sec(use_uncompressed=False)  # type: bytes
+        self._keys = collections.OrderedDict()  # type: Dict[int, DerivedKey]
+        self._indexes = {}  # type: Dict[bytes, int]
+        self._lock = threading.RLock()  # type: threading.RLock
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._keys
+
+    def _add(self, derived: DerivedKey) -> None:
+        self._keys[derived.index] = derived
+        self._indexes[bytes.fromhex(derived.scripthash)[::-1]] = derived.index
+        if self.max_size is not None and len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def derive_range(self, start: int, count: int) -> List[DerivedKey]:
+        """ Returns the DerivedKeys for a range of indicies, deriving every
+        missing one in a single batch. The EC math is done without holding
+        the lock, so readers on other threads are never held up by it.
+
+        :param start: the first index of the range
+        :param count: the number of indicies in the range
+        :returns: a list of DerivedKeys, in index order
+        """
+        derived_keys = {}  # type: Dict[int, DerivedKey]
+        with self._lock:
+            for i in range(start, start + count):
+                derived = self._keys.get(i)  # type: DerivedKey
+                if derived is not None:
+                    self._keys.move_to_end(i)
+                    derived_keys[i] = derived
+
+        missing = [i for i in range(start, start + count)
+                   if i not in derived_keys]  # type: List[int]
+        if missing:
+            first = missing[0]  # type: int
+            secs = derive_child_secs(
+                self._root_sec, self.root_key.chain_code(),
+                first, missing[-1] - first + 1, self.ec_backend)  # type: List[bytes]
+            netcode = self.root_key.netcode()  # type: str
+            new_keys = [DerivedKey(i, secs[i - first], netcode, self.bech32)
+                        for i in missing]  # type: List[DerivedKey]
+            with self._lock:
+                for derived in new_keys:
+                    # Another thread may have derived the same key meanwhile
+                    existing = self._keys.get(derived.index)  # type: DerivedKey
+                    if existing is not None:
+                        derived = existing
+                    else:
+                        self._add(derived)
+                    derived_keys[derived.index] = derived
+        return [derived_keys[i] for i in range(start, start + count)]
+
+    def load_compact(self, start: int, compact: CompactKeys) -> None:
+        """ Loads a compact block of keys, as returned by derive_compact(),
+        into the table and the reverse index.
+
+        :param start: the index of the first key in the block
+        :param compact: a (scripthashes, scripts, addresses) tuple
+        """
+        scripthashes, scripts, addresses = compact
+        address_list = addresses.split("\n")  # type: List[str]
+        script_len = len(scripts) // len(address_list)  # type: int
+        with self._lock:
+            for i, address in enumerate(address_list):
+                scripthash = scripthashes[i * 32:(i + 1) * 32]  # type: bytes
+                script = scripts[i * script_len:(i + 1) * script_len]  # type: bytes
+                self._add(DerivedKey.from_encoded(
+                    start + i, address, script, scripthash.hex()))
+
+    async def derive_parallel(self, start: int, count: int,
+                              loop: asyncio.AbstractEventLoop,
+                              executor: concurrent.futures.Executor = None,
+                              chunk_size: int = 2000) -> None:
+        """ Coroutine. Derives a large range of keys by splitting it into
+        chunks across a process pool, then loads them into the table.
+
+        :param start: the first index of the range
+        :param count: the number of indicies in the range
+        :param loop: an asyncio event loop
+        :param executor: a ProcessPoolExecutor to derive with, a new one is
+            created and shut down if None
+        :param chunk_size: the number of indicies each job derives
+        """
+        own_executor = executor is None  # type: bool
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor()
+        parent_sec = self._root_sec  # type: bytes
+        chain_code = self.root_key.chain_code()  # type: bytes
+        netcode = self.root_key.netcode()  # type: str
+        chunks = [(i, min(chunk_size, start + count - i))
+                  for i in range(start, start + count, chunk_size)]  # type: List[Tuple[int, int]]
+        try:
+            results = await asyncio.gather(*[
+                loop.run_in_executor(
+                    executor, derive_compact, parent_sec, chain_code, netcode,
+                    self.bech32, chunk_start, chunk_count, self.ec_backend)
+                for chunk_start, chunk_count in chunks
+            ], loop=loop)  # type: List[CompactKeys]
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
+        for (chunk_start, _), compact in zip(chunks, results):
+            self.load_compact(chunk_start, compact)
+
+    def get(self, index: int) -> DerivedKey:
+        """ Returns the DerivedKey for a given index, deriving it only
+        if it is not already in the table.
+
+        :param index: the index of the desired key
+        :returns: a DerivedKey associated with the given index
+        """
+        with self._lock:
+            derived = self._keys.get(index)  # type: DerivedKey
+            if derived is not None:
+                self._keys.move_to_end(index)
+                return derived
+        return self.derive_range(index, 1)[0]
+
+    def get_node(self, index: int) -> SegwitBIP32Node:
+        """ Returns the key node for a given index, deriving it only
+        if it is not already in the table.
+
+        :param index: the index of the desired key
+        :returns: a SegwitBIP32Node associated with the given index
+        """
+        derived = self.get(index)  # type: DerivedKey
+        if derived.node is None:
+            derived.node = self.root_key.subkey(index)
+        return derived.node
+
+    def find(self, search: Union[str, bytes]) -> int:
+        """ Returns the index associated with a given scripthash, address
+        or scriptPubKey if it has been derived, otherwise returns None.
+
+        :param search: a scripthash, address or scriptPubKey to search for
+        :returns: a key index associated with the given search term.
+        """
+        if isinstance(search, bytes):
+            return self._indexes.get(SHA256.new(search).digest())
+        if len(search) == 64:
+            try:
+                return self._indexes.get(bytes.fromhex(search)[::-1])
+            except ValueError:
+                pass
+        try:
+            script = standard_tx_out_script(search)  # type: bytes
+        except Exception:
+            return None
+        return self._indexes.get(SHA256.new(script).digest())
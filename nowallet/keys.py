@@ -1,47 +1,128 @@
-from typing import Union, Tuple
-
-from Crypto.Hash import SHA256
-import scrypt
-import pbkdf2
+import sys
+import time
+import hashlib
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+from typing import Union, Tuple, Dict, Callable
+
+try:
+    import scrypt
+except ImportError:
+    scrypt = None
+
+try:
+    import pbkdf2
+    from Crypto.Hash import SHA256
+except ImportError:
+    pbkdf2 = None
+
+SCRYPT_N = 1 << 18  # type: int
+SCRYPT_R = 8  # type: int
+PBKDF2_ROUNDS = 1 << 16  # type: int
+
+_HIGH_NIBBLES = bytes(byte & 0xF0 for byte in range(256))  # type: bytes
+_LOW_NIBBLES = bytes(byte & 0x0F for byte in range(256))  # type: bytes
 
 
 def and_split(bytes_: bytes) -> Tuple[bytes, bytes]:
-    ba1 = bytearray()  # type: bytearray
-    ba2 = bytearray()  # type: bytearray
-
-    for byte in bytes_:
-        ba1.append(byte & 0xF0)
-        ba2.append(byte & 0x0F)
-    return (bytes(ba1), bytes(ba2))
+    return (bytes_.translate(_HIGH_NIBBLES), bytes_.translate(_LOW_NIBBLES))
 
 
 def xor_merge(bytes1: bytes, bytes2: bytes) -> bytes:
     if len(bytes1) != len(bytes2):
         raise ValueError("Length mismatch")
 
-    byte_array = bytearray()  # type: bytearray
-    for i in range(len(bytes1)):
-        byte_array.append(bytes1[i] ^ bytes2[i])
-    return bytes(byte_array)
+    merged = int.from_bytes(bytes1, "big") ^ int.from_bytes(bytes2, "big")  # type: int
+    return merged.to_bytes(len(bytes1), "big")
 
 
-def derive_key(salt: str, passphrase: str, hd: bool = True) -> \
-        Union[int, Tuple[int, bytes]]:
-    key_length = 64 if hd else 32  # type: int
+def _hashlib_scrypt(password: bytes, salt: bytes, key_length: int,
+                    n: int = SCRYPT_N, r: int = SCRYPT_R) -> bytes:
+    return hashlib.scrypt(
+        password, salt=salt,
+        n=n, r=r, p=1,
+        maxmem=256 * r * n, dklen=key_length)
+
+
+def _scrypt_scrypt(password: bytes, salt: bytes, key_length: int,
+                   n: int = SCRYPT_N, r: int = SCRYPT_R) -> bytes:
+    return scrypt.hash(
+        password, salt,
+        N=n, r=r, p=1, buflen=key_length)
+
+
+def _hashlib_pbkdf2(password: bytes, salt: bytes, key_length: int) -> bytes:
+    return hashlib.pbkdf2_hmac(
+        "sha256", password, salt, PBKDF2_ROUNDS, dklen=key_length)
+
+
+def _pbkdf2_pbkdf2(password: bytes, salt: bytes, key_length: int) -> bytes:
+    return pbkdf2.PBKDF2(
+        password, salt,
+        iterations=PBKDF2_ROUNDS,
+        digestmodule=SHA256).read(key_length)
+
+
+# Available KDF backends in order of preference, fastest first.
+# Every backend must produce identical keys.
+KDFBackend = Callable[..., bytes]
+SCRYPT_BACKENDS = collections.OrderedDict()  # type: Dict[str, KDFBackend]
+if hasattr(hashlib, "scrypt"):
+    SCRYPT_BACKENDS["hashlib"] = _hashlib_scrypt
+if scrypt is not None:
+    SCRYPT_BACKENDS["scrypt"] = _scrypt_scrypt
+
+PBKDF2_BACKENDS = collections.OrderedDict()  # type: Dict[str, KDFBackend]
+PBKDF2_BACKENDS["hashlib"] = _hashlib_pbkdf2
+if pbkdf2 is not None:
+    PBKDF2_BACKENDS["pbkdf2"] = _pbkdf2_pbkdf2
+
+
+def _get_backend(backends: Dict[str, KDFBackend], name: str = None) -> KDFBackend:
+    if not backends:
+        raise RuntimeError("No KDF backend is available")
+    if name is None:
+        return next(iter(backends.values()))
+    if name not in backends:
+        raise ValueError("Unknown or unavailable KDF backend: {}".format(name))
+    return backends[name]
 
-    t1 = and_split(bytes(salt, "utf-8"))  # type: Tuple[bytes, bytes]
-    salt1, salt2 = t1
-    t2 = and_split(bytes(passphrase, "utf-8"))  # type: Tuple[bytes, bytes]
-    pass1, pass2 = t2
 
-    scrypt_key = scrypt.hash(
-        pass1, salt1,
-        N=1 << 18, buflen=key_length)  # type: bytes
-    pbkdf2_key = pbkdf2.PBKDF2(
-        pass2, salt2,
-        iterations=1 << 16,
-        digestmodule=SHA256).read(key_length)  # type: bytes
-    merged = xor_merge(scrypt_key, pbkdf2_key)  # type: bytes
+def scrypt_key(password: bytes, salt: bytes, key_length: int,
+               n: int = SCRYPT_N, r: int = SCRYPT_R, backend: str = None) -> bytes:
+    """ Stretches a password with scrypt, using the fastest available
+    backend if None is named.
+
+    :param password: the password to stretch
+    :param salt: the salt to stretch it with
+    :param key_length: the length of the key to return
+    :param n: the scrypt CPU/memory cost, a power of two
+    :param r: the scrypt block size
+    :param backend: a named key of SCRYPT_BACKENDS, or None for the fastest
+    :returns: the stretched key
+    """
+    return _get_backend(SCRYPT_BACKENDS, backend)(password, salt, key_length, n, r)
+
+
+def _scrypt_half(salt: str, passphrase: str, key_length: int,
+                 backend: str = None) -> bytes:
+    salt1 = and_split(bytes(salt, "utf-8"))[0]  # type: bytes
+    pass1 = and_split(bytes(passphrase, "utf-8"))[0]  # type: bytes
+    return _get_backend(SCRYPT_BACKENDS, backend)(pass1, salt1, key_length)
+
+
+def _pbkdf2_half(salt: str, passphrase: str, key_length: int,
+                 backend: str = None) -> bytes:
+    salt2 = and_split(bytes(salt, "utf-8"))[1]  # type: bytes
+    pass2 = and_split(bytes(passphrase, "utf-8"))[1]  # type: bytes
+    return _get_backend(PBKDF2_BACKENDS, backend)(pass2, salt2, key_length)
+
+
+def _merge_halves(s_key: bytes, p_key: bytes, hd: bool) -> \
+        Union[int, Tuple[int, bytes]]:
+    merged = xor_merge(s_key, p_key)  # type: bytes
 
     if hd:
         secret_exp = int(merged[0:32].hex(), 16)  # type: int
@@ -51,7 +132,88 @@ def derive_key(salt: str, passphrase: str, hd: bool = True) -> \
     return int(merged.hex(), 16)
 
 
+def derive_key(salt: str, passphrase: str, hd: bool = True,
+               parallel: bool = False, scrypt_backend: str = None,
+               pbkdf2_backend: str = None) -> Union[int, Tuple[int, bytes]]:
+    """ Stretches a salt and passphrase with the Warpwallet technique.
+    The scrypt half (high nibbles) and PBKDF2 half (low nibbles) are
+    independent until they are merged, so with parallel=True the scrypt
+    half runs in a second process while this one does the PBKDF2 half.
+    Backends are named keys of SCRYPT_BACKENDS and PBKDF2_BACKENDS, the
+    fastest available one is used if None.
+    """
+    key_length = 64 if hd else 32  # type: int
+
+    if not parallel:
+        s_key = _scrypt_half(
+            salt, passphrase, key_length, scrypt_backend)  # type: bytes
+        p_key = _pbkdf2_half(
+            salt, passphrase, key_length, pbkdf2_backend)  # type: bytes
+        return _merge_halves(s_key, p_key, hd)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(
+            _scrypt_half, salt, passphrase,
+            key_length, scrypt_backend)  # type: concurrent.futures.Future
+        p_key = _pbkdf2_half(salt, passphrase, key_length, pbkdf2_backend)
+        s_key = future.result()
+    return _merge_halves(s_key, p_key, hd)
+
+
+async def derive_key_async(salt: str, passphrase: str,
+                           loop: asyncio.AbstractEventLoop,
+                           executor: concurrent.futures.Executor,
+                           hd: bool = True, scrypt_backend: str = None,
+                           pbkdf2_backend: str = None) -> Union[int, Tuple[int, bytes]]:
+    """ Coroutine. Same as derive_key(), but runs both halves in the given
+    executor at once. Give it at least two workers to use two cores.
+    """
+    key_length = 64 if hd else 32  # type: int
+    s_key, p_key = await asyncio.gather(
+        loop.run_in_executor(executor, _scrypt_half, salt, passphrase,
+                             key_length, scrypt_backend),
+        loop.run_in_executor(executor, _pbkdf2_half, salt, passphrase,
+                             key_length, pbkdf2_backend),
+        loop=loop)
+    return _merge_halves(s_key, p_key, hd)
+
+
+def _time_call(func: Callable, *args, repeat: int = 1) -> float:
+    start_time = time.perf_counter()  # type: float
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start_time) / repeat
+
+
+def bench() -> None:
+    """ Times every KDF backend and the split/merge helpers on this machine. """
+    password, salt = b"CORRECT HORSE BATTERY STAPLE", b"test"
+    key_length = 64  # type: int
+
+    print("{:<24}{:>12}".format("Stage", "Seconds"))
+    for name, backend in SCRYPT_BACKENDS.items():
+        seconds = _time_call(backend, password, salt, key_length)  # type: float
+        print("{:<24}{:>12.4f}".format("scrypt/" + name, seconds))
+    for name, backend in PBKDF2_BACKENDS.items():
+        seconds = _time_call(backend, password, salt, key_length)
+        print("{:<24}{:>12.4f}".format("pbkdf2/" + name, seconds))
+
+    split_key = bytes(range(key_length))  # type: bytes
+    seconds = _time_call(and_split, split_key, repeat=10000)
+    print("{:<24}{:>12.8f}".format("and_split", seconds))
+    seconds = _time_call(xor_merge, split_key, split_key, repeat=10000)
+    print("{:<24}{:>12.8f}".format("xor_merge", seconds))
+
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", help="Time each KDF stage and backend.",
+                        action="store_true")
+    args = parser.parse_args()
+    if args.bench:
+        bench()
+        sys.exit(0)
+
     email = input("Enter email: ")  # type: str
     passphrase = input("Enter passphrase: ")  # type: str
     t = derive_key(email, passphrase)  # type: Tuple[int, bytes]
@@ -17,20 +17,24 @@ logging.basicConfig(level=logging.DEBUG, handlers=[stdout_hdlr, file_hdlr])
 
 import asyncio
 import io
+import heapq
+import hashlib
+import itertools
 import random
 import collections
 import pprint
 import time
 import json
+import concurrent.futures
 from decimal import Decimal
 from functools import wraps
 from urllib import parse
 from typing import (
     Tuple, List, Set, Dict, KeysView, Any,
-    Union, Callable, Awaitable
+    Union, Callable, Awaitable, Deque, Iterable, Iterator
 )
 
-from pycoin.serialize import b2h
+from pycoin.serialize import b2h, b2h_rev
 from pycoin.ui import standard_tx_out_script
 from pycoin.tx.tx_utils import distribute_from_split_pool, sign_tx
 from pycoin.tx.Tx import Tx
@@ -41,30 +45,243 @@ from connectrum.client import StratumClient
 from connectrum.svr_info import ServerInfo
 
 from .bip49 import SegwitBIP32Node
-from .keys import derive_key
+from .keychain import KeyChain, DerivedKey
+from .keys import derive_key, derive_key_async
+from .resume import ResumeCache
+from .txcache import TxCache, is_txid
+from .headers import HeaderCache
+from .utxoset import UtxoSet
+from .servers import ServerScores
 from .socks_http import urlopen
 
 
+# Request priority classes, most urgent first
+PRIORITY_INTERACTIVE = 0  # type: int
+PRIORITY_BROADCAST = 1  # type: int
+PRIORITY_BACKGROUND = 2  # type: int
+
+
+class RequestScheduler:
+    """ RequestScheduler object. Limits how many requests may be in flight
+    to one server at a time. Callers beyond that window wait, which applies
+    backpressure to bulk producers, and are let through most urgent
+    priority class first, in arrival order within a class.
+    """
+
+    def __init__(self, window: int, loop: asyncio.AbstractEventLoop = None) -> None:
+        """ RequestScheduler object constructor.
+
+        :param window: the most requests to have in flight at once
+        :param loop: an asyncio event loop
+        :returns: A new RequestScheduler object
+        """
+        self.window = window  # type: int
+        self.loop = loop or asyncio.get_event_loop()  # type: asyncio.AbstractEventLoop
+        self.active = 0  # type: int
+        self._waiters = []  # type: List[Tuple[int, int, asyncio.Future]]
+        self._order = itertools.count()  # type: Iterator[int]
+
+    @property
+    def queued(self) -> int:
+        """ Returns how many callers are waiting for a slot.
+        :returns: the number of waiting callers
+        """
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        """ Coroutine. Waits until a slot in the window is free for this caller.
+
+        :param priority: the caller's priority class, lower is more urgent
+        """
+        if self.active < self.window and not self._waiters:
+            self.active += 1
+            return
+        future = self.loop.create_future()  # type: asyncio.Future
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were given a slot just as we were cancelled, pass it on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """ Frees a slot, and hands it to the most urgent waiting caller. """
+        self.active -= 1
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+                return
+
+    async def run(self, priority: int, start: Callable[[], Awaitable[Any]]) -> Any:
+        """ Coroutine. Starts a request once there is a slot for it.
+
+        :param priority: the request's priority class, lower is more urgent
+        :param start: a function that starts the request
+        :returns: Future. The request's response
+        """
+        await self.acquire(priority)
+        try:
+            return await start()
+        finally:
+            self.release()
+
+
+class RequestCoalescer:
+    """ RequestCoalescer object. Shares a single in-flight request between
+    every caller that asks the same question while it is outstanding, and
+    counts how often that saved a round trip.
+    """
+
+    def __init__(self) -> None:
+        """ RequestCoalescer object constructor.
+        :returns: A new RequestCoalescer object
+        """
+        self._inflight = {}  # type: Dict[Any, asyncio.Future]
+        self.requests = 0  # type: int
+        self.coalesced = 0  # type: int
+
+    @property
+    def hit_rate(self) -> float:
+        """ Returns the fraction of calls that joined an in-flight request.
+        :returns: a float between 0 and 1
+        """
+        total = self.requests + self.coalesced  # type: int
+        return self.coalesced / total if total else 0.0
+
+    async def run(self, key: Any, start: Callable[[], Awaitable[Any]]) -> Any:
+        """ Coroutine. Awaits the in-flight request for key, starting one
+        if there isn't one. A cancelled caller doesn't cancel the others.
+
+        :param key: a hashable key identifying the request
+        :param start: a function that starts the request
+        :returns: Future. The request's response
+        """
+        future = self._inflight.get(key)  # type: asyncio.Future
+        if future is None:
+            self.requests += 1
+            future = asyncio.ensure_future(start())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+
+class SubscriptionRouter:
+    """ SubscriptionRouter object. Takes address notifications off the one
+    inbound subscription stream and hands them to a bounded pool of workers.
+    Notifications for a scripthash are handled one at a time and in order,
+    while different scripthashes are handled in parallel. A burst of
+    notifications for a scripthash that arrives while it waits or is being
+    handled collapses into one pass over the latest of them.
+    """
+
+    WORKERS = 4  # type: int
+
+    def __init__(self, handler: Callable[[List[str]], Awaitable[None]],
+                 loop: asyncio.AbstractEventLoop = None,
+                 workers: int = None) -> None:
+        """ SubscriptionRouter object constructor.
+
+        :param handler: a coroutine function to call with each notification
+        :param loop: an asyncio event loop
+        :param workers: the most notifications to handle at once
+        :returns: A new SubscriptionRouter object
+        """
+        self.handler = handler  # type: Callable[[List[str]], Awaitable[None]]
+        self.loop = loop or asyncio.get_event_loop()  # type: asyncio.AbstractEventLoop
+        self.workers = workers or SubscriptionRouter.WORKERS  # type: int
+        # scripthash -> the latest notification not yet handled
+        self._latest = {}  # type: Dict[str, List[str]]
+        self._busy = set()  # type: Set[str]
+        self._ready = asyncio.Queue(loop=self.loop)  # type: asyncio.Queue
+        self.received = 0  # type: int
+        self.collapsed = 0  # type: int
+
+    async def put(self, result: List[str]) -> None:
+        """ Coroutine. Routes a notification to a worker, never waits for one.
+
+        :param result: a [scripthash, status] notification
+        """
+        self.received += 1
+        key = result[0]  # type: str
+        if key in self._latest:
+            self.collapsed += 1
+        elif key not in self._busy:
+            self._ready.put_nowait(key)
+        self._latest[key] = result
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()  # type: str
+            result = self._latest.pop(key)  # type: List[str]
+            self._busy.add(key)
+            try:
+                await self.handler(result)
+            finally:
+                self._busy.discard(key)
+                if key in self._latest:
+                    self._ready.put_nowait(key)
+
+    async def run(self) -> None:
+        """ Coroutine. Runs the workers forever.
+        :raise: Re-raises the first error a handler raises
+        """
+        workers = [asyncio.ensure_future(self._work(), loop=self.loop)
+                   for _ in range(self.workers)]  # type: List[asyncio.Future]
+        try:
+            await asyncio.gather(*workers, loop=self.loop)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+
 class Connection:
     """ Connection object. Connects to an Electrum server, and handles all
     Stratum protocol messages.
     """
 
+    MAX_BATCH_SIZE = 50  # type: int
+    WINDOW = 8  # type: int
+    PING_INTERVAL = 60  # type: int
+    PING_TIMEOUT = 30  # type: int
+
+    # Priority classes for methods that aren't background work
+    PRIORITIES = {
+        "blockchain.estimatefee": PRIORITY_INTERACTIVE,
+        "blockchain.relayfee": PRIORITY_INTERACTIVE,
+        "blockchain.transaction.broadcast": PRIORITY_BROADCAST
+    }  # type: Dict[str, int]
+
     #  pylint: disable=E1111
     def __init__(self,
                  loop: asyncio.AbstractEventLoop,
                  server: str,
                  port: int,
-                 proto: str) -> None:
+                 proto: str,
+                 max_batch_size: int = None,
+                 window: int = None) -> None:
         """ Connection object constructor.
 
         :param loop: an asyncio event loop
         :param server: a string containing a hostname
         :param port: port number that the server listens on
+        :param max_batch_size: the most requests to send in one JSON-RPC batch
+        :param window: the most requests to have in flight to this server
         :returns: A new Connection object
         """
         logging.info("Connecting...")
 
+        self.server = server  # type: str
+        self.port = port  # type: int
+        self.proto = proto  # type: str
+        self.alive = False  # type: bool
+        self.lost = asyncio.Event(loop=loop)  # type: asyncio.Event
+
         self.server_info = ServerInfo(
             server, hostname=server, ports=port)  # type: ServerInfo
 
@@ -75,42 +292,178 @@ class Connection:
             self.server_info,
             proto_code=proto,
             use_tor=True,
-            disable_cert_verify=(proto != "s")
+            disable_cert_verify=(proto != "s"),
+            disconnect_callback=lambda _: self._mark_lost()
         )  # type: asyncio.Future
 
         self.queue = None  # type: asyncio.Queue
+        self.max_batch_size = max_batch_size \
+            or Connection.MAX_BATCH_SIZE  # type: int
+        self.coalescer = RequestCoalescer()  # type: RequestCoalescer
+        self.scheduler = RequestScheduler(
+            window or Connection.WINDOW, loop)  # type: RequestScheduler
+
+    @staticmethod
+    def priority_for(methods: Iterable[str]) -> int:
+        """ Returns the priority class for a request, or a batch of them.
+
+        :param methods: the Electrum API methods being requested
+        :returns: the most urgent priority class of any of the methods
+        """
+        return min([Connection.PRIORITIES.get(method, PRIORITY_BACKGROUND)
+                    for method in methods] or [PRIORITY_BACKGROUND])
 
     async def do_connect(self) -> None:
         """ Coroutine. Establishes a persistent connection to an Electrum server.
         Awaits the connection because AFAIK an init method can't be async.
+        Does nothing if we are already connected.
         """
+        if self.alive:
+            return
         await self.connection
+        self.alive = True
         logging.info("Connected to server")
 
-    async def listen_rpc(self, method: str, args: List) -> Any:
+    def close(self) -> None:
+        """ Closes the connection to the server. """
+        self.alive = False
+        self.client.close()
+
+    def _mark_lost(self) -> None:
+        if self.alive:
+            logging.warning("Lost connection to %s", self.server)
+        self.alive = False
+        self.lost.set()
+
+    async def ping(self, timeout: float = None) -> bool:
+        """ Coroutine. Checks that the server still answers in time.
+
+        :param timeout: how many seconds to wait for the answer
+        :returns: Future, True if the server answered
+        """
+        try:
+            await asyncio.wait_for(self.client.RPC("server.ping"),
+                                   timeout or Connection.PING_TIMEOUT)
+        except Exception as err:
+            logging.warning("Ping to %s failed: %r", self.server, err)
+            return False
+        return True
+
+    async def monitor(self, interval: float = None, timeout: float = None) -> None:
+        """ Coroutine. Pings the server every interval seconds, and returns
+        once the connection drops or the server stops answering.
+
+        :param interval: how many seconds to wait between pings
+        :param timeout: how many seconds to wait for each answer
+        """
+        while self.alive:
+            try:
+                await asyncio.wait_for(self.lost.wait(),
+                                       interval or Connection.PING_INTERVAL)
+            except asyncio.TimeoutError:
+                if not await self.ping(timeout):
+                    self._mark_lost()
+                    self.close()
+
+    async def listen_rpc(self, method: str, args: List, priority: int = None) -> Any:
         """ Coroutine. Sends a normal RPC message to the server and awaits response.
+        Identical requests that are already in flight share one round trip.
 
         :param method: The Electrum API method to use
         :param args: Params associated with current method
+        :param priority: the request's priority class, by default
+            chosen from the method
         :returns: Future. Response from server for this method(args)
         """
-        return await self.client.RPC(method, *args)
+        if priority is None:
+            priority = Connection.priority_for([method])
+        return await self.coalescer.run(
+            (method, tuple(args)), lambda: self.scheduler.run(
+                priority, lambda: self.client.RPC(method, *args)))
 
-    def listen_subscribe(self, method: str, args: List) -> None:
+    @property
+    def server_info_list(self) -> List[Any]:
+        """ Returns the server info list this connection was made from.
+        :returns: a [hostname, port, proto] list
+        """
+        return [self.server, self.port, self.proto]
+
+    def listen_subscribe(self, method: str, args: List) -> asyncio.Future:
         """ Sends a "subscribe" message to the server and adds to the queue.
-        Throws away the immediate future containing the "history" hash.
+        Every notification for a method reaches every queue subscribed to
+        it, so only the first queue is kept, and it carries them all.
 
         :param method: The Electrum API method to use
         :param args: Params associated with current method
+        :returns: the future containing the "history" hash
         """
         t = self.client.subscribe(
             method, *args
         )  # type: Tuple[asyncio.Future, asyncio.Queue]
         future, queue = t
 
-        self.queue = queue
+        if self.queue is None:
+            self.queue = queue
+        elif queue is not self.queue:
+            self.client.subscriptions[method].remove(queue)
         return future
 
+    def subscribe(self, method: str, args: List) -> Tuple[asyncio.Future, asyncio.Queue]:
+        """ Sends a "subscribe" message to the server, for notifications
+        that shouldn't go to our address queue.
+
+        :param method: The Electrum API method to use
+        :param args: Params associated with current method
+        :returns: A tuple of the initial response future and a notification queue
+        """
+        return self.client.subscribe(method, *args)
+
+    async def batch_rpc(self, requests: List[Tuple[str, List]],
+                        priority: int = None) -> List[Any]:
+        """ Coroutine. Sends many RPC messages to the server as JSON-RPC batches,
+        split into chunks of at most max_batch_size, and awaits all responses.
+        Each chunk takes one slot in the scheduler's window.
+        Subscriptions are allowed, their notifications arrive on our queue.
+
+        :param requests: a list of (method, args) tuples
+        :param priority: the batch's priority class, by default
+            chosen from the methods
+        :returns: Future. A list of responses, in the same order as requests
+        """
+        async def single(future: asyncio.Future) -> List[Any]:
+            return [await future]
+
+        def send(chunk: List[Tuple[int, Tuple[str, List]]]) -> Awaitable[List[Any]]:
+            return self.scheduler.run(priority, lambda: self.client.batch_rpc(
+                [(method,) + tuple(args) for _, (method, args) in chunk]))
+
+        if priority is None:
+            priority = Connection.priority_for(method for method, _ in requests)
+
+        indexed = list(enumerate(requests))  # type: List[Tuple[int, Tuple[str, List]]]
+        chunks = []  # type: List[List[int]]
+        futures = []  # type: List[Awaitable[List[Any]]]
+        if self.queue is None:
+            # A batch can't register a subscription queue, so send the first
+            # subscription on its own, and it will catch all notifications.
+            for i, (method, args) in indexed:
+                if method.endswith(".subscribe"):
+                    chunks.append([i])
+                    futures.append(single(self.listen_subscribe(method, args)))
+                    del indexed[i]
+                    break
+        for n in range(0, len(indexed), self.max_batch_size):
+            chunk = indexed[n:n + self.max_batch_size]
+            chunks.append([i for i, _ in chunk])
+            futures.append(send(chunk))
+
+        results = [None] * len(requests)  # type: List[Any]
+        for chunk, chunk_results in zip(
+                chunks, await asyncio.gather(*futures)):
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+        return results
+
     async def consume_queue(self, queue_func: Callable[[List[str]], Awaitable[None]]) -> None:
         """ Coroutine. Infinite loop that consumes the current subscription queue.
         :param queue_func: A function to call when new responses arrive
@@ -121,6 +474,351 @@ class Connection:
             await queue_func(result)
 
 
+class ConnectionPool:
+    """ ConnectionPool object. Holds connections to several Electrum servers
+    and presents the same interface as a single Connection. Read-only RPCs
+    are spread across the pool, each going to the connection with the
+    fewest requests outstanding. Everything else, and all subscriptions,
+    stay pinned to the primary connection, so notifications all arrive on
+    one queue.
+
+    The pool remembers every subscription and its latest status. While
+    monitor() runs, dead connections are replaced from a list of spare
+    servers, and if the primary dies the next connection takes over and
+    every subscription is replayed on it. Only subscriptions whose status
+    changed while we were failing over are passed on as notifications.
+    """
+
+    READ_ONLY_METHODS = frozenset((
+        "blockchain.transaction.get",
+        "blockchain.scripthash.get_history",
+        "blockchain.block.get_header",
+        "blockchain.block.headers",
+        "blockchain.scripthash.listunspent"
+    ))  # type: frozenset
+
+    CONNECT_TIMEOUT = 60  # type: int
+    RETRY_DELAY = 30  # type: int
+
+    def __init__(self, connections: List[Connection],
+                 loop: asyncio.AbstractEventLoop = None,
+                 spares: List[List[Any]] = None) -> None:
+        """ ConnectionPool object constructor.
+
+        :param connections: a list of Connection objects, the first one
+            is the primary
+        :param loop: an asyncio event loop
+        :param spares: server info lists to connect to when a connection dies
+        :returns: A new ConnectionPool object
+        :raise: Raises a ValueError if there are no connections
+        """
+        if not connections:
+            raise ValueError("A ConnectionPool needs at least one connection")
+        self.connections = list(connections)  # type: List[Connection]
+        self.loop = loop or asyncio.get_event_loop()  # type: asyncio.AbstractEventLoop
+        self.spares = list(spares or [])  # type: List[List[Any]]
+        self.size = len(self.connections)  # type: int
+        self.outstanding = {conn: 0 for conn in self.connections}  # type: Dict[Connection, int]
+        self.coalescer = RequestCoalescer()  # type: RequestCoalescer
+
+        # (method, args) -> latest status, for every subscription
+        self.subscriptions = collections.OrderedDict()  # type: Dict[Tuple[str, Tuple], Any]
+        self._queues = {}  # type: Dict[str, asyncio.Queue]
+        self._queue_method = None  # type: str
+        self._forwarders = {}  # type: Dict[Tuple[Connection, str], asyncio.Future]
+
+    @property
+    def primary(self) -> Connection:
+        """ Returns the connection that subscriptions are pinned to.
+        :returns: a Connection object
+        """
+        return self.connections[0]
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        """ Returns the address subscription queue, which outlives failovers.
+        :returns: an asyncio.Queue of notifications
+        """
+        if self._queue_method is None:
+            return None
+        return self._queue_for(self._queue_method)
+
+    async def do_connect(self) -> None:
+        """ Coroutine. Connects every connection in the pool at once and drops
+        any that fail. If the primary fails, the next connected one takes over.
+
+        :raise: Re-raises the first error if no connection succeeds
+        """
+        results = await asyncio.gather(
+            *[conn.do_connect() for conn in self.connections],
+            return_exceptions=True)  # type: List[Any]
+        connected = [conn for conn, result in zip(self.connections, results)
+                     if not isinstance(result, Exception)]  # type: List[Connection]
+        if not connected:
+            raise results[0]
+        if len(connected) < len(self.connections):
+            logging.warning("Connected to %s of %s servers",
+                            len(connected), len(self.connections))
+        self.connections = connected
+        self.outstanding = {conn: 0 for conn in self.connections}
+
+    def _least_outstanding(self) -> Connection:
+        return min(self.connections,
+                   key=lambda conn: (not conn.alive, self.outstanding[conn]))
+
+    def _done_with(self, conn: Connection) -> None:
+        if conn in self.outstanding:
+            self.outstanding[conn] -= 1
+
+    async def listen_rpc(self, method: str, args: List, priority: int = None) -> Any:
+        """ Coroutine. Sends a normal RPC message to the server and awaits response.
+        Read-only methods go to the least busy connection, others to the primary.
+
+        :param method: The Electrum API method to use
+        :param args: Params associated with current method
+        :param priority: the request's priority class, by default
+            chosen from the method
+        :returns: Future. Response from server for this method(args)
+        """
+        if method not in ConnectionPool.READ_ONLY_METHODS:
+            return await self.primary.listen_rpc(method, args, priority)
+        return await self.coalescer.run(
+            (method, tuple(args)),
+            lambda: self._rpc_on_least_outstanding(method, args, priority))
+
+    async def _rpc_on_least_outstanding(self, method: str, args: List,
+                                        priority: int = None, retry: bool = True) -> Any:
+        conn = self._least_outstanding()  # type: Connection
+        self.outstanding[conn] += 1
+        try:
+            return await conn.listen_rpc(method, args, priority)
+        except Exception:
+            # A read-only call can safely be retried once, elsewhere
+            if conn.alive or not retry or len(self.connections) < 2:
+                raise
+            logging.warning("Retrying %s on another server", method)
+            return await self._rpc_on_least_outstanding(
+                method, args, priority, retry=False)
+        finally:
+            self._done_with(conn)
+
+    def _queue_for(self, method: str) -> asyncio.Queue:
+        if method not in self._queues:
+            self._queues[method] = asyncio.Queue(loop=self.loop)
+        return self._queues[method]
+
+    def _track(self, method: str, args: List, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            self.subscriptions[(method, tuple(args))] = future.result()
+
+    def _forward(self, conn: Connection, method: str, queue: asyncio.Queue) -> None:
+        """ Starts passing a connection's notifications for a subscription
+        method on to our own queue for that method, once per connection.
+        """
+        if queue is None or (conn, method) in self._forwarders:
+            return
+        self._forwarders[(conn, method)] = asyncio.ensure_future(
+            self._forward_loop(conn, method, queue), loop=self.loop)
+
+    async def _forward_loop(self, conn: Connection, method: str,
+                            queue: asyncio.Queue) -> None:
+        while conn in self.outstanding:
+            result = await queue.get()  # type: List[Any]
+            self.subscriptions[(method, tuple(result[:-1]))] = result[-1]
+            await self._queue_for(method).put(result)
+
+    def listen_subscribe(self, method: str, args: List) -> asyncio.Future:
+        """ Sends a "subscribe" message to the primary server.
+
+        :param method: The Electrum API method to use
+        :param args: Params associated with current method
+        :returns: the future containing the "history" hash
+        """
+        future = self.primary.listen_subscribe(method, args)  # type: asyncio.Future
+        future.add_done_callback(lambda f: self._track(method, args, f))
+        self._queue_method = method
+        self._forward(self.primary, method, self.primary.queue)
+        return future
+
+    def subscribe(self, method: str, args: List) -> Tuple[asyncio.Future, asyncio.Queue]:
+        """ Sends a "subscribe" message to the primary server, for
+        notifications that shouldn't go to our address queue.
+
+        :param method: The Electrum API method to use
+        :param args: Params associated with current method
+        :returns: A tuple of the initial response future and a notification queue
+        """
+        future, queue = self.primary.subscribe(method, args)
+        future.add_done_callback(lambda f: self._track(method, args, f))
+        self._forward(self.primary, method, queue)
+        return future, self._queue_for(method)
+
+    async def _batch_on(self, conn: Connection, requests: List[Tuple[str, List]],
+                        priority: int = None) -> List[Any]:
+        # The caller has already counted this request as outstanding
+        try:
+            return await conn.batch_rpc(requests, priority)
+        finally:
+            self._done_with(conn)
+
+    async def _batch_on_primary(self, requests: List[Tuple[str, List]],
+                                priority: int = None) -> List[Any]:
+        primary = self.primary  # type: Connection
+        results = await primary.batch_rpc(requests, priority)  # type: List[Any]
+        for (method, args), result in zip(requests, results):
+            if method.endswith(".unsubscribe"):
+                self.subscriptions.pop(
+                    (method[:-len("unsubscribe")] + "subscribe", tuple(args)), None)
+            elif method.endswith(".subscribe"):
+                self.subscriptions[(method, tuple(args))] = result
+                self._queue_method = method
+                self._forward(primary, method, primary.queue)
+        return results
+
+    async def batch_rpc(self, requests: List[Tuple[str, List]],
+                        priority: int = None) -> List[Any]:
+        """ Coroutine. Sends many RPC messages as JSON-RPC batches. Read-only
+        requests are chunked and each chunk goes to the least busy connection,
+        the rest go to the primary in one batch.
+
+        :param requests: a list of (method, args) tuples
+        :param priority: the batch's priority class, by default
+            chosen from the methods
+        :returns: Future. A list of responses, in the same order as requests
+        """
+        read_only = [i for i, (method, _) in enumerate(requests)
+                     if method in ConnectionPool.READ_ONLY_METHODS]  # type: List[int]
+        pinned = [i for i, (method, _) in enumerate(requests)
+                  if method not in ConnectionPool.READ_ONLY_METHODS]  # type: List[int]
+
+        chunks = []  # type: List[List[int]]
+        futures = []  # type: List[Awaitable[List[Any]]]
+        if pinned:
+            chunks.append(pinned)
+            futures.append(self._batch_on_primary([requests[i] for i in pinned], priority))
+        chunk_size = self.primary.max_batch_size  # type: int
+        for n in range(0, len(read_only), chunk_size):
+            chunk = read_only[n:n + chunk_size]
+            chunks.append(chunk)
+            conn = self._least_outstanding()  # type: Connection
+            self.outstanding[conn] += 1
+            futures.append(self._batch_on(conn, [requests[i] for i in chunk], priority))
+
+        results = [None] * len(requests)  # type: List[Any]
+        for chunk, chunk_results in zip(
+                chunks, await asyncio.gather(*futures)):
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+        return results
+
+    async def consume_queue(self, queue_func: Callable[[List[str]], Awaitable[None]]) -> None:
+        """ Coroutine. Infinite loop that consumes the address subscription queue.
+        :param queue_func: A function to call when new responses arrive
+        """
+        while True:
+            logging.info("Awaiting queue..")
+            result = await self.queue.get()  # type: List[str]
+            await queue_func(result)
+
+    async def _connect_spare(self) -> Connection:
+        """ Coroutine. Connects to spare servers in turn until one answers.
+        :returns: Future, a connected Connection, or None if none answered
+        """
+        while self.spares:
+            server, port, proto = self.spares.pop(0)
+            conn = Connection(self.loop, server, port, proto)  # type: Connection
+            try:
+                await asyncio.wait_for(conn.do_connect(), ConnectionPool.CONNECT_TIMEOUT,
+                                       loop=self.loop)
+            except Exception as err:
+                logging.warning("Spare server %s is unreachable: %s", server, err)
+                continue
+            return conn
+        return None
+
+    async def _replay(self) -> None:
+        """ Coroutine. Replays every subscription on a new primary, and passes
+        on a notification for each one whose status has changed.
+        """
+        primary = self.primary  # type: Connection
+        by_method = collections.OrderedDict()  # type: Dict[str, List[Tuple]]
+        if self._queue_method is not None:
+            by_method[self._queue_method] = []
+        for method, args in self.subscriptions:
+            by_method.setdefault(method, []).append(args)
+
+        for method, args_list in by_method.items():
+            if not args_list:
+                continue
+            # The first subscription registers the connection's queue
+            if method == self._queue_method:
+                first = primary.listen_subscribe(method, list(args_list[0]))
+                queue = primary.queue  # type: asyncio.Queue
+            else:
+                first, queue = primary.subscribe(method, list(args_list[0]))
+            self._forward(primary, method, queue)
+            statuses = [await first]  # type: List[Any]
+            if len(args_list) > 1:
+                statuses += await primary.batch_rpc(
+                    [(method, list(args)) for args in args_list[1:]])
+
+            changed = 0  # type: int
+            for args, status in zip(args_list, statuses):
+                if self.subscriptions.get((method, args)) != status:
+                    self.subscriptions[(method, args)] = status
+                    await self._queue_for(method).put(list(args) + [status])
+                    changed += 1
+            logging.info("Replayed %s %s subscriptions, %s changed",
+                         len(args_list), method, changed)
+
+    async def _drop(self, conn: Connection) -> None:
+        """ Coroutine. Removes a dead connection, replaces it if we can, and
+        fails over to a new primary if it was the primary.
+        """
+        was_primary = conn is self.primary  # type: bool
+        self.connections.remove(conn)
+        del self.outstanding[conn]
+        forwarders = [key for key in self._forwarders if key[0] is conn]
+        for key in forwarders:
+            self._forwarders.pop(key).cancel()
+        logging.warning("Lost connection to a server, %s left", len(self.connections))
+
+        while len(self.connections) < self.size:
+            spare = await self._connect_spare()  # type: Connection
+            if spare is None:
+                break
+            self.connections.append(spare)
+            self.outstanding[spare] = 0
+        while not self.connections:
+            logging.error("No Electrum servers are reachable, retrying..")
+            await asyncio.sleep(ConnectionPool.RETRY_DELAY, loop=self.loop)
+            self.spares.append(conn.server_info_list)
+            spare = await self._connect_spare()
+            if spare is not None:
+                self.connections.append(spare)
+                self.outstanding[spare] = 0
+
+        if was_primary:
+            logging.info("Failing over to a new primary server")
+            await self._replay()
+
+    async def monitor(self) -> None:
+        """ Coroutine. Watches the health of every connection forever,
+        replacing dead ones and failing over when the primary dies.
+        """
+        tasks = {}  # type: Dict[Connection, asyncio.Future]
+        while True:
+            for conn in self.connections:
+                if conn not in tasks:
+                    tasks[conn] = asyncio.ensure_future(conn.monitor(), loop=self.loop)
+            done, _ = await asyncio.wait(
+                list(tasks.values()), loop=self.loop,
+                return_when=asyncio.FIRST_COMPLETED)
+            for conn in [conn for conn, task in tasks.items() if task in done]:
+                del tasks[conn]
+                await self._drop(conn)
+
+
 class History:
     """ History object. Holds data relevant to a piece of
     our transaction history.
@@ -141,18 +839,13 @@ class History:
         self.height = height  # type: int
         self.timestamp = None  # type: str
 
-    async def get_timestamp(self, connection: Connection) -> None:
+    async def get_timestamp(self, headers: HeaderCache) -> None:
         """ Coroutine. Gets the timestamp for this Tx based on the given height.
-        :param connection: a Connection object for getting a block header
+        :param headers: a HeaderCache for getting a block header
             from the server
         """
         if self.height > 0:
-            block_header = await connection.listen_rpc(
-                Wallet.methods["get_header"],
-                [self.height]
-            )  # type: Dict[str, Any]
-
-            block_time = block_header["timestamp"]
+            block_time = await headers.get_timestamp(self.height)  # type: int
             self.timestamp = block_time
 
             logging.debug("Got timestamp %d from block at height %s",
@@ -221,6 +914,11 @@ class Wallet:
 
     COIN = 100000000  # type: int
     _GAP_LIMIT = 20  # type: int
+    _KEY_CACHE_SIZE = 50000  # type: int
+    _LOOKAHEAD = 20  # type: int
+    _SCAN_AHEAD = 1  # type: int
+    _PREDERIVE_CHUNK = 10  # type: int
+    _RESUBSCRIBE_DELAY = 5  # type: int
 
     methods = {
         "get": "blockchain.transaction.get",
@@ -228,7 +926,10 @@ class Wallet:
         "listunspent": "blockchain.scripthash.listunspent",
         "get_history": "blockchain.scripthash.get_history",
         "get_header": "blockchain.block.get_header",
+        "get_headers": "blockchain.block.headers",
+        "subscribe_headers": "blockchain.headers.subscribe",
         "subscribe": "blockchain.scripthash.subscribe",
+        "unsubscribe": "blockchain.scripthash.unsubscribe",
         "estimatefee": "blockchain.estimatefee",
         "broadcast": "blockchain.transaction.broadcast"
     }  # type: Dict[str, str]
@@ -239,16 +940,23 @@ class Wallet:
                  connection: Connection,
                  loop: asyncio.AbstractEventLoop,
                  chain,
-                 bech32=False) -> None:
+                 bech32=False,
+                 derived_key: Tuple[int, bytes] = None,
+                 account_master: SegwitBIP32Node = None) -> None:
         """ Wallet object constructor. Use discover_keys() and listen_to_addresses()
         coroutine method to construct wallet data, and listen for new data from
-        the server.
+        the server. Prefer the create() coroutine, which does not block the
+        event loop while stretching the passphrase.
 
         :param salt: a string to use as a salt for key derivation
         :param passphrase: a string containing a secure passphrase
         :param connection: a Connection object
         :param loop: an asyncio event loop
         :param chain: a namedtuple containing chain-specific info
+        :param derived_key: an already derived (secret_exp, chain_code) tuple
+            for this salt/passphrase, skips key stretching if given
+        :param account_master: an already derived account key node,
+            skips key stretching and account derivation if given
         :returns: A new, empty Wallet object
         """
 
@@ -261,11 +969,13 @@ class Wallet:
             :param passphrase: a string containing a secure passphrase
             :param account: account number, defaults to 0
             """
-            logging.info("Deriving keys...")
-
-            t = derive_key(
-                salt, passphrase
-            )  # type: Union[int, Tuple[int, bytes]]
+            if derived_key is None:
+                logging.info("Deriving keys...")
+                t = derive_key(
+                    salt, passphrase
+                )  # type: Union[int, Tuple[int, bytes]]
+            else:
+                t = derived_key
             assert isinstance(t, tuple), "Should never fail"
             secret_exp, chain_code = t
 
@@ -282,38 +992,212 @@ class Wallet:
 
             self.account_master = \
                 self.mpk.subkey_for_path(path)  # type: SegwitBIP32Node
-            self.root_spend_key = \
-                self.account_master.subkey(0)  # type: SegwitBIP32Node
-            self.root_change_key = \
-                self.account_master.subkey(1)  # type: SegwitBIP32Node
 
         self.connection = connection  # type: Connection
         self.loop = loop  # type: asyncio.AbstractEventLoop
         self.chain = chain
-        self.bech32 = bech32
+        self._bech32 = bech32  # type: bool
 
         self.mpk = None  # type: SegwitBIP32Node
         self.account_master = None  # type: SegwitBIP32Node
         self.root_spend_key = None  # type: SegwitBIP32Node
         self.root_change_key = None  # type: SegwitBIP32Node
-        create_root_keys(salt, passphrase)
+        if account_master is None:
+            create_root_keys(salt, passphrase)
+        else:
+            self.account_master = account_master
+        self.root_spend_key = self.account_master.subkey(0)
+        self.root_change_key = self.account_master.subkey(1)
+
+        # Memoized key tables, one per key root, and the unused keys
+        # derived ahead of time in the background, ready to hand out
+        self.spend_keys = None  # type: KeyChain
+        self.change_keys = None  # type: KeyChain
+        self.lookahead = Wallet._LOOKAHEAD  # type: int
+        self._ready = {}  # type: Dict[bool, Deque[DerivedKey]]
+        self._ready_end = {}  # type: Dict[bool, int]
+        self._prederiving = {}  # type: Dict[bool, asyncio.Future]
+        self._reset_keychains()
+
+        # Subscriptions for keys handed out after discovery, by scripthash
+        self._watching = {}  # type: Dict[str, asyncio.Future]
+
+        # How many windows of subscriptions discovery sends ahead
+        self.scan_ahead = Wallet._SCAN_AHEAD  # type: int
 
         # Boolean lists, True = used / False = unused
         self.spend_indicies = []  # type: List[bool]
         self.change_indicies = []  # type: List[bool]
 
+        # Raw transactions, shared by every path that needs a Tx.
+        # Memory only unless replaced with a TxCache that has a path.
+        self.tx_cache = TxCache()  # type: TxCache
+        self.header_cache = HeaderCache(
+            connection, loop, self.methods["get_headers"])  # type: HeaderCache
+
         # All wallet TX info. (MUST not persist!)
-        self.utxos = []  # type: List[Spendable]
-        self.spent_utxos = []  # type: List[Spendable]
+        self.utxos = UtxoSet()  # type: UtxoSet
 
         self.history = {}  # type: Dict[Any]
         self.change_history = {}  # type: Dict[Any]
 
+        # scripthash -> (txid, height) pairs, in the server's order, and
+        # the status hash the server last sent for it
+        self.scripthash_history = {}  # type: Dict[str, List[Tuple[str, int]]]
+        self.statuses = {}  # type: Dict[str, str]
+
         self.balance = Decimal("0")  # type: Decimal
         self.zeroconf_balance = Decimal("0")  # type: Decimal
 
         self.new_history = False  # type: bool
 
+        # Hands address notifications to workers, a few scripthashes at once
+        self.router = SubscriptionRouter(
+            self._dispatch_result, loop)  # type: SubscriptionRouter
+
+    @classmethod
+    async def create(cls,
+                     salt: str,
+                     passphrase: str,
+                     loop: asyncio.AbstractEventLoop,
+                     chain,
+                     bech32: bool = False,
+                     connection: Connection = None,
+                     executor: concurrent.futures.Executor = None,
+                     progress: Callable[[str], None] = None,
+                     resume_cache: ResumeCache = None,
+                     pin: str = None,
+                     pool_size: int = 3) -> "Wallet":
+        """ Coroutine. Builds a new Wallet without blocking the event loop.
+        Key stretching runs in a worker pool while, if no connection is
+        given, an Electrum server is selected and connected to concurrently.
+        Cancelling this coroutine abandons both; a stretch that is already
+        running in a worker is left to finish and its result dropped.
+
+        With a resume cache and PIN, a freshly derived account key is saved
+        to the cache, and a later call with no passphrase resumes from it
+        without any key stretching.
+
+        :param salt: a string to use as a salt for key derivation
+        :param passphrase: a string containing a secure passphrase
+        :param loop: an asyncio event loop
+        :param chain: a namedtuple containing chain-specific info
+        :param bech32: a boolean indicating which address encoding to use
+        :param connection: a Connection object, a new one is made if None
+        :param executor: an executor to stretch keys in, a new two worker
+            thread pool is used if None. hashlib's scrypt and PBKDF2 release
+            the GIL, so threads use two cores, and unlike a process pool
+            they work where multiprocessing doesn't, e.g. on Android
+        :param progress: a function to call with a status message as
+            each stage of the login starts and finishes
+        :param resume_cache: a ResumeCache to save to or resume from
+        :param pin: the PIN protecting the resume cache
+        :param pool_size: how many Electrum servers to connect to if no
+            connection is given
+        :returns: Future, a new, empty Wallet object
+        :raise: Raises a ValueError if there is no passphrase and nothing to
+            resume, or if the PIN is wrong
+        """
+        def report(message: str) -> None:
+            if progress is not None:
+                progress(message)
+
+        bip = 84 if bech32 else 49  # type: int
+        identity = "{}:{}:{}".format(salt, chain.netcode, bip)  # type: str
+        if passphrase is None:
+            hwif = resume_cache.load(pin, identity) \
+                if resume_cache is not None and pin else None  # type: str
+            if hwif is None:
+                raise ValueError("There is no wallet to resume.")
+            report("Resuming wallet..")
+            if connection is None:
+                connection = await get_connection_pool(loop, pool_size)
+            account_master = SegwitBIP32Node.from_hwif(hwif)  # type: SegwitBIP32Node
+            return cls(salt, None, connection, loop, chain,
+                       bech32=bech32, account_master=account_master)
+
+        own_executor = executor is None  # type: bool
+        if own_executor:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+        async def stretch() -> Tuple[int, bytes]:
+            report("Deriving keys..")
+            start_time = time.time()  # type: float
+            t = await derive_key_async(
+                salt, passphrase, loop, executor)  # type: Tuple[int, bytes]
+            logging.info("Derived keys in {0:.3f} seconds".format(
+                time.time() - start_time))
+            report("Keys derived")
+            return t
+
+        async def connect() -> Connection:
+            if connection is not None:
+                return connection
+            report("Connecting..")
+            new_connection = await get_connection_pool(
+                loop, pool_size)  # type: ConnectionPool
+            report("Connected to server")
+            return new_connection
+
+        futures = [asyncio.ensure_future(stretch(), loop=loop),
+                   asyncio.ensure_future(connect(), loop=loop)]
+        try:
+            derived_key, connection = await asyncio.gather(*futures, loop=loop)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False)
+            raise
+        if own_executor:
+            executor.shutdown(wait=True)
+
+        wallet = cls(salt, passphrase, connection, loop, chain,
+                     bech32=bech32, derived_key=derived_key)  # type: Wallet
+        if resume_cache is not None and pin:
+            resume_cache.save(
+                wallet.account_master.hwif(as_private=True), pin, identity)
+        return wallet
+
+    @classmethod
+    def from_xpub(cls,
+                  xpub: str,
+                  connection: Connection,
+                  loop: asyncio.AbstractEventLoop,
+                  chain,
+                  bech32: bool = False) -> "Wallet":
+        """ Builds a watch-only Wallet from an account's extended public key.
+        No key stretching or private derivation is done; the wallet can
+        discover keys and listen to addresses, but can't spend.
+
+        :param xpub: an xpub, ypub or zpub (or testnet equivalent)
+        :param connection: a Connection object
+        :param loop: an asyncio event loop
+        :param chain: a namedtuple containing chain-specific info
+        :param bech32: a boolean indicating which address encoding to use,
+            ignored if the key's prefix says which one to use
+        :returns: A new, empty, watch-only Wallet object
+        :raise: Raises a ValueError if given a private key, or a key
+            for another chain
+        """
+        t = SegwitBIP32Node.from_segwit_hwif(xpub)  # type: Tuple[SegwitBIP32Node, bool]
+        account_master, prefix_bech32 = t
+        if account_master.is_private():
+            raise ValueError("Expected an extended public key")
+        if account_master.netcode() != chain.netcode:
+            raise ValueError("Extended public key is not for this chain")
+        if prefix_bech32 is not None:
+            bech32 = prefix_bech32
+        return cls(None, None, connection, loop, chain,
+                   bech32=bech32, account_master=account_master)
+
+    @property
+    def watch_only(self) -> bool:
+        """ Returns whether this wallet only holds public keys.
+        :returns: a boolean, True if this wallet can't sign.
+        """
+        return not self.account_master.is_private()
+
     @property
     def ypub(self) -> str:
         """ Returns this account's extended public key.
@@ -321,6 +1205,55 @@ class Wallet:
         """
         return self.account_master.hwif()
 
+    @property
+    def bech32(self) -> bool:
+        """ Returns whether this wallet uses bech32 addresses.
+        :returns: a boolean, True if addresses are bech32 encoded.
+        """
+        return self._bech32
+
+    @bech32.setter
+    def bech32(self, value: bool) -> None:
+        """ Sets the address encoding, and drops any memoized addresses
+        that were encoded the other way.
+        :param value: a boolean, True if addresses should be bech32 encoded.
+        """
+        if value != self._bech32:
+            self._bech32 = value
+            self._reset_keychains()
+
+    def _reset_keychains(self) -> None:
+        """ (Re)builds the memoized key tables for both key roots. """
+        self.spend_keys = KeyChain(self.root_spend_key, self.bech32,
+                                   max_size=Wallet._KEY_CACHE_SIZE)
+        self.change_keys = KeyChain(self.root_change_key, self.bech32,
+                                    max_size=Wallet._KEY_CACHE_SIZE)
+        for change in (False, True):
+            self._ready[change] = collections.deque()
+            self._ready_end[change] = 0
+
+    def get_derived_key(self, index: int, change: bool) -> DerivedKey:
+        """ Returns the memoized key table entry for a given index.
+
+        :param index: The index of the desired key
+        :param change: a boolean indicating which key root to use
+        :returns: a DerivedKey holding the key, scripthash and address
+        """
+        keychain = self.change_keys if change else self.spend_keys  # type: KeyChain
+        return keychain.get(index)
+
+    def derive_range(self, change: bool, start: int, count: int) -> List[DerivedKey]:
+        """ Returns the memoized key table entries for a range of indicies,
+        deriving any missing ones as a single batch.
+
+        :param change: a boolean indicating which key root to use
+        :param start: The first index of the range
+        :param count: The number of indicies in the range
+        :returns: a list of DerivedKeys, in index order
+        """
+        keychain = self.change_keys if change else self.spend_keys  # type: KeyChain
+        return keychain.derive_range(start, count)
+
     def get_key(self, index: int, change: bool) -> SegwitBIP32Node:
         """ Returns a specified pycoin.key object.
 
@@ -328,8 +1261,118 @@ class Wallet:
         :param change: a boolean indicating which key root to use
         :returns: a key object associated with the given index
         """
-        root_key = self.root_change_key if change else self.root_spend_key  # type: SegwitBIP32Node
-        return root_key.subkey(index)
+        keychain = self.change_keys if change else self.spend_keys  # type: KeyChain
+        return keychain.get_node(index)
+
+    def _first_unused_index(self, change: bool) -> int:
+        indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
+        for i, is_used in enumerate(indicies):
+            if not is_used:
+                return i
+        return len(indicies)
+
+    def _highest_used_index(self, change: bool) -> int:
+        indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
+        for i in range(len(indicies) - 1, -1, -1):
+            if indicies[i]:
+                return i
+        return -1
+
+    async def prederive(self, change: bool = False) -> None:
+        """ Coroutine. Derives keys in a worker thread until there are
+        lookahead keys beyond the highest used index ready to hand out.
+        Keys are derived a small chunk at a time, so the key table is only
+        ever locked briefly while each chunk is published.
+
+        :param change: a boolean indicating which key root to use
+        """
+        keychain = self.change_keys if change else self.spend_keys  # type: KeyChain
+        while True:
+            start = max(self._ready_end[change],
+                        self._first_unused_index(change))  # type: int
+            count = min(self._highest_used_index(change) + 1 + self.lookahead - start,
+                        Wallet._PREDERIVE_CHUNK)  # type: int
+            if count <= 0:
+                return
+            derived_keys = await self.loop.run_in_executor(
+                None, keychain.derive_range, start, count)  # type: List[DerivedKey]
+            current = self.change_keys if change else self.spend_keys  # type: KeyChain
+            if keychain is not current:
+                return  # The address encoding changed while we were deriving
+            self._ready[change].extend(derived_keys)
+            self._ready_end[change] = start + count
+            logging.debug("Pre-derived keys %s-%s. change=%s",
+                          start, start + count - 1, change)
+
+    def _schedule_prederive(self, change: bool) -> None:
+        task = self._prederiving.get(change)  # type: asyncio.Future
+        if task is None or task.done():
+            self._prederiving[change] = asyncio.ensure_future(
+                self.prederive(change), loop=self.loop)
+
+    def _watch(self, scripthash: str) -> None:
+        """ Subscribes to a key handed out after discovery. A subscription
+        that fails is retried after _RESUBSCRIBE_DELAY seconds, and a status
+        the server already has for the key is dispatched like any other.
+
+        :param scripthash: the scripthash of the key to watch
+        """
+        def retry(err: Exception) -> None:
+            logging.warning("Subscribing to %s failed, retrying: %r", scripthash, err)
+            self.loop.call_later(Wallet._RESUBSCRIBE_DELAY, self._watch, scripthash)
+
+        def done(future: asyncio.Future) -> None:
+            if self._watching.get(scripthash) is future:
+                del self._watching[scripthash]
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                retry(future.exception())
+            elif future.result() is not None:
+                asyncio.ensure_future(
+                    self.router.put([scripthash, future.result()]), loop=self.loop)
+
+        if scripthash in self._watching:
+            return
+        try:
+            future = self.connection.listen_subscribe(
+                self.methods["subscribe"], [scripthash])  # type: asyncio.Future
+        except Exception as err:
+            retry(err)
+            return
+        self._watching[scripthash] = future
+        future.add_done_callback(done)
+
+    def _next_unused(self, change: bool, using: bool) -> DerivedKey:
+        """ Returns the DerivedKey for the next unused index, taken from the
+        keys that were derived ahead of time whenever there are any.
+
+        :param change: a boolean indicating which key root to use
+        :param using: a boolean indicating whether to mark key as used now
+        :returns: a DerivedKey associated with the next unused index
+        """
+        indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
+        ready = self._ready[change]  # type: Deque[DerivedKey]
+        while ready and ready[0].index < len(indicies) and indicies[ready[0].index]:
+            ready.popleft()
+        if ready:
+            derived = ready.popleft() if using else ready[0]  # type: DerivedKey
+        else:
+            derived = self.get_derived_key(self._first_unused_index(change), change)
+        if not using:
+            return derived
+
+        if derived.index >= len(indicies):
+            # Handing out a key beyond the known ones, so watch for it too
+            new_keys = self.derive_range(
+                change, len(indicies),
+                derived.index + 1 - len(indicies))  # type: List[DerivedKey]
+            for new_key in new_keys:
+                indicies.append(False)
+                self._watch(new_key.scripthash)
+        indicies[derived.index] = True
+        self._schedule_prederive(change)
+        return derived
 
     def get_next_unused_key(self, change: bool = False, using: bool = False) -> SegwitBIP32Node:
         """ Returns the next unused key object in the sequence.
@@ -338,13 +1381,17 @@ class Wallet:
         :param using: a boolean indicating whether to mark key as used now
         :returns: a key object associated with the next unused index
         """
-        indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
-        for i, is_used in enumerate(indicies):
-            if not is_used:
-                if using:
-                    indicies[i] = True
-                return self.get_key(i, change)
-        return None
+        return self.get_key(self._next_unused(change, using).index, change)
+
+    def get_next_unused_address(self, change: bool = False, using: bool = False) -> str:
+        """ Returns the next unused address in the sequence. Unlike
+        get_next_unused_key(), this never has to derive a key node.
+
+        :param change: a boolean indicating which key root to use
+        :param using: a boolean indicating whether to mark address as used now
+        :returns: an address associated with the next unused index
+        """
+        return self._next_unused(change, using).address
 
     def get_address(self, key: SegwitBIP32Node, addr=False) -> str:
         """ Returns the segwit address for a given key.
@@ -364,8 +1411,9 @@ class Wallet:
             for the given root
         """
         indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
-        return [self.get_address(self.get_key(i, change), addr=addr)
-                for i in range(len(indicies))]  # type: List[str]
+        derived_keys = self.derive_range(change, 0, len(indicies))  # type: List[DerivedKey]
+        return [derived.address if addr else derived.scripthash
+                for derived in derived_keys]
 
     def get_all_used_addresses(self) -> List[str]:
         """ Returns all addresses that have been used previously.
@@ -382,10 +1430,25 @@ class Wallet:
         :param search: the address to search for
         :returns: a key index associated with the given address.
         """
-        addresses = self.get_all_known_addresses(change, addr=addr)
-        for i, addr in enumerate(addresses):
-            if addr == search:
-                return i
+        keychain = self.change_keys if change else self.spend_keys  # type: KeyChain
+        indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
+        index = keychain.find(search)  # type: int
+        if index is not None and index < len(indicies):
+            return index
+        return None
+
+    def lookup(self, search) -> Tuple[bool, int]:
+        """ Returns the key root and index associated with a given
+        scripthash, address or scriptPubKey if it is currently known
+        to us, otherwise returns None.
+
+        :param search: the scripthash, address or scriptPubKey to search for
+        :returns: a (change, index) tuple associated with the given search term.
+        """
+        for change in (False, True):
+            index = self.search_for_index(search, change=change)  # type: int
+            if index is not None:
+                return change, index
         return None
 
     def search_for_key(self, search, addr=True, change=False) -> SegwitBIP32Node:
@@ -396,7 +1459,7 @@ class Wallet:
         :returns: a SegWitBIP32Node associated with the given address.
         """
         index = self.search_for_index(search, addr=addr, change=change)
-        if index:
+        if index is not None:
             return self.get_key(index, change)
         return None
 
@@ -427,17 +1490,85 @@ class Wallet:
         history.sort(reverse=True, key=lambda h: h.timestamp)
         return history
 
-    async def _get_history(self, txids: List[str]) -> List[Tx]:
+    @staticmethod
+    def electrum_status(history: List[Tuple[str, int]]) -> str:
+        """ Computes the Electrum status hash of a scripthash's history.
+
+        :param history: (txid, height) pairs, in the server's order
+        :returns: the hex status hash, or None for an empty history
+        """
+        if not history:
+            return None
+        return hashlib.sha256("".join(
+            "{}:{}:".format(txid, height) for txid, height in history
+        ).encode("ascii")).hexdigest()
+
+    def _record_history(self, scripthash: str,
+                        history: List[Dict[str, Any]], status: str) -> None:
+        """ Remembers a scripthash's history as the server sent it,
+        and the status hash the server sent with it.
+        """
+        self.scripthash_history[scripthash] = [
+            (tx["tx_hash"], tx["height"]) for tx in history]
+        self.statuses[scripthash] = status
+
+    def status_matches(self, scripthash: str, status: str) -> bool:
+        """ Checks a status hash from the server against the last one it
+        sent for a scripthash, and failing that against the one our own
+        copy of its history hashes to. If either matches, we already have
+        everything the server has for it.
+
+        :param scripthash: the scripthash the status is for
+        :param status: the status hash sent by the server
+        :returns: True if our history is up to date
+        """
+        if scripthash in self.statuses and self.statuses[scripthash] == status:
+            return True
+        return Wallet.electrum_status(
+            self.scripthash_history.get(scripthash, [])) == status
+
+    async def _get_history(self, txids: List[str],
+                           heights: Dict[str, int] = None) -> List[Tx]:
         """ Coroutine. Returns a list of pycoin.tx.Tx objects
-        associated with the given txids.
+        associated with the given txids. Only txs that aren't
+        in our tx cache are fetched from the server.
 
         :param txids: a list of txid strings to retrieve tx histories for
+        :param heights: the known block height of each txid, confirmed txs
+            are kept in the cache's on-disk tier if it has one
         :returns: Future, a list of Tx objects
+        :raise: Raises a ConnectionError if the server sends a malformed
+            txid, or a tx that doesn't match its txid
         """
-        futures = [self.connection.listen_rpc(
-            self.methods["get"], [txid]) for txid in txids]  # type: str
-        results = await asyncio.gather(*futures, loop=self.loop)
-        txs = [Tx.from_hex(tx_hex) for tx_hex in results]  # type: List[Tx]
+        heights = heights or {}
+        for txid in txids:
+            if not is_txid(txid):
+                raise ConnectionError("Server sent a malformed txid {!r}".format(txid))
+        found = {}  # type: Dict[str, Tx]
+        for txid in txids:
+            if txid not in found:
+                tx = self.tx_cache.get(txid)  # type: Tx
+                if tx is not None:
+                    found[txid] = tx
+                    if heights.get(txid, 0) > 0:
+                        # It may have been cached while it was still pending
+                        self.tx_cache.confirm(txid)
+        missing = [txid for txid in collections.OrderedDict.fromkeys(txids)
+                   if txid not in found]  # type: List[str]
+
+        if missing:
+            results = await self.connection.batch_rpc(
+                [(self.methods["get"], [txid]) for txid in missing])  # type: List[str]
+            for txid, tx_hex in zip(missing, results):
+                raw = bytes.fromhex(tx_hex)  # type: bytes
+                tx = Tx.from_bin(raw)
+                if tx.id() != txid:
+                    raise ConnectionError(
+                        "Server sent the wrong tx for {}".format(txid))
+                found[txid] = tx
+                self.tx_cache.put(txid, raw, confirmed=heights.get(txid, 0) > 0, tx=tx)
+
+        txs = [found[txid] for txid in txids]  # type: List[Tx]
         logging.debug("Retrieved Txs: %s", txs)
         return txs
 
@@ -450,6 +1581,15 @@ class Wallet:
         result = await self.connection.listen_rpc(
             self.methods["get_balance"], [address])  # type: Dict[str, Any]
         logging.debug("Retrieved a balance for address: %s", address)
+        return Wallet._parse_balance(result)
+
+    @staticmethod
+    def _parse_balance(result: Dict[str, Any]) -> Tuple[Decimal, Decimal]:
+        """ Converts a get_balance response into Decimal balances.
+
+        :param result: a get_balance response from the server
+        :returns: a tuple of Decimals representing the balances.
+        """
         confirmed = \
             Decimal(str(result["confirmed"])) / Wallet.COIN  # type: Decimal
         zeroconf = \
@@ -466,22 +1606,72 @@ class Wallet:
         logging.debug("Retrieving utxos for address %s", address)
 
         result = await self.connection.listen_rpc(
-            self.methods["listunspent"], [address])  # type: Dict
-        pos_map = {unspent["tx_hash"]: unspent["tx_pos"]
-                   for unspent in result}  # type: Dict[str, int]
-        futures = [self.connection.listen_rpc(self.methods["get"], [unspent["tx_hash"]])
-                   for unspent in result]  # type: List[asyncio.Future]
-        txs = await asyncio.gather(*futures, loop=self.loop)  # type: List[str]
+            self.methods["listunspent"], [address])  # type: List[Dict[str, Any]]
+        txs = await self._get_history(
+            [unspent["tx_hash"] for unspent in result],
+            {unspent["tx_hash"]: unspent["height"] for unspent in result})  # type: List[Tx]
+        return Wallet._spendables_for(result, txs)
+
+    @staticmethod
+    def _spendables_for(unspents: List[Dict[str, Any]], txs: List[Tx]) -> List[Spendable]:
+        """ Picks the Spendables named by a listunspent response
+        out of their Tx objects.
 
+        :param unspents: a listunspent response from the server
+        :param txs: the Tx object for each unspent, in the same order
+        :returns: a list of pycoin Spendable objects.
+        """
         utxos = []  # type: List[Spendable]
-        for tx_hex in txs:
-            tx = Tx.from_hex(tx_hex)  # type: Tx
-            vout = pos_map[tx.id()]  # type: int
-            spendable = tx.tx_outs_as_spendable()[vout]  # type: Spendable
+        for unspent, tx in zip(unspents, txs):
+            spendable = Spendable.from_tx_out(
+                tx.txs_out[unspent["tx_pos"]], tx.hash(), unspent["tx_pos"])  # type: Spendable
             utxos.append(spendable)
             logging.debug("Retrieved utxo: %s", spendable)
         return utxos
 
+    @staticmethod
+    def _utxos_from_history(derived: DerivedKey, txs: List[Tx]) -> List[Spendable]:
+        """ Works out a key's utxos from its own history, as every output
+        that pays the key's script, less every outpoint that one of the
+        history's inputs spends. A Tx spending from a script is always in
+        that script's history, so nothing else is needed.
+
+        :param derived: the key to find utxos for
+        :param txs: the Tx objects of the key's whole history
+        :returns: a list of pycoin Spendable objects.
+        """
+        spent = set((txin.previous_hash, txin.previous_index)
+                    for tx in txs for txin in tx.txs_in)  # type: Set[Tuple[bytes, int]]
+        utxos = []  # type: List[Spendable]
+        for tx in txs:
+            tx_hash = None  # type: bytes
+            for i, txout in enumerate(tx.txs_out):
+                if txout.script != derived.script:
+                    continue
+                tx_hash = tx_hash or tx.hash()
+                if (tx_hash, i) not in spent:
+                    utxos.append(Spendable.from_tx_out(txout, tx_hash, i))
+        return utxos
+
+    async def _checked_utxos(self, derived: DerivedKey, txs: List[Tx],
+                             balance: Dict[str, Any]) -> List[Spendable]:
+        """ Coroutine. Returns a key's utxos, worked out from its history and
+        checked against the balance the server reports for it. If they
+        disagree, the server's listunspent is used instead.
+
+        :param derived: the key to find utxos for
+        :param txs: the Tx objects of the key's whole history
+        :param balance: a get_balance response from the server for the key
+        :returns: Future, a list of pycoin Spendable objects.
+        """
+        utxos = Wallet._utxos_from_history(derived, txs)  # type: List[Spendable]
+        if sum(utxo.coin_value for utxo in utxos) != \
+                balance["confirmed"] + balance["unconfirmed"]:
+            logging.warning("Utxos for %s don't match the server's balance, "
+                            "using listunspent", derived.address)
+            return await self._get_utxos(derived.scripthash)
+        return utxos
+
     def _get_spend_value(self, tx: Tx) -> int:
         """ Finds the value of the txout in the given Tx object that is
         associated with our spend.
@@ -489,16 +1679,26 @@ class Wallet:
         :param tx: A Tx object given from our transaction history
         :returns: The coin value associated with our spend output.
         """
-        change_addrs = \
-            self.get_all_known_addresses(change=True)  # type: List[str]
         chg_vout = None  # type: int
         for i, txout in enumerate(tx.txs_out):
-            address = txout.address(netcode=self.chain.netcode)  # type: str
-            if address in change_addrs:
+            if self.search_for_index(txout.script, change=True) is not None:
                 chg_vout = i
         spend_vout = 0 if chg_vout == 1 else 1  # type: int
         return tx.txs_out[spend_vout].coin_value
 
+    def _revalue_spends(self) -> None:
+        """ Recomputes the value of every spend in our history. Which output
+        of a spend is our change can only be told once the change key root
+        has been discovered, which may not have happened yet when the spend
+        was first processed.
+        """
+        for hist_dict in (self.history, self.change_history):
+            for entry in hist_dict.values():
+                for hist in entry["txns"]:
+                    if hist.is_spend:
+                        hist.value = Decimal(
+                            str(self._get_spend_value(hist.tx_obj))) / Wallet.COIN
+
     async def _process_history(self, history: Tx, address: str, height: int) -> History:
         """ Coroutine. Creates a _History namedtuple from a given Tx object.
 
@@ -521,58 +1721,83 @@ class Wallet:
                               is_spend=is_spend,
                               value=decimal_value,
                               height=height)  # type: History
-        await history_obj.get_timestamp(self.connection)
+        await history_obj.get_timestamp(self.header_cache)
         logging.debug("Processed history object: %s", history_obj)
         return history_obj
 
-    async def _interpret_history(self, statuses: List[str], change: bool = False) -> bool:
-        """ Populates the wallet's data structures based on a list of tx histories.
-        Should only be called by discover_keys(),
+    def _mark_window(self, statuses: List[str],
+                     change: bool = False) -> List[Tuple[DerivedKey, str]]:
+        """ Marks the next window of key indicies as used or unused.
+        Should only be called by _discover_keys(), once per window, in order.
 
         :param statuses: a list of address statuses from the server
         :param change: a boolean indicating which key index list to use
-        :returns: A boolean that is true if all given histories were empty
+        :returns: the used keys in the window, with their statuses
         """
         indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
-        history_dict = self.change_history if change \
-            else self.history  # type: Dict[Any]
-
-        is_empty = True  # type: bool
-        # Each iteration represents one key index
+        used = []  # type: List[Tuple[DerivedKey, str]]
         for status in statuses:
-            if not status:
-                # Mark this index as unused
-                indicies.append(False)
-                continue
-
-            index = len(indicies)
-            # Get key/address for current index
-            key = self.get_key(index, change)  # type: SegwitBIP32Node
-            scripthash = self.get_address(key)  # type: str
-            address = self.get_address(key, addr=True)  # type: str
-
-            history = await self.connection.listen_rpc(
-                    self.methods["get_history"], [scripthash])  # type: List[Any]
+            if status:
+                used.append((self.get_derived_key(len(indicies), change), status))
+            indicies.append(bool(status))
+        return used
 
-            # Reassign historic info for this index
-            txids = [tx["tx_hash"] for tx in history]  # type: List[str]
-            heights = [tx["height"] for tx in history]  # type: List[int]
+    async def _interpret_history(self, used: List[Tuple[DerivedKey, str]],
+                                 change: bool = False) -> None:
+        """ Populates the wallet's data structures for the used keys of a
+        window. Should only be called by _discover_keys(),
 
-            # Get Tx objects
-            this_history = await self._get_history(txids)  # type: List[Tx]
-
-            # Process all Txs into our History objects
-            futures = [self._process_history(hist, address, heights[i])
-                       for i, hist in enumerate(this_history)]  # type: List[Awaitable[History]]
-            processed_history = await asyncio.gather(
-                *futures, loop=self.loop)  # type: List[History]
+        :param used: the used keys of a window, with their statuses
+        :param change: a boolean indicating which key index list to use
+        """
+        history_dict = self.change_history if change \
+            else self.history  # type: Dict[Any]
 
+        # Fetch history and balance for every used index in one batch
+        requests = []  # type: List[Tuple[str, List]]
+        for derived, _ in used:
+            for method in ("get_history", "get_balance"):
+                requests.append((self.methods[method], [derived.scripthash]))
+        results = await self.connection.batch_rpc(requests)  # type: List[Any]
+        histories = results[0::2]  # type: List[List[Dict[str, Any]]]
+        balances = results[1::2]  # type: List[Dict[str, Any]]
+
+        # Get all Tx objects for this window at once
+        heights = {}  # type: Dict[str, int]
+        for item in [tx for history in histories for tx in history]:
+            heights[item["tx_hash"]] = item["height"]
+        txids = list(heights)  # type: List[str]
+        txs = dict(zip(txids, await self._get_history(txids, heights)))  # type: Dict[str, Tx]
+
+        # Get every block header this window needs at once
+        await self.header_cache.prefetch(
+            [height for height in heights.values() if height > 0])
+
+        for (derived, status), history in zip(used, histories):
+            self._record_history(derived.scripthash, history, status)
+            if not self.status_matches(derived.scripthash, status):
+                logging.debug("History of %s changed during discovery",
+                              derived.scripthash)
+
+        # Process every used index's Txs into our History objects at once
+        processed = await asyncio.gather(*[
+            asyncio.gather(*[
+                self._process_history(txs[tx["tx_hash"]], derived.address, tx["height"])
+                for tx in history
+            ], loop=self.loop) for (derived, _), history in zip(used, histories)
+        ], loop=self.loop)  # type: List[List[History]]
+
+        # Work out every used index's utxos from its own history
+        utxos = await asyncio.gather(*[
+            self._checked_utxos(derived, [txs[tx["tx_hash"]] for tx in history], balance)
+            for (derived, _), history, balance in zip(used, histories, balances)
+        ], loop=self.loop)  # type: List[List[Spendable]]
+
+        for (derived, _), processed_history, balance, utxo_list in zip(
+                used, processed, balances, utxos):
             if processed_history:
-                # Get balance information
-                t = await self._get_balance(scripthash)  # type: Tuple[Decimal, Decimal]
-                confirmed, zeroconf = t
-
-                history_dict[index] = {
+                confirmed, zeroconf = Wallet._parse_balance(balance)
+                history_dict[derived.index] = {
                     "balance": {
                         "confirmed": confirmed,
                         "zeroconf": zeroconf
@@ -580,152 +1805,288 @@ class Wallet:
                     "txns": processed_history
                 }
 
-            # Add utxos to our list
-            self.utxos.extend(await self._get_utxos(scripthash))
-
-            # Mark this index as used since it has a history
-            indicies.append(True)
-            is_empty = False
+            # Add utxos to our set
+            for utxo in utxo_list:
+                self.utxos.add(utxo, heights.get(b2h_rev(utxo.tx_hash), 0) > 0)
 
         # Adjust our balances
         self._update_wallet_balance()
 
-        return is_empty
-
-    async def _interpret_new_history(self, scripthash: str, history: Dict[str, Any]) -> bool:
-        """ Coroutine, Populates the wallet's data structures based on a new
-        new tx history. Should only be called by _dispatch_result(),
-
-        :param address: the address associated with this new tx history
-        :param history: a history message from the server
-        :param change: a boolean indicating which key index list to use
-        :returns: A boolean that is true if all given histories were empty
-        """
-        change = False  # type: bool
-        is_empty = True  # type: bool
-
-        if history:
-            logging.info("Interpreting new history..")
-            index = self.search_for_index(scripthash)  # type: int
-            if index is None:
-                change = True
-                index = self.search_for_index(scripthash, change=change)
-                assert index is not None, "Recieving to unknown address. CRITICAL ERROR"
-            address = self.get_address(self.get_key(index, change), addr=True)
-
-            logging.info("New history is for address: {}".format(address))
-            logging.info("New history is for change: {}".format(change))
-
-            indicies = self.change_indicies if change \
-                else self.spend_indicies  # type: List[int]
-            hist_dict = self.change_history if change \
-                else self.history  # type: Dict[str, Any]
-            address = self.get_address(
-                self.get_key(index, change), addr=True)  # type: str
-
-            # Reassign historic info for new history
-            txid = history["tx_hash"]  # type: str
-            height = history["height"]  # type: int
-
-            # Get Tx object and process into our History object
-            tx_list = await self._get_history([txid])  # type: List[Tx]
-            new_history = await self._process_history(
-                tx_list.pop(), address, height)  # type: History
-
-            # Add History object to our history dict
-            if index in hist_dict:
-                hist_list = hist_dict[index]["txns"]
-                did_match = False
-                for i, hist in enumerate(hist_list):
-                    if str(new_history.tx_obj) == str(hist.tx_obj):
-                        hist_list[i] = new_history
-                        did_match = True
-                if not did_match:
-                    hist_list.append(new_history)
-            else:
-                hist_dict[index] = {
-                    "balance": {
-                        "confirmed": None,
-                        "zeroconf": None
-                    },
-                    "txns": [new_history]
-                }
-
-            # Get/update balance for this index, then for the wallet
-            conf, zconf = await self._get_balance(scripthash)
-            current_balance = hist_dict[index]["balance"]
-            current_balance["confirmed"] = conf
-            current_balance["zeroconf"] = zconf
-            self._update_wallet_balance()
-
-            # Add new utxo to our list if not already spent
-            # type: List[Spendable]
-            new_utxos = await self._get_utxos(scripthash)
-            spents_str = [str(spent) for spent in self.spent_utxos]
-            for utxo in new_utxos:
-                if str(utxo) not in spents_str:
-                    self.utxos.append(utxo)
+    async def _interpret_new_history(self, scripthash: str,
+                                     history: List[Dict[str, Any]]) -> bool:
+        """ Coroutine, Brings the wallet's data structures up to date with a
+        scripthash's new tx history, by diffing it against the txids and
+        heights we already hold. Only new Txs are fetched, Txs whose height
+        changed just have it updated, and the balance is read once.
+        Should only be called by _dispatch_result(),
+
+        :param scripthash: the scripthash associated with this new tx history
+        :param history: a get_history response from the server
+        :returns: A boolean that is true if nothing in the history was new
+        """
+        known = dict(self.scripthash_history.get(scripthash, []))  # type: Dict[str, int]
+        heights = collections.OrderedDict(
+            (tx["tx_hash"], tx["height"]) for tx in history)  # type: Dict[str, int]
+        new = [txid for txid in heights if txid not in known]  # type: List[str]
+        moved = [txid for txid in heights
+                 if txid in known and known[txid] != heights[txid]]  # type: List[str]
+        gone = [txid for txid in known if txid not in heights]  # type: List[str]
+        if not (new or moved or gone):
+            return True
+
+        found = self.lookup(scripthash)  # type: Tuple[bool, int]
+        assert found is not None, "Recieving to unknown address. CRITICAL ERROR"
+        change, index = found
+        derived = self.get_derived_key(index, change)  # type: DerivedKey
+        address = derived.address  # type: str
+        logging.info("New history for address %s, change=%s: %s new, %s moved, %s gone",
+                     address, change, len(new), len(moved), len(gone))
+
+        indicies = self.change_indicies if change \
+            else self.spend_indicies  # type: List[int]
+        hist_dict = self.change_history if change \
+            else self.history  # type: Dict[str, Any]
+
+        balance = await self.connection.listen_rpc(
+            self.methods["get_balance"], [scripthash])  # type: Dict[str, Any]
+
+        # Get only the new Tx objects, and every header we need, at once
+        txs = await self._get_history(new, heights)  # type: List[Tx]
+        for txid in moved:
+            if heights[txid] > 0:
+                self.tx_cache.confirm(txid)
+        await self.header_cache.prefetch(
+            [heights[txid] for txid in new + moved if heights[txid] > 0])
+        new_history = await asyncio.gather(*[
+            self._process_history(tx, address, heights[txid])
+            for txid, tx in zip(new, txs)
+        ], loop=self.loop)  # type: List[History]
+
+        # Apply the diff to this index's History objects
+        entry = hist_dict.setdefault(index, {
+            "balance": {
+                "confirmed": None,
+                "zeroconf": None
+            },
+            "txns": []
+        })  # type: Dict[str, Any]
+        by_txid = collections.OrderedDict(
+            (hist.tx_obj.id(), hist) for hist in entry["txns"])  # type: Dict[str, History]
+        by_txid.update(zip(new, new_history))
+        for txid in moved:
+            hist = by_txid.get(txid)  # type: History
+            if hist is not None:
+                hist.height = heights[txid]
+                await hist.get_timestamp(self.header_cache)
+        for txid in gone:
+            by_txid.pop(txid, None)
+        entry["txns"] = list(by_txid.values())
+
+        # Update balance for this index, then for the wallet
+        conf, zconf = Wallet._parse_balance(balance)
+        entry["balance"]["confirmed"] = conf
+        entry["balance"]["zeroconf"] = zconf
+        self._update_wallet_balance()
 
-            # Mark this index as used
-            indicies[index] = True
+        # Work out this address's utxos again from its whole history, which
+        # is all in our tx cache by now, and replace its old ones
+        new_utxos = await self._checked_utxos(
+            derived, await self._get_history(list(heights), heights),
+            balance)  # type: List[Spendable]
+        self.utxos.replace_script(derived.script, [
+            (utxo, heights.get(b2h_rev(utxo.tx_hash), 0) > 0) for utxo in new_utxos])
 
-            is_empty = False
-        return is_empty
+        # Mark this index as used
+        indicies[index] = True
+        self._schedule_prederive(change)
+        return False
 
     async def _discover_keys(self, change: bool = False) -> None:
         """ Iterates through key indicies (_GAP_LIMIT) at a time and retrieves tx
         histories from the server, then populates our data structures using
         _interpret_history, Should be called once for each key root.
 
+        Scanning is pipelined. The subscriptions for the next scan_ahead
+        windows are sent before the current window's statuses are looked at,
+        and each used window's histories are fetched in the background while
+        later windows are scanned. Scanning stops at the first empty window,
+        and the windows sent speculatively beyond it are unsubscribed again,
+        so that no more than _GAP_LIMIT unused indicies are ever kept.
+
         :param change: a boolean indicating which key index list to use
         """
         logging.info("Discovering transaction history. change=%s", change)
-        current_index = 0  # type: int
-        quit_flag = False  # type: bool
-        while not quit_flag:
-            futures = []  # type: List[Awaitable]
-            for i in range(current_index, current_index + Wallet._GAP_LIMIT):
-                addr = self.get_address(self.get_key(i, change))  # type: str
-                futures.append(self.connection.listen_subscribe(
-                    self.methods["subscribe"], [addr]))
-
-            result = await asyncio.gather(
-                *futures, loop=self.loop)  # type: List[Dict[str, Any]]
-            quit_flag = await self._interpret_history(result, change)
-            current_index += Wallet._GAP_LIMIT
+        next_index = 0  # type: int
+        more = True  # type: bool
+        # (window, subscription batch) pairs, in index order
+        pending = collections.deque()  # type: Deque[Tuple[List[DerivedKey], asyncio.Future]]
+        fetches = []  # type: List[asyncio.Future]
+        try:
+            while more:
+                while len(pending) <= self.scan_ahead:
+                    window = self.derive_range(
+                        change, next_index, Wallet._GAP_LIMIT)  # type: List[DerivedKey]
+                    pending.append((window, asyncio.ensure_future(self.connection.batch_rpc(
+                        [(self.methods["subscribe"], [derived.scripthash])
+                         for derived in window]), loop=self.loop)))
+                    next_index += Wallet._GAP_LIMIT
+                # Only drop the window once it has been looked at, so that
+                # it is unsubscribed along with the rest if this is cancelled
+                statuses = await pending[0][1]  # type: List[str]
+                pending.popleft()
+                used = self._mark_window(statuses, change)  # type: List[Tuple[DerivedKey, str]]
+                more = bool(used)
+                if used:
+                    fetches.append(asyncio.ensure_future(
+                        self._interpret_history(used, change), loop=self.loop))
+            await asyncio.gather(*fetches, loop=self.loop)
+        except BaseException:
+            for future in [future for _, future in pending] + fetches:
+                future.cancel()
+            if pending:
+                asyncio.ensure_future(self._unsubscribe(
+                    [derived for window, _ in pending for derived in window]), loop=self.loop)
+            raise
+        for _, future in pending:
+            future.cancel()
+        await self._unsubscribe([derived for window, _ in pending for derived in window])
+        indicies = self.change_indicies if change else self.spend_indicies  # type: List[bool]
+        logging.info("Scanned %s indicies, change=%s", len(indicies), change)
         self.new_history = True
 
+    async def _unsubscribe(self, derived_keys: List[DerivedKey]) -> None:
+        """ Coroutine. Tells the server we no longer want notifications for
+        some keys. Servers too old to support it keep sending them, and
+        those are ignored as they aren't for known keys.
+
+        :param derived_keys: the keys to unsubscribe from
+        """
+        if not derived_keys:
+            return
+        try:
+            await self.connection.batch_rpc(
+                [(self.methods["unsubscribe"], [derived.scripthash])
+                 for derived in derived_keys])
+        except Exception as err:
+            logging.debug("Could not unsubscribe %s keys: %r", len(derived_keys), err)
+
+    async def derive_keys_parallel(self, count: int,
+                                   executor: concurrent.futures.Executor = None) -> None:
+        """ Coroutine. Derives the first count keys of both key roots across
+        a process pool, so that wallets with many used addresses don't
+        rebuild their key tables one core at a time.
+
+        :param count: the number of indicies to derive for each key root
+        :param executor: a ProcessPoolExecutor to derive with, a new one is
+            created and shut down if None
+        """
+        own_executor = executor is None  # type: bool
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor()
+        start_time = time.time()  # type: float
+        try:
+            await asyncio.gather(*[
+                keychain.derive_parallel(0, count, self.loop, executor)
+                for keychain in (self.spend_keys, self.change_keys)
+            ], loop=self.loop)
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
+        logging.info("Derived {} keys in {:.3f} seconds".format(
+            2 * count, time.time() - start_time))
+
     # @log_time_elapsed  TODO: Figure out how to use a decorator on a coroutine method
-    async def discover_all_keys(self) -> None:
-        """ Calls discover_keys for change and spend keys. """
-        logging.info("Begin discovering tx history...")
-        for change in (False, True):
+    async def discover_all_keys(self, expected_keys: int = 0) -> None:
+        """ Calls discover_keys for change and spend keys, both at once.
+        Their requests share our connection's window, so running them
+        together doesn't put any more load on a server.
+
+        :param expected_keys: roughly how many indicies each key root has
+            used, these are derived up front in parallel if given
+        """
+        async def discover(change: bool) -> None:
             await self._discover_keys(change=change)
+            self._schedule_prederive(change)
+
+        if expected_keys > Wallet._GAP_LIMIT:
+            await self.derive_keys_parallel(expected_keys)
+        logging.info("Begin discovering tx history...")
+        await asyncio.gather(discover(False), discover(True), loop=self.loop)
+        self._revalue_spends()
+        self._update_wallet_balance()
 
     async def listen_to_addresses(self) -> None:
         """ Coroutine, adds all known addresses to the subscription queue, and
         begins consuming the queue so we can recieve new tx histories from
-        the server asynchronously.
+        the server asynchronously. If any part of that stops, the rest is
+        cancelled and its error is raised here.
+
+        :raise: Raises a ConnectionError if a lone Connection is lost
         """
         logging.debug("Listening for updates involving any known address...")
-        await self.connection.consume_queue(self._dispatch_result)
+        tasks = [asyncio.ensure_future(coro, loop=self.loop) for coro in (
+            self.connection.consume_queue(self.router.put),
+            self.router.run(),
+            self._listen_to_headers(),
+            self._watch_connection())]  # type: List[asyncio.Future]
+        try:
+            done, _ = await asyncio.wait(
+                tasks, loop=self.loop, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            task.result()
+
+    async def _watch_connection(self) -> None:
+        """ Coroutine. Keeps our connection healthy. A ConnectionPool fails
+        over by itself, but a lone Connection can't, so rather than serve
+        stale data we raise once it is gone.
+
+        :raise: Raises a ConnectionError if the server is lost for good
+        """
+        await self.connection.monitor()
+        raise ConnectionError("Lost connection to the Electrum server")
+
+    async def _listen_to_headers(self) -> None:
+        """ Coroutine. Follows the chain tip, so that our header cache can
+        drop any headers that a reorg replaced.
+        """
+        future, queue = self.connection.subscribe(
+            self.methods["subscribe_headers"], [])
+        tip = await future  # type: Dict[str, Any]
+        while True:
+            self.header_cache.set_tip(tip["height"], bytes.fromhex(tip["hex"]))
+            tip = (await queue.get())[0]
 
     async def _dispatch_result(self, result: List[str]) -> None:
-        """ Gets called by the Connection's consume_queue method when a new tx
-        history is sent from the server, then populates data structures using
+        """ Gets called by our SubscriptionRouter when a new tx history is
+        sent from the server, then populates data structures using
         _interpret_new_history().
 
-        :param result: an address that has some new tx history
+        :param result: an address that has some new tx history, and its
+            new status hash. Nothing is fetched if the status hash matches
+            the history we already have.
         """
         addr = result[0]  # type: str
+        status = result[1] if len(result) > 1 else None  # type: str
+        if self.lookup(addr) is None:
+            # A key scanned speculatively past the gap limit
+            logging.debug("Ignoring status of unknown scripthash %s", addr)
+            return
+        if self.status_matches(addr, status):
+            self.statuses[addr] = status
+            logging.debug("Status of %s is unchanged, not refetching", addr)
+            return
+
         history = await self.connection.listen_rpc(
             self.methods["get_history"], [addr])  # type: List[Dict[str, Any]]
-        for tx in history:
-            empty_flag = await self._interpret_new_history(
-                addr, tx)  # type: bool
-            if not empty_flag:
-                self.new_history = True
-                logging.info("Dispatched a new history for address %s", addr)
+        empty_flag = await self._interpret_new_history(
+            addr, history)  # type: bool
+        if not empty_flag:
+            self.new_history = True
+            logging.info("Dispatched a new history for address %s", addr)
+        self._record_history(addr, history, status)
 
     @staticmethod
     def _calculate_vsize(tx: Tx) -> int:
@@ -820,28 +2181,21 @@ class Wallet:
 
         spendables = []  # type: List[Spendable]
         in_addrs = set()  # type: Set[str]
-        del_indexes = []  # type: List[int]
-
-        # Sort utxos based on current fee rate before coin selection
-        self.utxos.sort(key=lambda utxo: utxo.coin_value,
-                        reverse=not is_high_fee)
-
-        # Collect enough utxos for this spend
-        # Add them to spent list and delete them from utxo list
-        for i, utxo in enumerate(self.utxos):
-            if total_out < amount + fee_highball:
-                self.spent_utxos.append(utxo)
-                spendables.append(utxo)
-                in_addrs.add(utxo.address(self.chain.netcode))
-                del_indexes.append(i)
-                total_out += utxo.coin_value
-        self.utxos = [utxo for i, utxo in enumerate(self.utxos)
-                      if i not in del_indexes]
+
+        # Collect enough utxos for this spend, in value order based on
+        # the current fee rate, then mark them as spent
+        for utxo in self.utxos.by_value(reverse=not is_high_fee):
+            if total_out >= amount + fee_highball:
+                break
+            spendables.append(utxo)
+            in_addrs.add(utxo.address(self.chain.netcode))
+            total_out += utxo.coin_value
+        for utxo in spendables:
+            self.utxos.spend(utxo)
 
         # Get change address, mark index as used, and create payables list
-        change_key = self.get_next_unused_key(
-            change=True, using=True)  # type: SegwitBIP32Node
-        change_addr = self.get_address(change_key, addr=True)  # type: str
+        change_addr = self.get_next_unused_address(
+            change=True, using=True)  # type: str
         payables = []  # type: List[Tuple[str, int]]
         payables.append((out_addr, amount))
         payables.append((change_addr, 0))
@@ -904,17 +2258,17 @@ class Wallet:
         redeem_scripts = {}  # type: Dict[bytes, bytes]
         wifs = []  # type: List[str]
 
-        # Search our indicies for keys used, given in in_addrs list
+        # Look up the keys used, given in in_addrs list
         # Populate lists with our privkeys and redeemscripts
-        for change in (True, False):
-            addresses = self.get_all_known_addresses(change, addr=True)
-            for i, addr in enumerate(addresses):
-                key = self.get_key(i, change)  # type: SegwitBIP32Node
-                if addr in in_addrs:
-                    p2aw_script = key.p2wpkh_script()  # type: bytes
-                    script_hash = key.p2wpkh_script_hash()  # type: bytes
-                    redeem_scripts[script_hash] = p2aw_script
-                    wifs.append(key.wif())
+        for addr in in_addrs:
+            found = self.lookup(addr)  # type: Tuple[bool, int]
+            if found is None:
+                continue
+            key = self.get_key(found[1], found[0])  # type: SegwitBIP32Node
+            p2aw_script = key.p2wpkh_script()  # type: bytes
+            script_hash = key.p2wpkh_script_hash()  # type: bytes
+            redeem_scripts[script_hash] = p2aw_script
+            wifs.append(key.wif())
 
         # Include our total fee and sign the Tx
         distribute_from_split_pool(unsigned_tx, fee)
@@ -973,26 +2327,35 @@ class Wallet:
         :param broadcast: a boolean saying whether to broadcast the tx
         :returns: (The txid of) our new tx, the total fee, and the vsize
         :raise: Raises a base Exception if we can't afford the fee
+        :raise: Raises a ValueError if this wallet is watch-only
         """
+        if self.watch_only:
+            raise ValueError("Can't spend from a watch-only wallet")
         is_high_fee = Wallet.coinkb_to_satb(coin_per_kb) > 100
 
         # type: Tuple[Tx, Set[str], int]
         t1 = self._mktx(address, amount, is_high_fee, rbf=rbf)
         tx, in_addrs, chg_vout = t1
-        t2 = self._get_fee(tx, coin_per_kb)  # type: Tuple[int, int]
-        fee, tx_vsize = t2
-
-        decimal_fee = Decimal(str(fee)) / Wallet.COIN  # type: Decimal
-        total_out = amount + decimal_fee
-        if total_out > self.balance:
-            raise Exception("Insufficient funds.")
-
-        self._signtx(tx, in_addrs, fee)
-        if not broadcast:
-            return tx.as_hex(), chg_vout, decimal_fee, tx_vsize
-
-        chg_out = tx.txs_out[chg_vout]  # type: TxOut
-        txid = await self.broadcast(tx.as_hex(), chg_out)  # type: str
+        try:
+            t2 = self._get_fee(tx, coin_per_kb)  # type: Tuple[int, int]
+            fee, tx_vsize = t2
+
+            decimal_fee = Decimal(str(fee)) / Wallet.COIN  # type: Decimal
+            total_out = amount + decimal_fee
+            if total_out > self.balance:
+                raise Exception("Insufficient funds.")
+
+            self._signtx(tx, in_addrs, fee)
+            if not broadcast:
+                return tx.as_hex(), chg_vout, decimal_fee, tx_vsize
+
+            chg_out = tx.txs_out[chg_vout]  # type: TxOut
+            txid = await self.broadcast(tx.as_hex(), chg_out)  # type: str
+        except Exception:
+            # The Tx was never sent, so its utxos can still be spent
+            for utxo in tx.unspents:
+                self.utxos.unspend(utxo)
+            raise
         return txid, decimal_fee, tx_vsize
 
     async def broadcast(self, tx_hex: str, chg_out: TxOut) -> str:
@@ -1005,9 +2368,7 @@ class Wallet:
         scripthash = self.get_address(change_key)
 
         logging.info("Subscribing to new change address...")
-        self.connection.listen_subscribe(
-            self.methods["subscribe"], [scripthash])
-        logging.info("Finished subscribing to new change address...")
+        self._watch(scripthash)
         return txid
 
     async def replace_by_fee(self, hist_obj: History, coin_per_kb: float) -> str:
@@ -1018,7 +2379,10 @@ class Wallet:
         :param hist_obj: a History object from our tx history data
         :param coin_per_kb: a new fee rate given in whole coins per KB
         :returns: The txid of our new tx, given after a successful broadcast
+        :raise: Raises a ValueError if this wallet is watch-only
         """
+        if self.watch_only:
+            raise ValueError("Can't spend from a watch-only wallet")
         t = self._create_replacement_tx(
             hist_obj)  # type: Tuple[Tx, Set[str], int]
         tx, in_addrs = t[:2]
@@ -1043,24 +2407,23 @@ class Wallet:
         str_.append("\nHistory:\n{}".format(
             pprinter.pformat(self.get_tx_history())))
         str_.append("\nUTXOS:\n{}".format(
-            pprinter.pformat(self.utxos)))
+            pprinter.pformat(list(self.utxos))))
         str_.append("\nBalance: {} ({} unconfirmed) {}".format(
             float(self.balance), float(self.zeroconf_balance),
             self.chain.chain_1209k.upper()))
         str_.append("\nYour current address: {}".format(
-            self.get_address(self.get_next_unused_key(), addr=True)))
+            self.get_next_unused_address()))
         return "".join(str_)
 
 
-async def get_random_server(loop: asyncio.AbstractEventLoop,
-                            use_api: bool = False) -> List[Any]:
-    """ Grabs a random Electrum server from a list that it
-    gets from our REST api.
+async def get_servers(loop: asyncio.AbstractEventLoop,
+                      use_api: bool = False) -> List[List[Any]]:
+    """ Gets a list of Electrum servers from our REST api,
+    or from the local json file if that fails.
 
-    :param chain: Our current chain info
+    :param loop: an asyncio event loop
     :param use_api: Should we try using the API to get servers?
-    :returns: A server info list for a random Electrum server
-    :raise: Raises a base Exception if there are no servers up on 1209k
+    :returns: A list of server info lists
     """
     servers = None
     if use_api:
@@ -1081,7 +2444,184 @@ async def get_random_server(loop: asyncio.AbstractEventLoop,
     if not servers:
         logging.warning("No electrum servers found!")
         servers = load_servers_json()
-    return random.choice(servers)
+    return servers
+
+
+async def get_random_server(loop: asyncio.AbstractEventLoop,
+                            use_api: bool = False) -> List[Any]:
+    """ Grabs a random Electrum server from a list that it
+    gets from our REST api.
+
+    :param chain: Our current chain info
+    :param use_api: Should we try using the API to get servers?
+    :returns: A server info list for a random Electrum server
+    """
+    return random.choice(await get_servers(loop, use_api=use_api))
+
+
+PROBE_BUDGET = 10  # type: float
+PROBE_TIMEOUT = 30  # type: float
+PROBE_EXTRA = 3  # type: int
+LAG_COST = 5.0  # type: float
+
+
+async def probe_server(connection: Connection) -> Tuple[float, int]:
+    """ Coroutine. Connects to a server, which includes the server.version
+    handshake, then asks it for the chain tip.
+
+    :param connection: an unconnected Connection object
+    :returns: Future, a tuple of the seconds it all took and the tip height
+    """
+    start = time.monotonic()  # type: float
+    await connection.do_connect()
+    connected = time.monotonic()  # type: float
+    future, queue = connection.subscribe("blockchain.headers.subscribe", [])
+    header = await future  # type: Dict[str, Any]
+    # The wallet subscribes for itself later, don't leave a queue filling up
+    connection.client.subscriptions["blockchain.headers.subscribe"].remove(queue)
+    finished = time.monotonic()  # type: float
+    logging.debug("Probed %s: connect %.2fs, round trip %.2fs, height %s",
+                  connection.server, connected - start, finished - connected,
+                  header["height"])
+    return finished - start, header["height"]
+
+
+async def select_servers(connections: List[Connection],
+                         count: int,
+                         scores: ServerScores,
+                         loop: asyncio.AbstractEventLoop,
+                         budget: float = None,
+                         timeout: float = None) -> List[Connection]:
+    """ Coroutine. Probes candidate servers all at once and keeps the best.
+    Each probe costs its connect time and round trip, plus a penalty for
+    every block its tip is behind the best tip seen. We stop waiting as
+    soon as count probes have answered, or once the time budget runs out,
+    unless nothing has answered yet, in which case we wait for the first
+    answer until the timeout. Probes still running then are cancelled and
+    count as slow. Every result is recorded in the score table.
+
+    :param connections: unconnected Connection objects to probe
+    :param count: how many servers to keep
+    :param scores: the ServerScores table to record results in
+    :param loop: an asyncio event loop
+    :param budget: how many seconds to give the probes
+    :param timeout: how many seconds to wait in all for a first answer
+    :returns: Future, up to count connected Connections, best first
+    :raise: Re-raises the first error if no probe succeeds, or raises
+        a ConnectionError if none finishes before the timeout
+    """
+    budget = PROBE_BUDGET if budget is None else budget
+    start = loop.time()  # type: float
+    deadline = start + max(budget, PROBE_TIMEOUT if timeout is None
+                           else timeout)  # type: float
+    tasks = {asyncio.ensure_future(probe_server(conn), loop=loop): conn
+             for conn in connections}  # type: Dict[asyncio.Future, Connection]
+    done = set()  # type: Set[asyncio.Future]
+    pending = set(tasks)  # type: Set[asyncio.Future]
+    answered = 0  # type: int
+    while pending and answered < count:
+        remaining = (start + budget if answered else deadline) - loop.time()  # type: float
+        if remaining <= 0:
+            break
+        more, pending = await asyncio.wait(
+            pending, timeout=remaining, loop=loop,
+            return_when=asyncio.FIRST_COMPLETED)
+        done |= more
+        answered += sum(1 for task in more if task.exception() is None)
+    for task in pending:
+        task.cancel()
+        tasks[task].close()
+        scores.record(tasks[task].server_info_list, budget)
+
+    results = {}  # type: Dict[Connection, Tuple[float, int]]
+    for task in done:
+        if task.exception() is None:
+            results[tasks[task]] = task.result()
+        else:
+            logging.warning("Probe of %s failed: %r",
+                            tasks[task].server, task.exception())
+            scores.record_failure(tasks[task].server_info_list)
+    if not results:
+        scores.save()
+        if done:
+            raise next(iter(done)).exception()
+        raise ConnectionError("No Electrum server answered in time")
+
+    tip = max(height for _, height in results.values())  # type: int
+    costs = {conn: elapsed + LAG_COST * (tip - height)
+             for conn, (elapsed, height) in results.items()}  # type: Dict[Connection, float]
+    for conn, cost in costs.items():
+        scores.record(conn.server_info_list, cost)
+    scores.save()
+
+    ranked = sorted(costs, key=costs.get)  # type: List[Connection]
+    for conn in ranked[count:]:
+        conn.close()
+    logging.info("Selected %s", ", ".join(
+        "{} ({:.2f}s)".format(conn.server, costs[conn]) for conn in ranked[:count]))
+    return ranked[:count]
+
+
+async def get_ranked_servers(loop: asyncio.AbstractEventLoop,
+                             scores: ServerScores,
+                             use_api: bool = False) -> List[List[Any]]:
+    """ Coroutine. Gets the list of Electrum servers, best scoring first.
+    Servers with equal scores, like ones we have never probed, are shuffled.
+
+    :param loop: an asyncio event loop
+    :param scores: the ServerScores table to rank by
+    :param use_api: Should we try using the API to get servers?
+    :returns: Future, a sorted list of server info lists
+    """
+    servers = await get_servers(loop, use_api=use_api)  # type: List[List[Any]]
+    return scores.rank(random.sample(servers, len(servers)))
+
+
+async def get_connection(loop: asyncio.AbstractEventLoop,
+                         use_api: bool = False,
+                         scores: ServerScores = None) -> Connection:
+    """ Coroutine. Probes the best scoring Electrum servers and connects
+    to the one that answers best.
+
+    :param loop: an asyncio event loop
+    :param use_api: Should we try using the API to get servers?
+    :param scores: the ServerScores table to use, the default file if None
+    :returns: Future, a connected Connection object
+    """
+    scores = scores or ServerScores(ServerScores.DEFAULT_PATH)
+    servers = await get_ranked_servers(loop, scores, use_api)  # type: List[List[Any]]
+    connections = await select_servers([
+        Connection(loop, server, port, proto)
+        for server, port, proto in servers[:1 + PROBE_EXTRA]
+    ], 1, scores, loop)  # type: List[Connection]
+    return connections[0]
+
+
+async def get_connection_pool(loop: asyncio.AbstractEventLoop,
+                              size: int = 3,
+                              use_api: bool = False,
+                              scores: ServerScores = None) -> ConnectionPool:
+    """ Coroutine. Probes the best scoring Electrum servers, and a few more,
+    all at once, and pools connections to the size best of them.
+    The rest are kept as spares, best scoring first.
+
+    :param loop: an asyncio event loop
+    :param size: how many servers to connect to
+    :param use_api: Should we try using the API to get servers?
+    :param scores: the ServerScores table to use, the default file if None
+    :returns: Future, a connected ConnectionPool object
+    """
+    scores = scores or ServerScores(ServerScores.DEFAULT_PATH)
+    servers = await get_ranked_servers(loop, scores, use_api)  # type: List[List[Any]]
+    connections = await select_servers([
+        Connection(loop, server, port, proto)
+        for server, port, proto in servers[:size + PROBE_EXTRA]
+    ], size, scores, loop)  # type: List[Connection]
+    chosen = [conn.server_info_list for conn in connections]
+    pool = ConnectionPool(connections, loop, spares=scores.rank(
+        [server for server in servers if list(server) not in chosen]))  # type: ConnectionPool
+    await pool.do_connect()
+    return pool
 
 
 def load_servers_json() -> List[List[Any]]:
@@ -0,0 +1,184 @@
+import os
+import time
+import json
+import hashlib
+from typing import Dict, Any
+
+from Crypto.Cipher import AES
+
+from .keys import scrypt_key
+
+
+class ResumeCache:
+    """ ResumeCache object. An opt-in, device-local cache of a wallet's
+    extended account key, encrypted under a PIN so that reopening the
+    same wallet can skip the Warpwallet key stretch.
+
+    The PIN is stretched with memory-hard scrypt, together with a random
+    per-install secret that is kept in a separate file, by default in the
+    user's home directory rather than next to the cache. A copy of the
+    cache file alone can't be brute-forced, but anyone who can read both
+    files can try PINs offline, so a PIN is still far weaker than the
+    passphrase: use a long one. Entries always expire, and are wiped as
+    soon as they are found expired, or after MAX_ATTEMPTS wrong PINs.
+    """
+
+    VERSION = 2  # type: int
+    DEFAULT_TTL = 60 * 60  # type: int
+    MAX_ATTEMPTS = 3  # type: int
+    DEFAULT_SECRET_PATH = os.path.join(
+        os.path.expanduser("~"), ".nowallet_resume_secret")  # type: str
+    _SECRET_SIZE = 32  # type: int
+    _PIN_SCRYPT_N = 1 << 16  # type: int
+    _PIN_SCRYPT_R = 8  # type: int
+
+    def __init__(self, path: str = "nowallet.resume", ttl: int = None,
+                 secret_path: str = None) -> None:
+        """ ResumeCache object constructor.
+
+        :param path: the file to keep the encrypted key in
+        :param ttl: how many seconds a saved key stays valid for
+        :param secret_path: the file to keep the per-install secret in
+        :returns: A new ResumeCache object
+        """
+        self.path = path  # type: str
+        self.ttl = ResumeCache.DEFAULT_TTL if ttl is None else ttl  # type: int
+        self.secret_path = secret_path \
+            or ResumeCache.DEFAULT_SECRET_PATH  # type: str
+
+    @staticmethod
+    def _fingerprint(identity: str) -> str:
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _secret(self, create: bool = False) -> bytes:
+        """ Returns the per-install secret, making one if asked to,
+        or None if there isn't one.
+        """
+        try:
+            with open(self.secret_path, "rb") as infile:
+                secret = infile.read()  # type: bytes
+            if len(secret) == ResumeCache._SECRET_SIZE:
+                return secret
+        except OSError:
+            pass
+        if not create:
+            return None
+        secret = os.urandom(ResumeCache._SECRET_SIZE)
+        fd = os.open(self.secret_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(secret)
+        return secret
+
+    @staticmethod
+    def _pin_key(pin: str, salt: bytes, secret: bytes) -> bytes:
+        return scrypt_key(pin.encode("utf-8"), salt + secret, 32,
+                          n=ResumeCache._PIN_SCRYPT_N, r=ResumeCache._PIN_SCRYPT_R)
+
+    def save(self, hwif: str, pin: str, identity: str) -> None:
+        """ Encrypts and stores an extended private key, replacing any
+        previously cached key.
+
+        :param hwif: the account's extended private key
+        :param pin: the PIN to encrypt it under
+        :param identity: a string identifying the wallet the key belongs to
+        :raise: Raises a ValueError if the PIN is empty
+        """
+        if not pin:
+            raise ValueError("PIN is empty")
+        fingerprint = self._fingerprint(identity)  # type: str
+        expires = int(time.time()) + self.ttl  # type: int
+        kdf_salt = os.urandom(16)  # type: bytes
+
+        cipher = AES.new(self._pin_key(pin, kdf_salt, self._secret(create=True)),
+                         AES.MODE_GCM)
+        cipher.update("{}:{}".format(fingerprint, expires).encode("utf-8"))
+        data, tag = cipher.encrypt_and_digest(hwif.encode("utf-8"))
+
+        entry = {
+            "version": ResumeCache.VERSION,
+            "id": fingerprint,
+            "expires": expires,
+            "kdf_salt": kdf_salt.hex(),
+            "nonce": cipher.nonce.hex(),
+            "tag": tag.hex(),
+            "data": data.hex(),
+            "failures": 0
+        }  # type: Dict[str, Any]
+        self._write(entry)
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as outfile:
+            json.dump(entry, outfile)
+
+    def load(self, pin: str, identity: str) -> str:
+        """ Returns the cached extended private key for the given wallet if
+        there is one, otherwise returns None. Expired entries are wiped,
+        and so is an entry once MAX_ATTEMPTS wrong PINs have been tried.
+
+        :param pin: the PIN the key was encrypted under
+        :param identity: a string identifying the wallet the key belongs to
+        :returns: The extended private key, or None
+        :raise: Raises a ValueError if the PIN is wrong
+        """
+        try:
+            with open(self.path, "r") as infile:
+                entry = json.load(infile)  # type: Dict[str, Any]
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("version") != ResumeCache.VERSION \
+                or entry.get("expires", 0) <= time.time():
+            self.wipe()
+            return None
+        if entry.get("id") != self._fingerprint(identity):
+            return None
+        secret = self._secret()  # type: bytes
+        if secret is None:
+            # Without the secret the entry can never be decrypted again
+            self.wipe()
+            return None
+
+        key = self._pin_key(pin, bytes.fromhex(entry["kdf_salt"]), secret)  # type: bytes
+        cipher = AES.new(key, AES.MODE_GCM, nonce=bytes.fromhex(entry["nonce"]))
+        cipher.update("{}:{}".format(entry["id"], entry["expires"]).encode("utf-8"))
+        try:
+            hwif = cipher.decrypt_and_verify(
+                bytes.fromhex(entry["data"]), bytes.fromhex(entry["tag"]))  # type: bytes
+        except ValueError:
+            entry["failures"] = entry.get("failures", 0) + 1
+            if entry["failures"] >= ResumeCache.MAX_ATTEMPTS:
+                self.wipe()
+                raise ValueError("Bad PIN entered, too many times. "
+                                 "Log in with your passphrase.")
+            self._write(entry)
+            raise ValueError("Bad PIN entered.")
+        if entry.get("failures"):
+            entry["failures"] = 0
+            self._write(entry)
+        return hwif.decode("utf-8")
+
+    def purge(self) -> None:
+        """ Wipes the cache file if its entry has expired, or can't be read. """
+        try:
+            with open(self.path, "r") as infile:
+                entry = json.load(infile)  # type: Dict[str, Any]
+        except OSError:
+            return
+        except ValueError:
+            entry = {}
+        if entry.get("version") != ResumeCache.VERSION \
+                or entry.get("expires", 0) <= time.time():
+            self.wipe()
+
+    def wipe(self) -> None:
+        """ Overwrites and removes the cache file, if there is one. """
+        try:
+            size = os.path.getsize(self.path)  # type: int
+            with open(self.path, "r+b") as outfile:
+                outfile.write(b"\0" * size)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.remove(self.path)
+        except OSError:
+            pass
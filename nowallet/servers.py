@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import logging
+from typing import Dict, List, Any
+
+
+class ServerScores:
+    """ ServerScores object. A persisted table of how well each Electrum
+    server answered when we last probed it, in seconds of cost, lower is
+    better. A new probe is blended into the old score, and an old score
+    decays back towards the prior as it ages, so a server that was slow
+    once isn't shunned forever and one that was fast long ago isn't
+    trusted forever.
+    """
+
+    DEFAULT_PATH = "server_scores.json"  # type: str
+    PRIOR = 5.0  # type: float
+    FAILURE_COST = 60.0  # type: float
+    WEIGHT = 0.5  # type: float
+    HALF_LIFE = 3 * 24 * 60 * 60  # type: int
+
+    def __init__(self, path: str = None) -> None:
+        """ ServerScores object constructor.
+
+        :param path: a json file to load scores from and save them to,
+            or None to keep them in memory only
+        :returns: A new ServerScores object
+        """
+        self.path = path  # type: str
+        # server key -> [cost, time of last probe]
+        self._scores = {}  # type: Dict[str, List[float]]
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r") as infile:
+                    self._scores = {key: [float(cost), float(when)]
+                                    for key, (cost, when) in json.load(infile).items()}
+            except (OSError, ValueError, TypeError) as err:
+                logging.warning("Ignoring unreadable server scores: %s", err)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, server: List[Any]) -> bool:
+        return ServerScores.key(server) in self._scores
+
+    @staticmethod
+    def key(server: List[Any]) -> str:
+        """ Returns the table key for a server info list.
+
+        :param server: a [hostname, port, proto] server info list
+        :returns: a string naming the server
+        """
+        hostname, port, proto = server
+        return "{}:{}:{}".format(hostname, port, proto)
+
+    def score(self, server: List[Any], now: float = None) -> float:
+        """ Returns a server's current score, decayed for its age.
+
+        :param server: a [hostname, port, proto] server info list
+        :param now: the current unix time, defaults to time.time()
+        :returns: the server's cost in seconds, or the prior if never probed
+        """
+        entry = self._scores.get(ServerScores.key(server))  # type: List[float]
+        if entry is None:
+            return ServerScores.PRIOR
+        cost, when = entry
+        age = max(0.0, (time.time() if now is None else now) - when)  # type: float
+        decay = 0.5 ** (age / ServerScores.HALF_LIFE)  # type: float
+        return ServerScores.PRIOR + (cost - ServerScores.PRIOR) * decay
+
+    def record(self, server: List[Any], cost: float, now: float = None) -> None:
+        """ Blends a new probe result into a server's score.
+
+        :param server: a [hostname, port, proto] server info list
+        :param cost: what the probe cost, in seconds
+        :param now: the current unix time, defaults to time.time()
+        """
+        now = time.time() if now is None else now
+        if server in self:
+            old = self.score(server, now)  # type: float
+            cost = old + (cost - old) * ServerScores.WEIGHT
+        self._scores[ServerScores.key(server)] = [cost, now]
+
+    def record_failure(self, server: List[Any], now: float = None) -> None:
+        """ Records a probe that failed outright.
+
+        :param server: a [hostname, port, proto] server info list
+        :param now: the current unix time, defaults to time.time()
+        """
+        self.record(server, ServerScores.FAILURE_COST, now)
+
+    def rank(self, servers: List[List[Any]], now: float = None) -> List[List[Any]]:
+        """ Sorts servers best first. Servers with equal scores keep their order.
+
+        :param servers: a list of server info lists
+        :param now: the current unix time, defaults to time.time()
+        :returns: a new, sorted list of server info lists
+        """
+        now = time.time() if now is None else now
+        return sorted(servers, key=lambda server: self.score(server, now))
+
+    def save(self) -> None:
+        """ Writes the table to its json file, if it has one. """
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"  # type: str
+        try:
+            with open(tmp_path, "w") as outfile:
+                json.dump(self._scores, outfile)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            logging.warning("Could not save server scores: %s", err)
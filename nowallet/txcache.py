@@ -0,0 +1,180 @@
+import os
+import re
+import collections
+from typing import Dict, List
+
+from pycoin.tx.Tx import Tx
+
+_TXID = re.compile("[0-9a-f]{64}")
+
+
+def is_txid(txid: str) -> bool:
+    """ Checks that a string is a well formed txid, 64 lowercase hex
+    characters, so it is safe to use as a file name.
+
+    :param txid: the string to check
+    :returns: True if it is a well formed txid
+    """
+    return isinstance(txid, str) and _TXID.fullmatch(txid) is not None
+
+
+class TxCache:
+    """ TxCache object. A txid keyed cache of raw transactions, shared by
+    discovery, utxo lookups and notification handling so that each
+    transaction is only downloaded once. Raw bytes are kept in a memory
+    bounded LRU table, and are only parsed into pycoin Tx objects when
+    asked for. A parsed Tx is counted against the bound too, at an
+    estimated PARSED_COST times the size of its raw bytes. Confirmed
+    transactions can also be kept in an on-disk tier, so they are never
+    fetched again, even across runs.
+
+    The on-disk tier records which transactions belong to this wallet, so
+    it is off unless a path is given.
+    """
+
+    DEFAULT_MAX_BYTES = 16 * 1024 * 1024  # type: int
+    # Roughly how many times its raw size a parsed Tx takes in memory
+    PARSED_COST = 5  # type: int
+
+    def __init__(self, max_bytes: int = None, path: str = None) -> None:
+        """ TxCache object constructor.
+
+        :param max_bytes: the most memory to hold transactions in, in bytes
+        :param path: a directory to keep confirmed transactions in,
+            or None for a memory only cache
+        :returns: A new, empty TxCache object
+        """
+        self.max_bytes = TxCache.DEFAULT_MAX_BYTES \
+            if max_bytes is None else max_bytes  # type: int
+        self.path = path  # type: str
+        if path is not None:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+
+        # txid -> [raw bytes, parsed Tx or None]
+        self._entries = collections.OrderedDict()  # type: Dict[str, List]
+        self._size = 0  # type: int
+        self.hits = 0  # type: int
+        self.misses = 0  # type: int
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, txid: str) -> bool:
+        if not is_txid(txid):
+            return False
+        return txid in self._entries or (
+            self.path is not None and os.path.exists(self._disk_path(txid)))
+
+    def _disk_path(self, txid: str) -> str:
+        if not is_txid(txid):
+            raise ValueError("Not a txid: {!r}".format(txid))
+        return os.path.join(self.path, txid)
+
+    @staticmethod
+    def _cost(entry: List) -> int:
+        raw, tx = entry
+        return len(raw) * (1 + TxCache.PARSED_COST if tx is not None else 1)
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= TxCache._cost(entry)
+
+    def put(self, txid: str, raw: bytes, confirmed: bool = False, tx: Tx = None) -> None:
+        """ Adds a raw transaction to the cache.
+
+        :param txid: the transaction's id
+        :param raw: the serialized transaction
+        :param confirmed: a boolean, True if the transaction is in a block,
+            confirmed transactions are also written to the on-disk tier
+        :param tx: the already parsed Tx object, if there is one
+        :raise: Raises a ValueError if txid isn't a well formed txid
+        """
+        if not is_txid(txid):
+            raise ValueError("Not a txid: {!r}".format(txid))
+        if txid in self._entries:
+            self._size -= TxCache._cost(self._entries.pop(txid))
+        self._entries[txid] = [raw, tx]
+        self._size += TxCache._cost(self._entries[txid])
+        self._evict()
+
+        if confirmed:
+            self._write(txid, raw)
+
+    def _write(self, txid: str, raw: bytes) -> None:
+        if self.path is None:
+            return
+        path = self._disk_path(txid)  # type: str
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp"  # type: str
+            with open(tmp_path, "wb") as outfile:
+                outfile.write(raw)
+            os.replace(tmp_path, path)
+
+    def confirm(self, txid: str) -> None:
+        """ Marks a cached transaction as confirmed, writing it to the
+        on-disk tier if it was only held in memory while it was pending.
+
+        :param txid: the transaction's id
+        """
+        entry = self._entries.get(txid)  # type: List
+        if entry is not None:
+            self._write(txid, entry[0])
+
+    def _load(self, txid: str) -> List:
+        if not is_txid(txid):
+            return None
+        entry = self._entries.get(txid)  # type: List
+        if entry is not None:
+            self._entries.move_to_end(txid)
+            return entry
+        if self.path is None:
+            return None
+        try:
+            with open(self._disk_path(txid), "rb") as infile:
+                raw = infile.read()  # type: bytes
+        except OSError:
+            return None
+
+        try:
+            tx = Tx.from_bin(raw)  # type: Tx
+        except Exception:
+            tx = None
+        if tx is None or tx.id() != txid:
+            os.remove(self._disk_path(txid))
+            return None
+        self.put(txid, raw, tx=tx)
+        return self._entries.get(txid, [raw, tx])
+
+    def get_raw(self, txid: str) -> bytes:
+        """ Returns the raw transaction for a given txid if it is cached,
+        otherwise returns None.
+
+        :param txid: the transaction's id
+        :returns: the serialized transaction, or None
+        """
+        entry = self._load(txid)  # type: List
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def get(self, txid: str) -> Tx:
+        """ Returns the parsed Tx object for a given txid if it is cached,
+        otherwise returns None. Each transaction is only parsed once.
+
+        :param txid: the transaction's id
+        :returns: a pycoin Tx object, or None
+        """
+        entry = self._load(txid)  # type: List
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        tx = entry[1]  # type: Tx
+        if tx is None:
+            tx = entry[1] = Tx.from_bin(entry[0])
+            self._size += len(entry[0]) * TxCache.PARSED_COST
+            self._evict()
+        return tx
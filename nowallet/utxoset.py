@@ -0,0 +1,190 @@
+import bisect
+from typing import Dict, List, Set, Tuple, Iterator
+
+from pycoin.tx.Spendable import Spendable
+
+Outpoint = Tuple[bytes, int]
+
+
+class UtxoSet:
+    """ UtxoSet object. The wallet's unspent outputs, keyed by outpoint,
+    i.e. (tx_hash, tx_out_index), so adding, spending and looking up a utxo
+    takes constant time however many there are. Each utxo is either
+    confirmed, pending (its Tx isn't in a block yet) or spent by a Tx of
+    ours that the server hasn't reported yet. Spent utxos are kept so that
+    a late notification can't hand them out again.
+
+    Iterating over the set yields the utxos that can still be spent. Those
+    are also kept sorted by value as they come and go, so coin selection
+    never has to sort them.
+    """
+
+    CONFIRMED = "confirmed"  # type: str
+    PENDING = "pending"  # type: str
+    SPENT = "spent"  # type: str
+
+    def __init__(self) -> None:
+        """ UtxoSet object constructor.
+        :returns: A new, empty UtxoSet object
+        """
+        self._utxos = {}  # type: Dict[Outpoint, Spendable]
+        self._states = {}  # type: Dict[Outpoint, str]
+        self._by_script = {}  # type: Dict[bytes, Set[Outpoint]]
+        self._unspent = 0  # type: int
+        # The state each spent utxo had before we spent it
+        self._spent_from = {}  # type: Dict[Outpoint, str]
+        # (coin_value, outpoint) for every utxo that can still be spent, sorted
+        self._sorted = []  # type: List[Tuple[int, Outpoint]]
+
+    @staticmethod
+    def outpoint(utxo: Spendable) -> Outpoint:
+        """ Returns the key a utxo is kept under.
+
+        :param utxo: a pycoin Spendable object
+        :returns: a (tx_hash, tx_out_index) tuple
+        """
+        return utxo.tx_hash, utxo.tx_out_index
+
+    def __len__(self) -> int:
+        return self._unspent
+
+    def __iter__(self) -> Iterator[Spendable]:
+        return (self._utxos[outpoint] for outpoint, state in self._states.items()
+                if state != UtxoSet.SPENT)
+
+    def __contains__(self, outpoint: Outpoint) -> bool:
+        return outpoint in self._utxos
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def get(self, outpoint: Outpoint) -> Spendable:
+        """ Returns the utxo kept under an outpoint, spent or not,
+        or None if there isn't one.
+
+        :param outpoint: a (tx_hash, tx_out_index) tuple
+        :returns: a pycoin Spendable object, or None
+        """
+        return self._utxos.get(outpoint)
+
+    def state(self, outpoint: Outpoint) -> str:
+        """ Returns the state of the utxo kept under an outpoint.
+
+        :param outpoint: a (tx_hash, tx_out_index) tuple
+        :returns: CONFIRMED, PENDING or SPENT, or None if there is no utxo
+        """
+        return self._states.get(outpoint)
+
+    def _sort_key(self, outpoint: Outpoint) -> Tuple[int, Outpoint]:
+        return self._utxos[outpoint].coin_value, outpoint
+
+    def _set_state(self, outpoint: Outpoint, state: str) -> None:
+        old = self._states.get(outpoint)  # type: str
+        if (old is None or old == UtxoSet.SPENT) and state != UtxoSet.SPENT:
+            self._unspent += 1
+            bisect.insort(self._sorted, self._sort_key(outpoint))
+        elif old not in (None, UtxoSet.SPENT) and state == UtxoSet.SPENT:
+            self._unspent -= 1
+            self._unsort(outpoint)
+        self._states[outpoint] = state
+
+    def _unsort(self, outpoint: Outpoint) -> None:
+        key = self._sort_key(outpoint)  # type: Tuple[int, Outpoint]
+        del self._sorted[bisect.bisect_left(self._sorted, key)]
+
+    def add(self, utxo: Spendable, confirmed: bool = True) -> None:
+        """ Adds a utxo, or updates whether it is confirmed. A utxo we have
+        already spent stays spent.
+
+        :param utxo: a pycoin Spendable object
+        :param confirmed: a boolean, True if the utxo's Tx is in a block
+        """
+        outpoint = UtxoSet.outpoint(utxo)  # type: Outpoint
+        state = UtxoSet.CONFIRMED if confirmed else UtxoSet.PENDING  # type: str
+        self._utxos[outpoint] = utxo
+        self._by_script.setdefault(utxo.script, set()).add(outpoint)
+        if self._states.get(outpoint) == UtxoSet.SPENT:
+            self._spent_from[outpoint] = state
+        else:
+            self._set_state(outpoint, state)
+
+    def spend(self, utxo: Spendable) -> None:
+        """ Marks a utxo as spent by one of our own Txs.
+
+        :param utxo: a pycoin Spendable object in this set
+        :raise: Raises a KeyError if the utxo isn't in this set
+        """
+        outpoint = UtxoSet.outpoint(utxo)  # type: Outpoint
+        if outpoint not in self._utxos:
+            raise KeyError(outpoint)
+        if self._states[outpoint] != UtxoSet.SPENT:
+            self._spent_from[outpoint] = self._states[outpoint]
+            self._set_state(outpoint, UtxoSet.SPENT)
+
+    def unspend(self, utxo: Spendable) -> None:
+        """ Undoes spend(), for a Tx of ours that was never sent.
+        The utxo goes back to being confirmed or pending, as it was.
+
+        :param utxo: a pycoin Spendable object in this set
+        :raise: Raises a KeyError if the utxo isn't in this set
+        """
+        outpoint = UtxoSet.outpoint(utxo)  # type: Outpoint
+        if outpoint not in self._utxos:
+            raise KeyError(outpoint)
+        if self._states[outpoint] == UtxoSet.SPENT:
+            self._set_state(outpoint, self._spent_from.pop(outpoint, UtxoSet.CONFIRMED))
+
+    def remove(self, outpoint: Outpoint) -> None:
+        """ Forgets the utxo kept under an outpoint, if there is one.
+
+        :param outpoint: a (tx_hash, tx_out_index) tuple
+        """
+        if outpoint not in self._utxos:
+            return
+        if self._states.pop(outpoint) != UtxoSet.SPENT:
+            self._unspent -= 1
+            self._unsort(outpoint)
+        self._spent_from.pop(outpoint, None)
+        utxo = self._utxos.pop(outpoint)  # type: Spendable
+        outpoints = self._by_script[utxo.script]  # type: Set[Outpoint]
+        outpoints.discard(outpoint)
+        if not outpoints:
+            del self._by_script[utxo.script]
+
+    def replace_script(self, script: bytes, utxos: List[Tuple[Spendable, bool]]) -> None:
+        """ Replaces every utxo paying one script with the ones the server
+        now knows of. Utxos we spent that the server still lists stay spent.
+
+        :param script: the scriptPubKey the utxos pay
+        :param utxos: (Spendable, confirmed) tuples for every utxo paying it
+        """
+        current = set(UtxoSet.outpoint(utxo) for utxo, _ in utxos)  # type: Set[Outpoint]
+        for outpoint in list(self._by_script.get(script, ())):
+            if outpoint not in current:
+                self.remove(outpoint)
+        for utxo, confirmed in utxos:
+            self.add(utxo, confirmed)
+
+    def spent(self) -> List[Spendable]:
+        """ Returns the utxos our own Txs have spent.
+        :returns: a list of pycoin Spendable objects
+        """
+        return [self._utxos[outpoint] for outpoint, state in self._states.items()
+                if state == UtxoSet.SPENT]
+
+    def by_value(self, reverse: bool = False) -> Iterator[Spendable]:
+        """ Iterates over the utxos that can still be spent, sorted by value,
+        without copying them. The set mustn't change while this iterates.
+
+        :param reverse: a boolean, True for the largest utxos first
+        :returns: an iterator of pycoin Spendable objects
+        """
+        keys = reversed(self._sorted) if reverse \
+            else iter(self._sorted)  # type: Iterator[Tuple[int, Outpoint]]
+        return (self._utxos[outpoint] for _, outpoint in keys)
+
+    def value(self) -> int:
+        """ Returns the total value of the utxos that can still be spent.
+        :returns: a value in satoshis
+        """
+        return sum(utxo.coin_value for utxo in self)
@@ -1,6 +1,8 @@
 import sys
 import json
 import asyncio
+import getpass
+import concurrent.futures
 import argparse
 
 from decimal import Decimal
@@ -16,23 +18,35 @@ class WalletDaemon:
         self.loop = _loop
         self.chain = nowallet.TBTC
 
-    async def initialize_wallet(self, _salt, _passphrase, bech32, rbf):
+    async def initialize_wallet(self, _salt, _passphrase, bech32, rbf, pin=None,
+                                expected_keys=0, tx_cache=None):
+        resume_cache = nowallet.resume.ResumeCache() if pin else None
+        if resume_cache is not None:
+            resume_cache.purge()
+        # The daemon runs where multiprocessing works, so stretch keys in
+        # processes, whichever key stretching backends are installed
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=2)
         try:
-            server, port, proto = await nowallet.get_random_server(self.loop)
-            connection = nowallet.Connection(self.loop, server, port, proto)
-            self.wallet = nowallet.Wallet(
-                _salt, _passphrase, connection, self.loop, self.chain)
-            await connection.do_connect()
+            self.wallet = await nowallet.Wallet.create(
+                _salt, _passphrase, self.loop, self.chain, executor=executor,
+                resume_cache=resume_cache, pin=pin)
         except (SocksConnectionError, ClientConnectorError):
             self.print_json({
                 "error": "Make sure Tor is installed and running before using nowalletd."
             })
             sys.exit(1)
+        except ValueError as err:
+            self.print_json({"error": str(err)})
+            sys.exit(1)
+        finally:
+            executor.shutdown(wait=False)
 
         self.wallet.bech32 = bech32
+        if tx_cache:
+            self.wallet.tx_cache = nowallet.txcache.TxCache(path=tx_cache)
         self.rbf = rbf
 
-        await self.wallet.discover_all_keys()
+        await self.wallet.discover_all_keys(expected_keys)
         self.print_history()
         self.wallet.new_history = False
 
@@ -91,8 +105,7 @@ class WalletDaemon:
             self.print_json({"error": "Command type is not supported"})
 
     def do_get_address(self):
-        key = self.wallet.get_next_unused_key()
-        address = self.wallet.get_address(key, addr=True)
+        address = self.wallet.get_next_unused_address()
         self.print_json({"address": address})
 
     async def do_get_feerate(self):
@@ -139,16 +152,27 @@ class WalletDaemon:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("salt", help="You must supply a salt to create a wallet.")
-    parser.add_argument("passphrase", help="You must supply a passphrase to create a wallet.")
+    parser.add_argument("passphrase", nargs="?",
+                        help="You must supply a passphrase to create a wallet, unless resuming.")
+    parser.add_argument("--pin", action="store_true",
+                        help="Ask for a PIN to cache the wallet under, " +
+                        "or to resume from the cache if no passphrase is given.")
     parser.add_argument("--bech32", help="Create a Bech32 wallet.", action="store_true")
     parser.add_argument("--rbf", help="Mark transactions as replaceable.", action="store_true")
+    parser.add_argument("--expected-keys", type=int, default=0,
+                        help="Derive this many addresses per chain up front, in parallel.")
+    parser.add_argument("--tx-cache", metavar="DIR",
+                        help="Keep confirmed transactions in this directory between runs.")
     args = parser.parse_args()
+    # Never take the PIN on the command line, where ps and shell history see it
+    pin = getpass.getpass("PIN: ", stream=sys.stderr) if args.pin else None
 
     loop = asyncio.get_event_loop()
     daemon = WalletDaemon(loop)
 
     loop.run_until_complete(daemon.initialize_wallet(
-        args.salt, args.passphrase, args.bech32, args.rbf))
+        args.salt, args.passphrase, args.bech32, args.rbf, pin,
+        args.expected_keys, args.tx_cache))
 
     tasks = asyncio.gather(
         asyncio.ensure_future(daemon.wallet.listen_to_addresses()),
@@ -164,6 +188,10 @@ if __name__ == "__main__":
         # number of tasks
         sys.exit(loop.run_until_complete(tasks))
 
+    except ConnectionError as err:
+        daemon.print_json({"error": str(err)})
+        sys.exit(1)
+
     except KeyboardInterrupt:
         # Optionally show a message if the shutdown may take a while
         print("\nAttempting graceful shutdown, press Ctrl+C again to exit...",
@@ -189,4 +217,6 @@ if __name__ == "__main__":
             loop.run_forever()
 
     finally:
+        if args.pin:
+            nowallet.resume.ResumeCache().purge()
         loop.close()
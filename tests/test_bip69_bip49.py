@@ -125,3 +125,16 @@ def test_bech32_segwitkey_address(segwitbip32node_from_chbs):
     address = segwitbip32node_from_chbs.bech32_p2wpkh_address()
     assert isinstance(address, str)
     assert address == "bc1pqq2wtwkpv674h8mzqjcmg0anccsejutycllqmc65qs"
+
+def test_segwitkey_from_segwit_hwif():
+    node = bip49.SegwitBIP32Node.from_master_secret(
+        b"CORRECT HORSE BATTERY STAPLE").public_copy()
+    xpub = node.hwif()
+    zpub = ("zpub6jftahH18ngZxaEPwB5D7XrtTsUYpeE5PifP1dw8Emt9Q3fwAev4CD22eS" +
+            "kj35KeUqpvpyd3Hqiajhem593PAPq6UCsweKaTMRN5CsvaqDj")
+    parsed, bech32 = bip49.SegwitBIP32Node.from_segwit_hwif(xpub)
+    assert parsed.hwif() == xpub
+    assert bech32 is None
+    parsed, bech32 = bip49.SegwitBIP32Node.from_segwit_hwif(zpub)
+    assert parsed.hwif() == xpub
+    assert bech32 is True
@@ -0,0 +1,57 @@
+import struct
+import asyncio
+
+import pytest
+
+from nowallet import headers
+
+def make_header(height, prev=b"\0" * 32):
+    return struct.pack("<I", 1) + prev + b"\0" * 32 + \
+        struct.pack("<III", 1500000000 + height, 0, 0)
+
+class FakeConnection:
+    def __init__(self, event_loop):
+        self.loop = event_loop
+        self.requests = []
+
+    async def batch_rpc(self, requests):
+        self.requests.extend(requests)
+        await asyncio.sleep(0, loop=self.loop)
+        return [{"count": count,
+                 "hex": b"".join(make_header(start + i) for i in range(count)).hex()}
+                for _, (start, count) in requests]
+
+@pytest.fixture
+def header_cache(event_loop):
+    return headers.HeaderCache(FakeConnection(event_loop), event_loop)
+
+def test_header_runs():
+    assert headers.HeaderCache._runs([1, 2, 3, 10, 100]) == [(1, 10), (100, 1)]
+    assert headers.HeaderCache._runs([0, 2016]) == [(0, 1), (2016, 1)]
+
+@pytest.mark.asyncio
+async def test_header_cache_prefetch(event_loop, header_cache):
+    heights = [500, 501, 500, 510, 9000] * 100
+    prefetch = asyncio.ensure_future(header_cache.prefetch(heights), loop=event_loop)
+    await asyncio.sleep(0, loop=event_loop)
+    assert await header_cache.get_timestamp(9000) == 1500009000
+    await prefetch
+    assert sorted(header_cache.connection.requests) == [
+        ("blockchain.block.headers", [500, 11]),
+        ("blockchain.block.headers", [9000, 1])]
+    assert await header_cache.get_timestamp(510) == 1500000510
+    assert len(header_cache.connection.requests) == 2
+
+@pytest.mark.asyncio
+async def test_header_cache_reorg(event_loop, header_cache):
+    await header_cache.prefetch(range(90, 100))
+    tip = make_header(100, headers.header_hash(make_header(99)))
+    header_cache.set_tip(100, tip)
+    assert 90 in header_cache and 100 in header_cache
+
+    header_cache.set_tip(100, tip)
+    assert 99 in header_cache
+    header_cache.set_tip(100, make_header(100))
+    assert 95 not in header_cache
+    assert 94 in header_cache
+    assert header_cache.tip == 100
@@ -0,0 +1,123 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+from nowallet import bip49, keychain
+
+@pytest.fixture
+def root_key():
+    secret = "CORRECT HORSE BATTERY STAPLE".encode("utf-8")
+    return bip49.SegwitBIP32Node.from_master_secret(secret)
+
+def test_derived_key_matches_node(root_key):
+    derived = keychain.KeyChain(root_key).get(3)
+    node = root_key.subkey(3)
+    assert derived.index == 3
+    assert derived.node is None
+    assert derived.address == node.p2sh_p2wpkh_address()
+    assert derived.scripthash == node.electrumx_script_hash()
+
+def test_derived_key_bech32(root_key):
+    derived = keychain.KeyChain(root_key, bech32=True).get(0)
+    node = root_key.subkey(0)
+    assert derived.address == node.bech32_p2wpkh_address()
+    assert derived.scripthash == node.electrumx_script_hash(bech32=True)
+
+def test_keychain_memoizes(root_key):
+    chain = keychain.KeyChain(root_key)
+    assert chain.get(5) is chain.get(5)
+    assert 5 in chain
+    assert len(chain) == 1
+
+def test_keychain_max_size(root_key):
+    chain = keychain.KeyChain(root_key, max_size=2)
+    chain.get(0)
+    chain.get(1)
+    chain.get(0)
+    chain.get(2)
+    assert len(chain) == 2
+    assert 0 in chain
+    assert 1 not in chain
+
+def test_keychain_reverse_index(root_key):
+    chain = keychain.KeyChain(root_key, max_size=1)
+    first = chain.get(0)
+    chain.get(1)
+    assert chain.find(first.scripthash) == 0
+    assert chain.find(first.address) == 0
+    assert chain.find(first.script) == 0
+    assert chain.find("unknown") is None
+
+@pytest.mark.parametrize("backend", list(keychain.EC_BACKENDS))
+def test_keychain_derive_range(root_key, backend):
+    chain = keychain.KeyChain(root_key, ec_backend=backend)
+    chain.get(2)
+    window = chain.derive_range(0, 5)
+    assert [derived.index for derived in window] == list(range(5))
+    for i, derived in enumerate(window):
+        node = root_key.subkey(i)
+        assert derived.address == node.p2sh_p2wpkh_address()
+        assert derived.scripthash == node.electrumx_script_hash()
+        assert chain.get_node(i).hwif() == node.hwif()
+
+def test_keychain_public_root(root_key):
+    private_chain = keychain.KeyChain(root_key, bech32=True)
+    public_chain = keychain.KeyChain(root_key.public_copy(), bech32=True)
+    assert public_chain.get(9).address == private_chain.get(9).address
+    assert not public_chain.get_node(9).is_private()
+
+def test_keychain_derive_range_max_size(root_key):
+    chain = keychain.KeyChain(root_key, max_size=2)
+    assert len(chain.derive_range(0, 4)) == 4
+    assert len(chain) == 2
+
+@pytest.mark.parametrize("bech32", [False, True])
+def test_keychain_load_compact(root_key, bech32):
+    expected = keychain.KeyChain(root_key, bech32=bech32).derive_range(10, 4)
+    compact = keychain.derive_compact(
+        root_key.sec(), root_key.chain_code(), root_key.netcode(), bech32, 10, 4)
+    chain = keychain.KeyChain(root_key, bech32=bech32)
+    chain.load_compact(10, compact)
+    for derived in expected:
+        loaded = chain.get(derived.index)
+        assert loaded.address == derived.address
+        assert loaded.script == derived.script
+        assert loaded.scripthash == derived.scripthash
+        assert chain.find(derived.scripthash) == derived.index
+    assert chain.get_node(12).hwif() == root_key.subkey(12).hwif()
+
+@pytest.mark.asyncio
+async def test_keychain_derive_parallel(event_loop, root_key):
+    chain = keychain.KeyChain(root_key)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        await chain.derive_parallel(0, 25, event_loop, executor, chunk_size=10)
+    assert len(chain) == 25
+    assert chain.get(24).address == root_key.subkey(24).p2sh_p2wpkh_address()
+
+def test_keychain_reverse_index_is_compact(root_key):
+    chain = keychain.KeyChain(root_key, max_size=2)
+    window = chain.derive_range(0, 10)
+    assert len(chain) == 2
+    assert len(chain._indexes) == 10
+    assert chain.find(window[0].address) == 0
+    assert chain.find("not an address") is None
+
+def test_keychain_reads_while_deriving(root_key, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    def slow_child_secs(parent_sec, tweaks):
+        started.set()
+        release.wait(5)
+        return keychain._pycoin_child_secs(parent_sec, tweaks)
+    monkeypatch.setitem(keychain.EC_BACKENDS, "slow", slow_child_secs)
+    chain = keychain.KeyChain(root_key)
+    first = chain.get(0)
+    chain.ec_backend = "slow"
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        deriving = executor.submit(chain.derive_range, 1, 5)
+        assert started.wait(5)
+        # The lock isn't held while the slow backend runs
+        assert chain.get(0) is first
+        release.set()
+        assert [derived.index for derived in deriving.result()] == [1, 2, 3, 4, 5]
+    assert chain.find(chain.get(5).scripthash) == 5
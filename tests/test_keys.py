@@ -1,6 +1,14 @@
+import concurrent.futures
 import pytest
 from nowallet import keys
 
+SALT = "test"
+PASSPHRASE = "CORRECT HORSE BATTERY STAPLE"
+SECRET_EXP = int("35645493381215587888643547950114523511" +
+                 "569659408346598921044976623615331125007")
+CHAIN_CODE = (b"^I\xa3k\xf3jO\xd3%\xd3\x81\x98\xf9\x1f\xb4" +
+              b"\x01:\xd4T\x14\xdc\r\xe6\x16Pn9\x9f\x16kRW")
+
 def test_and_split():
     bytes_ = b"\xff\xff\xff\xff"
     b1, b2 = keys.and_split(bytes_)
@@ -31,3 +39,39 @@ def test_derive_keys():
     assert isinstance(derived_code, bytes)
     assert derived_exp == secret_exp
     assert derived_code == chain_code
+
+def test_derive_keys_parallel():
+    derived = keys.derive_key(SALT, PASSPHRASE, parallel=True)
+    assert derived == (SECRET_EXP, CHAIN_CODE)
+
+def test_derive_keys_not_hd():
+    serial = keys.derive_key(SALT, PASSPHRASE, hd=False)
+    parallel = keys.derive_key(SALT, PASSPHRASE, hd=False, parallel=True)
+    assert isinstance(serial, int)
+    assert serial == parallel
+
+@pytest.mark.asyncio
+async def test_derive_keys_async(event_loop):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        derived = await keys.derive_key_async(
+            SALT, PASSPHRASE, event_loop, executor)
+    assert derived == (SECRET_EXP, CHAIN_CODE)
+
+SCRYPT_HALF = bytes.fromhex(
+    "df61e155fb184f6b113c612e4d5d2acf30edfaaf115567b5a824497f595f4a82" +
+    "2db48680b413b59edac9a0a82663c7281d19364c098fa3452d2c427313a2f5fa")
+PBKDF2_HALF = bytes.fromhex(
+    "91af43350b453786bb8c76faecd53e5a021ad23a9329a2c98676423416be8d8d" +
+    "73fd25eb4779fa4dff1a2130df7c732927cd6258d58245537d427bec05c9a7ad")
+
+@pytest.mark.parametrize("backend", list(keys.SCRYPT_BACKENDS))
+def test_scrypt_backends(backend):
+    assert keys._scrypt_half(SALT, PASSPHRASE, 64, backend) == SCRYPT_HALF
+
+@pytest.mark.parametrize("backend", list(keys.PBKDF2_BACKENDS))
+def test_pbkdf2_backends(backend):
+    assert keys._pbkdf2_half(SALT, PASSPHRASE, 64, backend) == PBKDF2_HALF
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        keys.derive_key(SALT, PASSPHRASE, scrypt_backend="md5")
@@ -1,6 +1,12 @@
+import asyncio
+import hashlib
 import decimal
 import pytest
 import nowallet
+from pycoin.tx.TxIn import TxIn
+from pycoin.tx.TxOut import TxOut
+from pycoin.tx.Spendable import Spendable
+from pycoin.ui import standard_tx_out_script
 
 @pytest.fixture
 def dummy_connection(event_loop):
@@ -28,3 +34,650 @@ def test_get_payable_from_BIP21URI():
     addr, amount = payable
     assert isinstance(addr, str)
     assert isinstance(amount, decimal.Decimal) or amount is None
+
+def test_wallet_key_table(dummy_wallet):
+    dummy_wallet.spend_indicies = [False] * 3
+    key = dummy_wallet.get_key(2, False)
+    assert dummy_wallet.get_key(2, False) is key
+    assert dummy_wallet.get_all_known_addresses(addr=True)[2] == \
+        key.p2sh_p2wpkh_address()
+    dummy_wallet.bech32 = True
+    assert dummy_wallet.get_all_known_addresses(addr=True)[2] == \
+        key.bech32_p2wpkh_address()
+
+def test_wallet_lookup(dummy_wallet):
+    dummy_wallet.spend_indicies = [True, False]
+    dummy_wallet.change_indicies = [False]
+    spend_addr = dummy_wallet.get_derived_key(0, False).address
+    change_hash = dummy_wallet.get_derived_key(0, True).scripthash
+    assert dummy_wallet.search_for_key(spend_addr) is \
+        dummy_wallet.get_key(0, False)
+    assert dummy_wallet.lookup(spend_addr) == (False, 0)
+    assert dummy_wallet.lookup(change_hash) == (True, 0)
+    beyond = dummy_wallet.get_derived_key(5, False).address
+    assert dummy_wallet.lookup(beyond) is None
+
+@pytest.mark.asyncio
+async def test_wallet_create(event_loop, dummy_connection, dummy_wallet):
+    messages = []
+    wallet = await nowallet.Wallet.create(
+        "CORRECT HORSE", "BATTERY STAPLE", event_loop, nowallet.TBTC,
+        connection=dummy_connection, progress=messages.append)
+    assert wallet.connection is dummy_connection
+    assert wallet.ypub == dummy_wallet.ypub
+    assert messages == ["Deriving keys..", "Keys derived"]
+
+@pytest.mark.asyncio
+async def test_wallet_resume(event_loop, tmpdir, dummy_connection, dummy_wallet):
+    cache = nowallet.resume.ResumeCache(str(tmpdir.join("nowallet.resume")),
+                                        secret_path=str(tmpdir.join("secret")))
+    with pytest.raises(ValueError):
+        await nowallet.Wallet.create(
+            "CORRECT HORSE", None, event_loop, nowallet.TBTC,
+            connection=dummy_connection, resume_cache=cache, pin="1234")
+    await nowallet.Wallet.create(
+        "CORRECT HORSE", "BATTERY STAPLE", event_loop, nowallet.TBTC,
+        connection=dummy_connection, resume_cache=cache, pin="1234")
+    wallet = await nowallet.Wallet.create(
+        "CORRECT HORSE", None, event_loop, nowallet.TBTC,
+        connection=dummy_connection, resume_cache=cache, pin="1234")
+    assert wallet.ypub == dummy_wallet.ypub
+    assert wallet.get_derived_key(0, True).address == \
+        dummy_wallet.get_derived_key(0, True).address
+
+def test_wallet_from_xpub(event_loop, dummy_connection, dummy_wallet):
+    wallet = nowallet.Wallet.from_xpub(
+        dummy_wallet.ypub, dummy_connection, event_loop, nowallet.TBTC)
+    assert wallet.watch_only
+    assert not dummy_wallet.watch_only
+    assert wallet.get_derived_key(7, True).scripthash == \
+        dummy_wallet.get_derived_key(7, True).scripthash
+    with pytest.raises(ValueError):
+        event_loop.run_until_complete(
+            wallet.spend("address", decimal.Decimal("1"), 0.0001))
+    with pytest.raises(ValueError):
+        nowallet.Wallet.from_xpub(dummy_wallet.account_master.hwif(as_private=True),
+                                  dummy_connection, event_loop, nowallet.TBTC)
+    with pytest.raises(ValueError):
+        nowallet.Wallet.from_xpub(dummy_wallet.ypub,
+                                  dummy_connection, event_loop, nowallet.BTC)
+
+@pytest.mark.asyncio
+async def test_wallet_prederive(event_loop, dummy_wallet):
+    dummy_wallet.spend_indicies = [True, False, True, False]
+    dummy_wallet.lookahead = 5
+    await dummy_wallet.prederive()
+    assert [derived.index for derived in dummy_wallet._ready[False]] == \
+        list(range(1, 8))
+    first = dummy_wallet.get_derived_key(1, False).address
+    assert dummy_wallet.get_next_unused_address() == first
+    assert dummy_wallet.get_next_unused_address(using=True) == first
+    assert dummy_wallet.spend_indicies == [True, True, True, False]
+    assert dummy_wallet.get_next_unused_key().p2sh_p2wpkh_address() == \
+        dummy_wallet.get_derived_key(3, False).address
+    await dummy_wallet.prederive()
+    assert dummy_wallet._ready[False][-1].index == 7
+
+class FakeConnection:
+    def __init__(self, event_loop, fail=False):
+        self.fail = fail
+        self.alive = True
+        self.calls = []
+        self.release = asyncio.Event(loop=event_loop)
+
+    async def do_connect(self):
+        if self.fail:
+            raise ConnectionError("unreachable")
+
+    async def listen_rpc(self, method, args, priority=None):
+        self.calls.append(method)
+        await self.release.wait()
+        return method
+
+    max_batch_size = 2
+
+    async def batch_rpc(self, requests, priority=None):
+        self.calls.extend(method for method, _ in requests)
+        return [method for method, _ in requests]
+
+@pytest.mark.asyncio
+async def test_connection_pool(event_loop):
+    conns = [FakeConnection(event_loop), FakeConnection(event_loop),
+             FakeConnection(event_loop, fail=True)]
+    pool = nowallet.ConnectionPool(conns)
+    await pool.do_connect()
+    assert pool.connections == conns[:2]
+
+    get_history = nowallet.Wallet.methods["get_history"]
+    futures = [asyncio.ensure_future(pool.listen_rpc(get_history, [i]), loop=event_loop)
+               for i in range(4)]
+    futures.append(asyncio.ensure_future(
+        pool.listen_rpc(nowallet.Wallet.methods["broadcast"], []), loop=event_loop))
+    for _ in range(3):
+        await asyncio.sleep(0, loop=event_loop)
+    assert conns[0].calls.count(get_history) == 2
+    assert conns[1].calls == [get_history] * 2
+    assert nowallet.Wallet.methods["broadcast"] in conns[0].calls
+    for conn in conns:
+        conn.release.set()
+    await asyncio.gather(*futures, loop=event_loop)
+    assert all(count == 0 for count in pool.outstanding.values())
+
+@pytest.mark.asyncio
+async def test_connection_pool_batch_rpc(event_loop):
+    conns = [FakeConnection(event_loop), FakeConnection(event_loop)]
+    pool = nowallet.ConnectionPool(conns)
+    get_history = nowallet.Wallet.methods["get_history"]
+    broadcast = nowallet.Wallet.methods["broadcast"]
+    requests = [(get_history, [])] * 2 + [(broadcast, [])] + [(get_history, [])] * 2
+    results = await pool.batch_rpc(requests)
+    assert results == [method for method, _ in requests]
+    assert sorted(conns[0].calls) == sorted([broadcast, get_history, get_history])
+    assert conns[1].calls == [get_history] * 2
+
+class FakeClient:
+    def __init__(self, event_loop):
+        self.loop = event_loop
+        self.batches = []
+        self.subscribed = []
+
+    def _done(self, result):
+        future = self.loop.create_future()
+        future.set_result(result)
+        return future
+
+    def batch_rpc(self, requests):
+        self.batches.append(requests)
+        return self._done([params[0] for _, *params in requests])
+
+    def subscribe(self, method, *params):
+        self.subscribed.append(params[0])
+        return self._done(params[0]), asyncio.Queue(loop=self.loop)
+
+@pytest.mark.asyncio
+async def test_connection_batch_rpc(event_loop, dummy_connection):
+    dummy_connection.client = FakeClient(event_loop)
+    dummy_connection.max_batch_size = 2
+    subscribe = nowallet.Wallet.methods["subscribe"]
+    results = await dummy_connection.batch_rpc(
+        [(subscribe, [str(i)]) for i in range(5)])
+    assert results == ["0", "1", "2", "3", "4"]
+    assert dummy_connection.client.subscribed == ["0"]
+    assert dummy_connection.queue is not None
+    assert [len(batch) for batch in dummy_connection.client.batches] == [2, 2]
+
+    results = await dummy_connection.batch_rpc(
+        [(subscribe, [str(i)]) for i in range(3)])
+    assert results == ["0", "1", "2"]
+    assert dummy_connection.client.subscribed == ["0"]
+
+@pytest.mark.asyncio
+async def test_request_coalescing(event_loop):
+    conn = FakeConnection(event_loop)
+    pool = nowallet.ConnectionPool([conn])
+    get_history = nowallet.Wallet.methods["get_history"]
+    futures = [asyncio.ensure_future(pool.listen_rpc(get_history, ["a"]), loop=event_loop)
+               for _ in range(3)]
+    futures.append(asyncio.ensure_future(
+        pool.listen_rpc(get_history, ["b"]), loop=event_loop))
+    for _ in range(3):
+        await asyncio.sleep(0, loop=event_loop)
+    conn.release.set()
+    assert await asyncio.gather(*futures, loop=event_loop) == [get_history] * 4
+    assert conn.calls == [get_history] * 2
+    assert pool.coalescer.requests == 2
+    assert pool.coalescer.coalesced == 2
+    assert pool.coalescer.hit_rate == 0.5
+    await pool.listen_rpc(get_history, ["a"])
+    assert pool.coalescer.requests == 3
+
+@pytest.mark.asyncio
+async def test_request_scheduler(event_loop):
+    scheduler = nowallet.RequestScheduler(1, event_loop)
+    release = asyncio.Event(loop=event_loop)
+    order = []
+
+    async def request(name):
+        order.append(name)
+        await release.wait()
+
+    first = asyncio.ensure_future(scheduler.run(
+        nowallet.PRIORITY_BACKGROUND, lambda: request("sync")), loop=event_loop)
+    await asyncio.sleep(0, loop=event_loop)
+    waiting = [asyncio.ensure_future(scheduler.run(priority, lambda name=name: request(name)),
+                                     loop=event_loop)
+               for name, priority in [("sync2", nowallet.PRIORITY_BACKGROUND),
+                                      ("broadcast", nowallet.PRIORITY_BROADCAST),
+                                      ("fee", nowallet.PRIORITY_INTERACTIVE)]]
+    await asyncio.sleep(0, loop=event_loop)
+    assert scheduler.active == 1
+    assert scheduler.queued == 3
+    release.set()
+    await asyncio.gather(first, *waiting, loop=event_loop)
+    assert order == ["sync", "fee", "broadcast", "sync2"]
+    assert scheduler.active == 0
+
+def test_connection_priority_for():
+    methods = nowallet.Wallet.methods
+    assert nowallet.Connection.priority_for([methods["get_history"]]) == \
+        nowallet.PRIORITY_BACKGROUND
+    assert nowallet.Connection.priority_for(
+        [methods["get_history"], methods["broadcast"]]) == nowallet.PRIORITY_BROADCAST
+    assert nowallet.Connection.priority_for([methods["estimatefee"]]) == \
+        nowallet.PRIORITY_INTERACTIVE
+
+class FakeServer:
+    max_batch_size = 50
+
+    def __init__(self, event_loop, statuses):
+        self.loop = event_loop
+        self.statuses = statuses
+        self.alive = True
+        self.lost = asyncio.Event(loop=event_loop)
+        self.queue = None
+
+    async def monitor(self):
+        await self.lost.wait()
+
+    def listen_subscribe(self, method, args):
+        self.queue = self.queue or asyncio.Queue(loop=self.loop)
+        future = self.loop.create_future()
+        future.set_result(self.statuses[args[0]])
+        return future
+
+    async def batch_rpc(self, requests, priority=None):
+        self.queue = self.queue or asyncio.Queue(loop=self.loop)
+        return [self.statuses[args[0]] for _, args in requests]
+
+@pytest.mark.asyncio
+async def test_connection_pool_failover(event_loop):
+    subscribe = nowallet.Wallet.methods["subscribe"]
+    first = FakeServer(event_loop, {"a": "1", "b": "2"})
+    second = FakeServer(event_loop, {"a": "1", "b": "2"})
+    pool = nowallet.ConnectionPool([first, second], event_loop)
+    assert await pool.batch_rpc(
+        [(subscribe, ["a"]), (subscribe, ["b"])]) == ["1", "2"]
+
+    await first.queue.put(["a", "3"])
+    assert await asyncio.wait_for(pool.queue.get(), 1, loop=event_loop) == ["a", "3"]
+    assert pool.subscriptions[(subscribe, ("a",))] == "3"
+
+    second.statuses = {"a": "3", "b": "4"}
+    monitor = asyncio.ensure_future(pool.monitor(), loop=event_loop)
+    first.alive = False
+    first.lost.set()
+    assert await asyncio.wait_for(pool.queue.get(), 1, loop=event_loop) == ["b", "4"]
+    assert pool.primary is second
+    assert pool.queue.empty()
+    monitor.cancel()
+
+class FakeCandidate:
+    def __init__(self, event_loop, server, delay, height, fail=False):
+        self.loop = event_loop
+        self.server, self.port, self.proto = server, 50001, "t"
+        self.server_info_list = [server, 50001, "t"]
+        self.delay = delay
+        self.height = height
+        self.fail = fail
+        self.closed = False
+        self.client = type("Client", (), {"subscriptions": {}})()
+
+    async def do_connect(self):
+        await asyncio.sleep(self.delay, loop=self.loop)
+        if self.fail:
+            raise ConnectionError("unreachable")
+
+    def subscribe(self, method, args):
+        queue = asyncio.Queue(loop=self.loop)
+        self.client.subscriptions.setdefault(method, []).append(queue)
+        future = self.loop.create_future()
+        future.set_result({"height": self.height})
+        return future, queue
+
+    def close(self):
+        self.closed = True
+
+@pytest.mark.asyncio
+async def test_select_servers(event_loop, tmpdir):
+    scores = nowallet.servers.ServerScores(str(tmpdir.join("scores.json")))
+    fast = FakeCandidate(event_loop, "fast", 0, 100)
+    lagging = FakeCandidate(event_loop, "lagging", 0, 98)
+    slow = FakeCandidate(event_loop, "slow", 0.05, 100)
+    broken = FakeCandidate(event_loop, "broken", 0, 100, fail=True)
+    stuck = FakeCandidate(event_loop, "stuck", 10, 100)
+    # Three answers are enough, so the stuck probe doesn't hold us up
+    selecting = nowallet.select_servers(
+        [stuck, lagging, broken, slow, fast], 3, scores, event_loop, budget=5)
+    chosen = await asyncio.wait_for(selecting, 1, loop=event_loop)
+    assert chosen == [fast, slow, lagging]
+    assert stuck.closed and not fast.closed
+    assert fast.client.subscriptions["blockchain.headers.subscribe"] == []
+
+    reloaded = nowallet.servers.ServerScores(scores.path)
+    infos = [conn.server_info_list for conn in (stuck, lagging, broken, slow, fast)]
+    assert [info[0] for info in reloaded.rank(infos)] == \
+        ["fast", "slow", "stuck", "lagging", "broken"]
+
+@pytest.mark.asyncio
+async def test_select_servers_timeout(event_loop):
+    scores = nowallet.servers.ServerScores()
+    stuck = [FakeCandidate(event_loop, "stuck", 10, 100),
+             FakeCandidate(event_loop, "broken", 0, 100, fail=True)]
+    with pytest.raises(ConnectionError):
+        await asyncio.wait_for(nowallet.select_servers(
+            stuck, 1, scores, event_loop, budget=0.01, timeout=0.05), 1, loop=event_loop)
+    assert stuck[0].closed
+
+@pytest.mark.asyncio
+async def test_subscription_router(event_loop):
+    handled = []
+    gates = {"a": asyncio.Event(loop=event_loop), "b": asyncio.Event(loop=event_loop)}
+
+    async def handler(result):
+        handled.append(result)
+        await gates[result[0]].wait()
+
+    async def settle():
+        for _ in range(5):
+            await asyncio.sleep(0, loop=event_loop)
+
+    router = nowallet.SubscriptionRouter(handler, event_loop, workers=2)
+    task = asyncio.ensure_future(router.run(), loop=event_loop)
+    await router.put(["a", "1"])
+    await router.put(["b", "1"])
+    await settle()
+    assert handled == [["a", "1"], ["b", "1"]]
+
+    for status in ("2", "3", "4"):
+        await router.put(["a", status])
+    await settle()
+    assert len(handled) == 2
+    gates["a"].set()
+    for _ in range(3):
+        await settle()
+    assert handled[2:] == [["a", "4"]]
+    assert router.collapsed == 2
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+def test_electrum_status():
+    assert nowallet.Wallet.electrum_status([]) is None
+    history = [("a" * 64, 100), ("b" * 64, 0)]
+    expected = hashlib.sha256(
+        "{}:100:{}:0:".format("a" * 64, "b" * 64).encode()).hexdigest()
+    assert nowallet.Wallet.electrum_status(history) == expected
+
+@pytest.mark.asyncio
+async def test_dispatch_skips_unchanged_status(event_loop, dummy_wallet):
+    dummy_wallet.connection = FakeConnection(event_loop)
+    scripthash = dummy_wallet.get_derived_key(0, False).scripthash
+    await dummy_wallet._dispatch_result([scripthash, "unknown"])
+    assert scripthash not in dummy_wallet.statuses
+    dummy_wallet.spend_indicies = [True]
+    dummy_wallet._record_history(
+        scripthash, [{"tx_hash": "a" * 64, "height": 100}], None)
+    status = nowallet.Wallet.electrum_status([("a" * 64, 100)])
+    await dummy_wallet._dispatch_result([scripthash, status])
+    assert dummy_wallet.connection.calls == []
+    assert dummy_wallet.statuses[scripthash] == status
+    assert not dummy_wallet.new_history
+
+    # A status the server sent before is trusted without rehashing
+    dummy_wallet.statuses[scripthash] = "opaque"
+    assert dummy_wallet.status_matches(scripthash, "opaque")
+    assert not dummy_wallet.status_matches(scripthash, "other")
+
+class LostServer:
+    def __init__(self, event_loop):
+        self.loop = event_loop
+        self.queue = asyncio.Queue(loop=event_loop)
+
+    async def consume_queue(self, callback):
+        await asyncio.Event(loop=self.loop).wait()
+
+    def subscribe(self, method, args):
+        return self.loop.create_future(), self.queue
+
+    async def monitor(self):
+        await asyncio.sleep(0, loop=self.loop)
+
+@pytest.mark.asyncio
+async def test_listen_to_addresses_raises_when_lost(event_loop, dummy_wallet):
+    dummy_wallet.connection = LostServer(event_loop)
+    tasks = asyncio.Task.all_tasks(loop=event_loop)
+    with pytest.raises(ConnectionError):
+        await dummy_wallet.listen_to_addresses()
+    for _ in range(5):
+        await asyncio.sleep(0, loop=event_loop)
+    current = asyncio.Task.current_task(loop=event_loop)
+    assert all(task.done() for task in asyncio.Task.all_tasks(loop=event_loop)
+               if task not in tasks and task is not current)
+
+class HistoryServer:
+    def __init__(self, txs):
+        self.txs = txs
+        self.balance = 0
+        self.calls = []
+
+    async def listen_rpc(self, method, args, priority=None):
+        self.calls.append((method, args[0]))
+        assert method == nowallet.Wallet.methods["get_balance"]
+        return {"confirmed": 0, "unconfirmed": self.balance}
+
+    async def batch_rpc(self, requests, priority=None):
+        self.calls.extend((method, args[0]) for method, args in requests)
+        return [self.txs[args[0]].as_hex() for _, args in requests]
+
+@pytest.mark.asyncio
+async def test_get_history_rejects_wrong_tx(event_loop, dummy_wallet):
+    tx = nowallet.Tx(1, [TxIn(bytes(32), 0)], [TxOut(1000, b"\x51")])
+    other = "ab" * 32
+    dummy_wallet.connection = HistoryServer({other: tx, "../x": tx})
+    with pytest.raises(ConnectionError):
+        await dummy_wallet._get_history([other], {other: 100})
+    with pytest.raises(ConnectionError):
+        await dummy_wallet._get_history(["../x"])
+    assert other not in dummy_wallet.tx_cache
+    assert dummy_wallet.connection.calls == [(nowallet.Wallet.methods["get"], other)]
+
+@pytest.mark.asyncio
+async def test_interpret_new_history_diff(event_loop, dummy_wallet):
+    derived = dummy_wallet.get_derived_key(0, False)
+    dummy_wallet.spend_indicies = [False]
+    txs = {}
+    for i in range(2):
+        tx = nowallet.Tx(1, [TxIn(bytes([i]) * 32, 0)],
+                         [TxOut(1000, standard_tx_out_script(derived.address))])
+        txs[tx.id()] = tx
+    first, second = list(txs)
+    dummy_wallet.connection = HistoryServer(txs)
+    dummy_wallet.header_cache._headers[100] = bytes(80)
+    get = nowallet.Wallet.methods["get"]
+
+    dummy_wallet.connection.balance = 1000
+    history = [{"tx_hash": first, "height": 0}]
+    assert not await dummy_wallet._interpret_new_history(derived.scripthash, history)
+    dummy_wallet._record_history(derived.scripthash, history, None)
+    assert dummy_wallet.spend_indicies == [True]
+    assert dummy_wallet.zeroconf_balance == decimal.Decimal("0.00001")
+
+    assert len(dummy_wallet.utxos) == 1
+
+    dummy_wallet.connection.balance = 2000
+    history = [{"tx_hash": first, "height": 100}, {"tx_hash": second, "height": 0}]
+    assert not await dummy_wallet._interpret_new_history(derived.scripthash, history)
+    dummy_wallet._record_history(derived.scripthash, history, None)
+    assert [txid for method, txid in dummy_wallet.connection.calls
+            if method == get] == [first, second]
+    txns = dummy_wallet.history[0]["txns"]
+    assert [(hist.tx_obj.id(), hist.height) for hist in txns] == \
+        [(first, 100), (second, 0)]
+    assert sorted(utxo.tx_hash for utxo in dummy_wallet.utxos) == \
+        sorted(tx.hash() for tx in txs.values())
+    assert await dummy_wallet._interpret_new_history(derived.scripthash, history)
+
+class EmptyServer:
+    def __init__(self, event_loop, wallet):
+        self.loop = event_loop
+        self.wallet = wallet
+        self.calls = {False: [], True: []}
+        self.change_started = asyncio.Event(loop=event_loop)
+
+    async def batch_rpc(self, requests, priority=None):
+        method, (scripthash,) = requests[0]
+        change = self.wallet.change_keys.find(scripthash) is not None
+        self.calls[change].append((method, scripthash))
+        if change:
+            self.change_started.set()
+        else:
+            # The spend chain can't finish until the change chain has begun
+            await self.change_started.wait()
+        return [None] * len(requests)
+
+@pytest.mark.asyncio
+async def test_discover_all_keys_concurrently(event_loop, dummy_wallet):
+    dummy_wallet.connection = EmptyServer(event_loop, dummy_wallet)
+    await asyncio.wait_for(dummy_wallet.discover_all_keys(), 5, loop=event_loop)
+    gap = nowallet.Wallet._GAP_LIMIT
+    subscribe = nowallet.Wallet.methods["subscribe"]
+    for change in (False, True):
+        assert sorted(call for call in dummy_wallet.connection.calls[change]
+                      if call[0] == subscribe) == sorted(
+                          (subscribe, dummy_wallet.get_derived_key(index, change).scripthash)
+                          for index in (0, gap))
+    assert dummy_wallet.spend_indicies == [False] * gap
+    assert dummy_wallet.change_indicies == [False] * gap
+    assert dummy_wallet.balance == 0
+
+class WindowServer:
+    def __init__(self, event_loop, used):
+        self.loop = event_loop
+        self.used = used
+        self.calls = []
+
+    async def batch_rpc(self, requests, priority=None):
+        self.calls.append([method for method, _ in requests])
+        await asyncio.sleep(0, loop=self.loop)
+        if requests[0][0] != nowallet.Wallet.methods["subscribe"]:
+            return [{"confirmed": 0, "unconfirmed": 0}
+                    if method == nowallet.Wallet.methods["get_balance"] else []
+                    for method, _ in requests]
+        return ["status" if args[0] in self.used else None
+                for _, args in requests]
+
+@pytest.mark.asyncio
+async def test_discover_keys_pipelined(event_loop, dummy_wallet):
+    gap = nowallet.Wallet._GAP_LIMIT
+    used = {dummy_wallet.get_derived_key(index, False).scripthash
+            for index in (3, gap + 5, 3 * gap)}
+    dummy_wallet.connection = WindowServer(event_loop, used)
+    dummy_wallet.scan_ahead = 2
+    await dummy_wallet._discover_keys(change=False)
+    subscribe = nowallet.Wallet.methods["subscribe"]
+    calls = dummy_wallet.connection.calls
+    # Three windows are subscribed before the first history is fetched
+    assert [call[0] == subscribe for call in calls[:4]] == [True] * 3 + [False]
+    assert sum(call[0] == subscribe for call in calls) == 5
+    # Scanning stops at the first empty window, even though index 3 * gap
+    # was used, and the two windows sent past it are unsubscribed
+    assert len(dummy_wallet.spend_indicies) == 3 * gap
+    assert [i for i, is_used in enumerate(dummy_wallet.spend_indicies)
+            if is_used] == [3, gap + 5]
+    assert calls[-1] == [nowallet.Wallet.methods["unsubscribe"]] * 2 * gap
+
+class HangingServer:
+    def __init__(self, event_loop):
+        self.loop = event_loop
+        self.unsubscribed = []
+
+    async def batch_rpc(self, requests, priority=None):
+        if requests[0][0] == nowallet.Wallet.methods["unsubscribe"]:
+            self.unsubscribed.extend(args[0] for _, args in requests)
+            return [True] * len(requests)
+        await asyncio.Event(loop=self.loop).wait()
+
+@pytest.mark.asyncio
+async def test_discover_keys_cancelled(event_loop, dummy_wallet):
+    gap = nowallet.Wallet._GAP_LIMIT
+    dummy_wallet.connection = HangingServer(event_loop)
+    task = asyncio.ensure_future(dummy_wallet._discover_keys(), loop=event_loop)
+    await asyncio.sleep(0, loop=event_loop)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    for _ in range(3):
+        await asyncio.sleep(0, loop=event_loop)
+    # The window being waited on is unsubscribed along with the one ahead
+    assert dummy_wallet.connection.unsubscribed == [
+        dummy_wallet.get_derived_key(index, False).scripthash
+        for index in range(2 * gap)]
+
+def test_utxos_from_history(dummy_wallet):
+    derived = dummy_wallet.get_derived_key(0, False)
+    ours = standard_tx_out_script(derived.address)
+    theirs = standard_tx_out_script(dummy_wallet.get_derived_key(1, False).address)
+    funding = nowallet.Tx(1, [TxIn(bytes(32), 0)],
+                          [TxOut(1000, ours), TxOut(2000, ours), TxOut(3000, theirs)])
+    spending = nowallet.Tx(1, [TxIn(funding.hash(), 0)], [TxOut(900, theirs)])
+    utxos = nowallet.Wallet._utxos_from_history(derived, [spending, funding])
+    assert [(utxo.tx_hash, utxo.tx_out_index, utxo.coin_value) for utxo in utxos] == \
+        [(funding.hash(), 1, 2000)]
+
+def test_mktx_selects_from_utxo_set(dummy_wallet):
+    derived = dummy_wallet.get_derived_key(0, False)
+    script = standard_tx_out_script(derived.address)
+    dummy_wallet.spend_indicies = [True]
+    for n, value in enumerate((50000, 200000, 120000)):
+        dummy_wallet.utxos.add(Spendable(value, script, bytes([n]) * 32, 0))
+    tx, in_addrs, _ = dummy_wallet._mktx(
+        dummy_wallet.get_derived_key(1, False).address,
+        decimal.Decimal("0.001"), is_high_fee=False)
+    assert in_addrs == {derived.address}
+    assert len(tx.txs_in) == 1
+    assert [utxo.coin_value for utxo in dummy_wallet.utxos.spent()] == [200000]
+    assert sorted(utxo.coin_value for utxo in dummy_wallet.utxos) == [50000, 120000]
+
+@pytest.mark.asyncio
+async def test_failed_spend_unspends_utxos(event_loop, dummy_wallet):
+    derived = dummy_wallet.get_derived_key(0, False)
+    script = standard_tx_out_script(derived.address)
+    dummy_wallet.spend_indicies = [True]
+    dummy_wallet.utxos.add(Spendable(200000, script, bytes(32), 0))
+    dummy_wallet.balance = decimal.Decimal("0.0005")
+    with pytest.raises(Exception, match="Insufficient funds"):
+        await dummy_wallet.spend(dummy_wallet.get_derived_key(1, False).address,
+                                 decimal.Decimal("0.001"), 0.0001)
+    assert dummy_wallet.utxos.spent() == []
+    assert [utxo.coin_value for utxo in dummy_wallet.utxos] == [200000]
+
+class FlakySubscriber:
+    def __init__(self, event_loop):
+        self.loop = event_loop
+        self.calls = 0
+
+    def listen_subscribe(self, method, args):
+        self.calls += 1
+        future = self.loop.create_future()
+        if self.calls == 1:
+            future.set_exception(ConnectionError("dropped"))
+        else:
+            future.set_result("status")
+        return future
+
+@pytest.mark.asyncio
+async def test_next_unused_resubscribes(event_loop, dummy_wallet, monkeypatch):
+    monkeypatch.setattr(nowallet.Wallet, "_RESUBSCRIBE_DELAY", 0)
+    dummy_wallet.connection = FlakySubscriber(event_loop)
+    dispatched = []
+    async def put(result):
+        dispatched.append(result)
+    dummy_wallet.router.put = put
+    derived = dummy_wallet._next_unused(False, using=True)
+    for _ in range(5):
+        await asyncio.sleep(0, loop=event_loop)
+    assert dummy_wallet.connection.calls == 2
+    assert dispatched == [[derived.scripthash, "status"]]
+    assert not dummy_wallet._watching
+    for task in dummy_wallet._prederiving.values():
+        await task
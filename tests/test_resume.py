@@ -0,0 +1,72 @@
+import os
+import time
+import pytest
+
+from nowallet import resume
+
+HWIF = ("tprv8ZgxMBicQKsPd1B7vcMAc9rnTogPPdnmDD7LAH1atFiDwPcWgthJyXkmDRi6" +
+        "EVy5T5qvdmYTnYtK8gX4wfF6PsMYYaN1jVaBTxDr8z2T8Lf")
+IDENTITY = "CORRECT HORSE:XTN:49"
+
+@pytest.fixture
+def cache(tmpdir):
+    return resume.ResumeCache(str(tmpdir.join("nowallet.resume")),
+                              secret_path=str(tmpdir.join("secret")))
+
+def test_resume_roundtrip(cache):
+    assert cache.load("1234", IDENTITY) is None
+    cache.save(HWIF, "1234", IDENTITY)
+    assert cache.load("1234", IDENTITY) == HWIF
+    assert cache.load("1234", "SOMEONE ELSE:XTN:49") is None
+
+def test_resume_bad_pin(cache):
+    cache.save(HWIF, "1234", IDENTITY)
+    with pytest.raises(ValueError):
+        cache.load("4321", IDENTITY)
+    with pytest.raises(ValueError):
+        cache.save(HWIF, "", IDENTITY)
+
+def test_resume_attempt_limit(cache):
+    cache.save(HWIF, "1234", IDENTITY)
+    for _ in range(resume.ResumeCache.MAX_ATTEMPTS - 1):
+        with pytest.raises(ValueError):
+            cache.load("4321", IDENTITY)
+    assert cache.load("1234", IDENTITY) == HWIF
+    for _ in range(resume.ResumeCache.MAX_ATTEMPTS):
+        with pytest.raises(ValueError):
+            cache.load("4321", IDENTITY)
+    assert not os.path.exists(cache.path)
+
+def test_resume_malformed_entry(cache):
+    with open(cache.path, "w") as outfile:
+        outfile.write('{"version": %d}' % resume.ResumeCache.VERSION)
+    assert cache.load("1234", IDENTITY) is None
+    assert not os.path.exists(cache.path)
+
+def test_resume_expiry(cache):
+    cache.ttl = -1
+    cache.save(HWIF, "1234", IDENTITY)
+    assert cache.load("1234", IDENTITY) is None
+    assert not os.path.exists(cache.path)
+
+def test_resume_wipe(cache):
+    cache.save(HWIF, "1234", IDENTITY)
+    cache.wipe()
+    assert not os.path.exists(cache.path)
+    assert cache.load("1234", IDENTITY) is None
+
+def test_resume_needs_secret(cache):
+    cache.save(HWIF, "1234", IDENTITY)
+    assert os.path.exists(cache.secret_path)
+    os.remove(cache.secret_path)
+    assert cache.load("1234", IDENTITY) is None
+    assert not os.path.exists(cache.path)
+
+def test_resume_purge(cache):
+    cache.save(HWIF, "1234", IDENTITY)
+    cache.purge()
+    assert os.path.exists(cache.path)
+    cache.ttl = -1
+    cache.save(HWIF, "1234", IDENTITY)
+    cache.purge()
+    assert not os.path.exists(cache.path)
@@ -0,0 +1,41 @@
+from nowallet.servers import ServerScores
+
+SERVER = ["electrum.example.com", 50002, "s"]
+OTHER = ["other.example.com", 50001, "t"]
+
+def test_server_scores_prior():
+    scores = ServerScores()
+    assert SERVER not in scores
+    assert scores.score(SERVER) == ServerScores.PRIOR
+
+def test_server_scores_blend():
+    scores = ServerScores()
+    scores.record(SERVER, 1.0, now=0)
+    assert scores.score(SERVER, now=0) == 1.0
+    scores.record(SERVER, 3.0, now=0)
+    assert scores.score(SERVER, now=0) == 2.0
+
+def test_server_scores_decay():
+    scores = ServerScores()
+    scores.record(SERVER, 1.0, now=0)
+    scores.record_failure(OTHER, now=0)
+    later = ServerScores.HALF_LIFE
+    assert scores.score(SERVER, now=later) == \
+        ServerScores.PRIOR - (ServerScores.PRIOR - 1.0) / 2
+    assert scores.score(OTHER, now=later) == \
+        ServerScores.PRIOR + (ServerScores.FAILURE_COST - ServerScores.PRIOR) / 2
+
+def test_server_scores_rank_and_save(tmpdir):
+    path = str(tmpdir.join("scores.json"))
+    scores = ServerScores(path)
+    scores.record(SERVER, 1.0)
+    scores.record_failure(OTHER)
+    scores.save()
+    unknown = ["unknown.example.com", 50001, "t"]
+    assert ServerScores(path).rank([OTHER, unknown, SERVER]) == \
+        [SERVER, unknown, OTHER]
+
+def test_server_scores_unreadable(tmpdir):
+    path = tmpdir.join("scores.json")
+    path.write("not json")
+    assert len(ServerScores(str(path))) == 0
@@ -0,0 +1,82 @@
+import pytest
+
+from pycoin.tx.Tx import Tx
+from pycoin.tx.TxIn import TxIn
+from pycoin.tx.TxOut import TxOut
+
+from nowallet import txcache
+
+def make_tx(value):
+    tx = Tx(1, [TxIn(b"\0" * 32, 0)], [TxOut(value, b"\x51")])
+    return tx.id(), tx.as_bin()
+
+def test_txcache_lazy_parse():
+    cache = txcache.TxCache()
+    txid, raw = make_tx(1000)
+    cache.put(txid, raw)
+    assert cache.get_raw(txid) == raw
+    tx = cache.get(txid)
+    assert tx.id() == txid
+    assert cache.get(txid) is tx
+    assert cache.get("unknown") is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_txcache_memory_bound():
+    first, first_raw = make_tx(1)
+    second, second_raw = make_tx(2)
+    third, third_raw = make_tx(3)
+    cache = txcache.TxCache(max_bytes=2 * len(first_raw))
+    cache.put(first, first_raw)
+    cache.put(second, second_raw)
+    cache.get_raw(first)
+    cache.put(third, third_raw)
+    assert len(cache) == 2
+    assert first in cache
+    assert second not in cache
+
+def test_txcache_disk_tier(tmpdir):
+    path = str(tmpdir.join("txs"))
+    confirmed, confirmed_raw = make_tx(1)
+    pending, pending_raw = make_tx(2)
+    cache = txcache.TxCache(path=path)
+    cache.put(confirmed, confirmed_raw, confirmed=True)
+    cache.put(pending, pending_raw)
+
+    reopened = txcache.TxCache(path=path)
+    assert reopened.get(confirmed).id() == confirmed
+    assert reopened.get(pending) is None
+
+    tmpdir.join("txs", pending).write_binary(confirmed_raw)
+    assert reopened.get(pending) is None
+    assert not tmpdir.join("txs", pending).exists()
+
+def test_txcache_confirm(tmpdir):
+    path = str(tmpdir.join("txs"))
+    txid, raw = make_tx(1)
+    cache = txcache.TxCache(path=path)
+    cache.put(txid, raw)
+    assert not tmpdir.join("txs", txid).exists()
+    cache.confirm(txid)
+    assert txcache.TxCache(path=path).get(txid).id() == txid
+
+def test_txcache_rejects_bad_txids(tmpdir):
+    cache = txcache.TxCache(path=str(tmpdir.join("txs")))
+    txid, raw = make_tx(1)
+    for bad in ("../" + txid[3:], txid.upper(), txid[:-1]):
+        with pytest.raises(ValueError):
+            cache.put(bad, raw, confirmed=True)
+        assert bad not in cache
+        assert cache.get(bad) is None
+    assert tmpdir.listdir() == [tmpdir.join("txs")]
+    assert tmpdir.join("txs").listdir() == []
+
+def test_txcache_counts_parsed_txs():
+    first, first_raw = make_tx(1)
+    second, second_raw = make_tx(2)
+    cache = txcache.TxCache(max_bytes=(1 + txcache.TxCache.PARSED_COST) * len(first_raw))
+    cache.put(first, first_raw)
+    cache.put(second, second_raw)
+    assert len(cache) == 2
+    assert cache.get(second).id() == second
+    assert len(cache) == 1
+    assert first not in cache
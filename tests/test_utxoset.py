@@ -0,0 +1,82 @@
+import pytest
+
+from pycoin.tx.Spendable import Spendable
+
+from nowallet.utxoset import UtxoSet
+
+SCRIPT = b"\xa9\x14" + bytes(20) + b"\x87"
+OTHER = b"\xa9\x14" + bytes([1]) * 20 + b"\x87"
+
+def utxo(n, value, script=SCRIPT):
+    return Spendable(value, script, bytes([n]) * 32, n % 2)
+
+def test_utxoset_add_and_lookup():
+    utxos = UtxoSet()
+    first = utxo(1, 1000)
+    utxos.add(first)
+    utxos.add(utxo(2, 500), confirmed=False)
+    utxos.add(first)
+    assert len(utxos) == 2
+    assert UtxoSet.outpoint(first) in utxos
+    assert utxos.get(UtxoSet.outpoint(first)) is first
+    assert utxos.state(UtxoSet.outpoint(first)) == UtxoSet.CONFIRMED
+    assert utxos.state((bytes([2]) * 32, 0)) == UtxoSet.PENDING
+    assert utxos.value() == 1500
+
+def test_utxoset_spend():
+    utxos = UtxoSet()
+    first, second = utxo(1, 1000), utxo(2, 500)
+    utxos.add(first)
+    utxos.add(second)
+    utxos.spend(first)
+    assert list(utxos) == [second]
+    assert utxos.spent() == [first]
+    utxos.add(first)
+    assert utxos.state(UtxoSet.outpoint(first)) == UtxoSet.SPENT
+    assert len(utxos) == 1
+    with pytest.raises(KeyError):
+        utxos.spend(utxo(3, 1))
+
+def test_utxoset_by_value():
+    utxos = UtxoSet()
+    for n, value in enumerate((300, 100, 200)):
+        utxos.add(utxo(n, value))
+    assert [u.coin_value for u in utxos.by_value()] == [100, 200, 300]
+    assert [u.coin_value for u in utxos.by_value(reverse=True)] == [300, 200, 100]
+    smallest = next(utxos.by_value())
+    utxos.spend(smallest)
+    assert [u.coin_value for u in utxos.by_value()] == [200, 300]
+    utxos.remove(UtxoSet.outpoint(utxo(0, 300)))
+    assert [u.coin_value for u in utxos.by_value()] == [200]
+    utxos.unspend(smallest)
+    assert [u.coin_value for u in utxos.by_value()] == [100, 200]
+
+def test_utxoset_unspend():
+    utxos = UtxoSet()
+    pending = utxo(1, 1000)
+    utxos.add(pending, confirmed=False)
+    utxos.spend(pending)
+    utxos.add(pending, confirmed=True)
+    assert utxos.state(UtxoSet.outpoint(pending)) == UtxoSet.SPENT
+    utxos.unspend(pending)
+    assert utxos.state(UtxoSet.outpoint(pending)) == UtxoSet.CONFIRMED
+    assert list(utxos) == [pending]
+    assert len(utxos) == 1
+    with pytest.raises(KeyError):
+        utxos.unspend(utxo(3, 1))
+
+def test_utxoset_replace_script():
+    utxos = UtxoSet()
+    gone, spent, kept = utxo(1, 100), utxo(2, 200), utxo(3, 300)
+    other = utxo(4, 400, OTHER)
+    for each in (gone, spent, kept, other):
+        utxos.add(each, confirmed=False)
+    utxos.spend(spent)
+    new = utxo(5, 500)
+    utxos.replace_script(SCRIPT, [(spent, True), (kept, True), (new, False)])
+    assert UtxoSet.outpoint(gone) not in utxos
+    assert utxos.state(UtxoSet.outpoint(spent)) == UtxoSet.SPENT
+    assert utxos.state(UtxoSet.outpoint(kept)) == UtxoSet.CONFIRMED
+    assert sorted(u.coin_value for u in utxos) == [300, 400, 500]
+    utxos.replace_script(SCRIPT, [])
+    assert list(utxos) == [other]